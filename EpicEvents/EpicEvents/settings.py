@@ -49,11 +49,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that the time taken by the others is measured too.
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Before the middlewares that read or change the content of the responses.
+    'api.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # After the authentication, so that only the gestion users can ask for their requests to be profiled.
+    'api.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -137,3 +143,60 @@ STATIC_URL = '/static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'accounts.MyUser'
+
+# The JSON renderer and parser of the API use orjson when it is installed, and the json module otherwise.
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # It counts the permissions denied for the metrics.
+    'EXCEPTION_HANDLER': 'api.views.exception_handler',
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # The responses to the creations made with an Idempotency-Key. They're kept in the database, so that a retry gets
+    # the original response whichever process it reaches. The table is created by `manage.py createcachetable`.
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'api_idempotency_keys',
+        'TIMEOUT': 24 * 3600,
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# The number of threads, and of connections to the database, running the reads of the API in each process served by
+# the ASGI handler of api.asgi. The other requests run one at a time.
+API_READ_THREADS = 8
+
+# Where the background jobs of api.jobs keep the files they're given and the ones they make.
+JOBS_DIR = BASE_DIR / 'jobs'
+
+# The payment reminders are sent by the workers of the background jobs every PAYMENT_REMINDERS_INTERVAL seconds, by
+# email through the SMTP server given in the .env file.
+PAYMENT_REMINDERS_INTERVAL = 3600
+EMAIL_HOST = config.get("email_host", "localhost")
+DEFAULT_FROM_EMAIL = config.get("email_from", "webmaster@localhost")
+
+# The `archive` command archives the contracts and events closed for longer than that, by default.
+ARCHIVE_AFTER_DAYS = 365
+
+# The metrics of api.metrics are served at /api/metrics/, to the gestion users and to the requests with METRICS_TOKEN as
+# a bearer token. When the server runs several processes, they add up their metrics in METRICS_DIR, which must be
+# emptied when the server is deployed again. Otherwise each process only serves its own.
+METRICS_DIR = config.get("metrics_dir")
+METRICS_TOKEN = config.get("metrics_token")
+
+# The requests of the gestion users logged in with `?profile=true` or the header `X-Profile: true` are profiled, as is
+# one in PROFILE_SAMPLE_RATE requests if it isn't 0. Their profiles are listed at /api/profiles/list/, and the calls
+# recorded by cProfile are kept in PROFILES_DIR.
+PROFILE_SAMPLE_RATE = int(config.get("profile_sample_rate", 0))
+PROFILES_DIR = BASE_DIR / 'profiles'
@@ -20,3 +20,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls'), name="api")
 ]
+
+# It counts the permissions denied by the admin for the metrics, the API counts its own.
+handler403 = 'api.views.permission_denied'
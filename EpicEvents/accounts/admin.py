@@ -11,10 +11,18 @@ from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.contrib.auth.models import Group
 from django.core.exceptions import ValidationError
 from django.core.exceptions import PermissionDenied
+from django.http import Http404, QueryDict
+from django.urls import resolve, reverse
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
 
 
 from .models import MyUser
-from api.urls import user_change, user_create, user_list, user_delete
+from api import jobs, services
+from api.models import Job
+
+# Above that number of objects, the admin deletes them with a job in the background rather than in the request.
+BACKGROUND_DELETE_THRESHOLD = 100
 
 module_logger = logging.getLogger(__name__)
 file_handler = logging.FileHandler('debug.log')
@@ -72,10 +80,10 @@ class UserAdmin(BaseUserAdmin):
     search_fields = ('email', 'role')
     ordering = ('email',)
     filter_horizontal = ()
-    api_views = {"create": user_create,
-                 "change": user_change,
-                 "list": user_list,
-                 "delete": user_delete}
+    api_views = {"create": "user_create",
+                 "change": "user_change",
+                 "list": "user_list",
+                 "delete": "user_delete"}
     data_to_log = ["email", "first_name", "last_name", "role"]
     logger = module_logger
 
@@ -126,11 +134,44 @@ admin.site.register(MyUser, UserAdmin)
 admin.site.unregister(Group)
 
 
-def get_context(admin_model, request, object_id, extra_context, status_code):
+def get_api_view(name, user, query_params=None, **kwargs):
+    """Return the viewset of the API behind the URL with the given name, ready to run its action for the user.
+
+    It is found through the URL configuration, so that the admin doesn't need to import the API. The permissions of
+    the viewset are checked, but the request of the admin doesn't go through the whole pipeline of DRF again."""
+    view = resolve(reverse(name, kwargs=kwargs)).func
+    return services.get_view(view.cls, user, view.actions["post"], query_params=query_params, **kwargs)
+
+
+class ArchivedListFilter(admin.SimpleListFilter):
+    """Only list the objects that aren't archived, unless the archived ones are asked for.
+
+    The admin gets every object from the API, with `include_archived`, so that the archived ones can still be opened."""
+    title = 'archive'
+    parameter_name = 'archived'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Archived'), ('all', 'All'))
+
+    def choices(self, changelist):
+        yield {'selected': self.value() is None,
+               'query_string': changelist.get_query_string(remove=[self.parameter_name]), 'display': 'Recent'}
+        for lookup, title in self.lookup_choices:
+            yield {'selected': self.value() == lookup,
+                   'query_string': changelist.get_query_string({self.parameter_name: lookup}), 'display': title}
+
+    def queryset(self, request, queryset):
+        if self.value() == 'all':
+            return queryset
+        return queryset.filter(archived=self.value() == 'yes')
+
+
+def get_context(admin_model, request, object_id, extra_context, status_code, api_errors=None):
     """Create the context required to render the admin template.
 
     It is needed because django's default change_view will perform change on the database, while we want the API to be
-    the only one to do so."""
+    the only one to do so. `api_errors` are the errors the API sent, the ones that aren't about a field, like those
+    raised by the database constraints, are shown on the form."""
     to_field = request.POST.get(TO_FIELD_VAR, request.GET.get(TO_FIELD_VAR))
     if to_field and not admin_model.to_field_allowed(request, to_field):
         raise DisallowedModelAdminToField("The field %s cannot be referenced." % to_field)
@@ -157,6 +198,8 @@ def get_context(admin_model, request, object_id, extra_context, status_code):
     )
 
     form = ModelForm(request.POST, request.FILES, instance=obj)
+    if isinstance(api_errors, dict) and api_errors.get(api_settings.NON_FIELD_ERRORS_KEY):
+        form.add_error(None, [str(message) for message in api_errors[api_settings.NON_FIELD_ERRORS_KEY]])
     formsets, inline_instances = admin_model._create_formsets(request, form.instance, change=not add)
 
     if not add and not admin_model.has_change_permission(request, obj):
@@ -229,25 +272,25 @@ def create_view(admin_model, request, allowed_roles, form_url='', extra_context=
                 context, add, obj = get_context(admin_model, request, None, extra_context, status_code=200)
                 return admin_model.render_change_form(request, context, add=add, change=not add, obj=obj,
                                                       form_url=form_url)
-        # api_view must be a view from the API. It ensures that all access and modifications to the database are
-        # subject to validation by the API.
-        response = api_view(request)
-        if response.status_code == 201:
-            return admin_model.response_add(request, admin_model.model.objects.last())
-        else:
-            if response.status_code != 403:
-                data = "\n".join(
-                    [f"{information.replace('_', ' ')}:{request.POST[information]}"
-                     for information in logs])
-                logger.warning(f"Failed to create {model_name} with \n"
-                               f"{data} \n"
-                               f"The API sent {response.data}")
-            else:
-                logger.warning(f"Unauthorized user {request.user} failed to create a {model_name}")
-            context, add, obj = get_context(admin_model, request, None, extra_context,
-                                            status_code=response.status_code)
+        # api_view must be the name of a view from the API. It ensures that all access and modifications to the
+        # database are subject to validation by the API.
+        try:
+            serializer = services.create_object(get_api_view(api_view, request.user), request.POST)
+        except exceptions.PermissionDenied:
+            logger.warning(f"Unauthorized user {request.user} failed to create a {model_name}")
+            raise PermissionDenied
+        except exceptions.ValidationError as error:
+            data = "\n".join(
+                [f"{information.replace('_', ' ')}:{request.POST[information]}"
+                 for information in logs])
+            logger.warning(f"Failed to create {model_name} with \n"
+                           f"{data} \n"
+                           f"The API sent {error.detail}")
+            context, add, obj = get_context(admin_model, request, None, extra_context, status_code=400,
+                                            api_errors=error.detail)
             return admin_model.render_change_form(request, context, add=add, change=not add, obj=obj,
                                                   form_url=form_url)
+        return admin_model.response_add(request, serializer.instance)
     else:
         # Might become irrelevant once the Django permissions are properly set. Currently without it, it's possible
         # to access the form page for creation.
@@ -264,24 +307,25 @@ def modification_view(admin_model, request, object_id, api_view=None, logs=None,
         logger = admin_model.logger
     model_name = admin_model.model.__name__.lower()
     if request.method == 'POST':
-        # api_view must be a view from the API that will ensure the modification is allowed.
-        response = api_view(request, pk=object_id)
-        if response.status_code == 200:
-            return admin_model.response_change(request, admin_model.get_object(request, object_id))
-        else:
-            if response.status_code != 403:
-                data = "\n".join(
-                    [f"{information.replace('_', ' ')}:{request.POST[information]}"
-                     for information in logs])
-                logger.warning(f"Failed to edit {model_name} {object_id} with \n"
-                               f"{data}\n"
-                               f"The API sent {response.data}")
-            else:
-                logger.warning(f"Unauthorized user {request.user} failed to edit a {model_name}")
+        # api_view must be the name of a view from the API that will ensure the modification is allowed.
+        try:
+            services.update_object(get_api_view(api_view, request.user, pk=object_id), request.POST, partial=True)
+        except exceptions.PermissionDenied:
+            logger.warning(f"Unauthorized user {request.user} failed to edit a {model_name}")
+            raise PermissionDenied
+        except (exceptions.ValidationError, Http404) as error:
+            data = "\n".join(
+                [f"{information.replace('_', ' ')}:{request.POST[information]}"
+                 for information in logs])
+            logger.warning(f"Failed to edit {model_name} {object_id} with \n"
+                           f"{data}\n"
+                           f"The API sent {getattr(error, 'detail', error)}")
             context, add, obj = get_context(admin_model, request, object_id, extra_context,
-                                            status_code=response.status_code)
+                                            status_code=400 if isinstance(error, exceptions.ValidationError) else 404,
+                                            api_errors=getattr(error, 'detail', None))
             return admin_model.render_change_form(request, context, add=add, change=not add, obj=obj,
                                                   form_url=form_url)
+        return admin_model.response_change(request, admin_model.get_object(request, object_id))
     else:
         return super(type(admin_model), admin_model).change_view(request, object_id, form_url, extra_context)
 
@@ -293,22 +337,16 @@ def obtain_queryset(admin_model, request, api_view=None, logger=None):
         api_view = admin_model.api_views["list"]
     if logger is None:
         logger = admin_model.logger
-    # api_view must be a view from the API that will ensure only results allowed by the APi are used.
-    response = api_view(request)
-    if response.status_code in (200, 204):
-        qs = admin_model.model._default_manager.get_queryset()
-        # This is where we filter the original queryset to make sure it's the same as what is provided by the API.
-        qs = qs.filter(id__in=[item["id"] for item in response.data])
-        ordering = admin_model.get_ordering(request)
-        if ordering:
-            qs = qs.order_by(*ordering)
-    elif response.status_code == 403:
+    # api_view must be the name of a view from the API that will ensure only results allowed by the APi are used.
+    try:
+        qs = services.list_objects(get_api_view(api_view, request.user,
+                                                QueryDict(getattr(admin_model, 'api_list_query', ''))))
+    except exceptions.PermissionDenied:
         logger.warning(f"Unauthorized user {request.user} failed to obtain the list of {model_name}s.")
         raise PermissionDenied
-    else:
-        logger.warning(f"An empty list of {model_name}s was sent to {request.user}.\n"
-                       f"The API sent : {response.data}")
-        qs = admin_model.model.objects.none()
+    ordering = admin_model.get_ordering(request)
+    if ordering:
+        qs = qs.order_by(*ordering)
     return qs
 
 
@@ -317,13 +355,32 @@ def delete_view(admin_model, request, obj, api_view=None, logger=None):
         api_view = admin_model.api_views["delete"]
     if logger is None:
         logger = admin_model.logger
-    # api_view must be a view from the API that will ensure the deletion is allowed.
-    response = api_view(request, pk=obj.pk)
-    if response.status_code == 403:
+    # api_view must be the name of a view from the API that will ensure the deletion is allowed.
+    try:
+        services.delete_object(get_api_view(api_view, request.user, pk=obj.pk))
+    except exceptions.PermissionDenied:
         logger.warning(f"Unauthorized user {request.user} failed to delete {obj}")
         raise PermissionDenied
-    elif response.status_code != 204:
+    except Http404 as error:
         logger.warning(f"{request.user} failed to delete {obj}.\n"
-                       f"The API sent: {response.data}")
+                       f"The API sent: {error}")
 
 
+def delete_queryset_view(admin_model, request, queryset, logger=None):
+    """Delete the objects of a queryset through the API, with a job in the background if there are many of them."""
+    if logger is None:
+        logger = admin_model.logger
+    pks = list(queryset.values_list('pk', flat=True))
+    if len(pks) <= BACKGROUND_DELETE_THRESHOLD:
+        for obj in queryset:
+            delete_view(admin_model, request, obj)
+        return
+    model = next(name for name, view in jobs.VIEWS.items() if view == admin_model.api_views["list"])
+    task = jobs.TASKS["delete"]
+    try:
+        arguments = task.validate(request.user, {"model": model, "ids": pks})
+    except exceptions.PermissionDenied:
+        logger.warning(f"Unauthorized user {request.user} failed to delete {len(pks)} {model}")
+        raise PermissionDenied
+    job = Job.objects.enqueue(task.name, arguments, created_by=request.user, max_attempts=task.max_attempts)
+    admin_model.message_user(request, f"The {len(pks)} {model} are deleted in the background by the job {job.pk}.")
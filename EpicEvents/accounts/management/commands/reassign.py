@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import MyUser, Reassignment
+
+
+class Command(BaseCommand):
+    help = "Give all the clients, contracts and events of a user to another user of the same role."
+
+    def add_arguments(self, parser):
+        parser.add_argument('previous_user', help="The email of the user whose objects are given.")
+        parser.add_argument('new_user', help="The email of the user they're given to.")
+        parser.add_argument('--deactivate', action='store_true', help="Deactivate the previous user as well.")
+
+    def handle(self, *args, **options):
+        users = {}
+        for name in ('previous_user', 'new_user'):
+            try:
+                users[name] = MyUser.objects.get(email=options[name])
+            except MyUser.DoesNotExist:
+                raise CommandError(f"There is no user with the email {options[name]}.")
+        try:
+            reassignment = Reassignment.objects.reassign(users['previous_user'], users['new_user'],
+                                                         deactivate=options['deactivate'])
+        except ValueError as error:
+            raise CommandError(str(error))
+        self.stdout.write(f"Gave {len(reassignment.clients)} clients, {len(reassignment.contracts)} contracts and "
+                          f"{len(reassignment.events)} events of {users['previous_user']} to {users['new_user']}.")
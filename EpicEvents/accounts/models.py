@@ -1,5 +1,8 @@
-from django.db import models
+from django.apps import apps
+from django.contrib.postgres.fields import ArrayField
+from django.db import connection, models, transaction
 from django.contrib.auth.base_user import BaseUserManager, AbstractBaseUser
+from django.utils import timezone
 
 
 class MyUserManager(BaseUserManager):
@@ -82,3 +85,71 @@ class MyUser(AbstractBaseUser):
     def is_staff(self):
         """Is the user a member of staff?"""
         return self.role in ("gestion", "sales", "support")
+
+
+def reassign_column(model, field_name, previous_user, new_user, now):
+    """Give to `new_user` every object of `model` whose `field_name` is `previous_user`, in a single UPDATE.
+
+    Return the primary keys of the objects."""
+    quote = connection.ops.quote_name
+    column = quote(model._meta.get_field(field_name).column)
+    # Like save() would, the fields with auto_now are updated too.
+    auto_now = [quote(field.column) for field in model._meta.concrete_fields if getattr(field, 'auto_now', False)]
+    assignments = ", ".join([f"{column} = %s"] + [f"{auto_now_column} = %s" for auto_now_column in auto_now])
+    with connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {quote(model._meta.db_table)} SET {assignments} "
+                       f"WHERE {column} = %s RETURNING {quote(model._meta.pk.column)}",
+                       [new_user.pk] + [now] * len(auto_now) + [previous_user.pk])
+        return sorted(row[0] for row in cursor.fetchall())
+
+
+class ReassignmentManager(models.Manager):
+    def check_users(self, previous_user, new_user):
+        """Raise a ValueError if the objects of `previous_user` can't be given to `new_user`."""
+        if previous_user.pk == new_user.pk:
+            raise ValueError("The objects of a user can't be given to the same user.")
+        if previous_user.role != new_user.role or new_user.role not in ("sales", "support"):
+            raise ValueError("The objects of a user can only be given to another sales or support user.")
+
+    def reassign(self, previous_user, new_user, performed_by=None, deactivate=False):
+        """Give all the clients, contracts and events of a user to another user of the same role, and record it.
+
+        Both users are locked first. The foreign keys pointing at a user lock it as well, so no object can be given to
+        the previous user while its objects are moved. Each kind of object is moved with a single UPDATE."""
+        self.check_users(previous_user, new_user)
+        Client = apps.get_model('clients', 'Client')
+        Contract = apps.get_model('clients', 'Contract')
+        Event = apps.get_model('events', 'Event')
+        with transaction.atomic():
+            list(MyUser.objects.select_for_update().filter(pk__in=[previous_user.pk, new_user.pk]).order_by('pk'))
+            now = timezone.now()
+            reassignment = self.create(
+                previous_user=previous_user, previous_user_email=previous_user.email, new_user=new_user,
+                performed_by=performed_by,
+                clients=reassign_column(Client, 'sales_contact', previous_user, new_user, now),
+                contracts=reassign_column(Contract, 'sales_contact', previous_user, new_user, now),
+                events=reassign_column(Event, 'support', previous_user, new_user, now),
+            )
+            if deactivate:
+                MyUser.objects.filter(pk=previous_user.pk).update(is_active=False)
+                previous_user.is_active = False
+        return reassignment
+
+
+class Reassignment(models.Model):
+    """The record of the clients, contracts and events of a user given to another user."""
+    # The previous user is usually deleted later, its email is kept to know who it was.
+    previous_user = models.ForeignKey(MyUser, on_delete=models.SET_NULL, null=True, related_name="+")
+    previous_user_email = models.EmailField(max_length=255)
+    new_user = models.ForeignKey(MyUser, on_delete=models.SET_NULL, null=True, related_name="reassignments")
+    performed_by = models.ForeignKey(MyUser, on_delete=models.SET_NULL, null=True, related_name="+")
+    date = models.DateTimeField(auto_now_add=True)
+    # The primary keys of the objects that were given to the new user.
+    clients = ArrayField(models.BigIntegerField(), default=list)
+    contracts = ArrayField(models.BigIntegerField(), default=list)
+    events = ArrayField(models.BigIntegerField(), default=list)
+
+    objects = ReassignmentManager()
+
+    def __str__(self):
+        return f"{self.previous_user_email} to {self.new_user} {self.date.date()}"
@@ -1,8 +1,15 @@
+import datetime
+from io import StringIO
+
+from django.core.management import CommandError, call_command
 from django.test import TestCase
+from django.utils.timezone import make_aware
 from unittest.mock import patch
 
 import accounts.admin
-from accounts.models import MyUser
+from accounts.models import MyUser, Reassignment
+from clients.models import Client, Contract
+from events.models import Event
 
 default_password = "correcthorsebatterystaple"
 
@@ -163,3 +170,84 @@ class AccountsTest(TestCase):
             resp = self.client.post(f"/admin/accounts/myuser/{self.gestion_user.pk}/delete/", {"post": "yes"})
             assert resp.status_code == 403
             assert len(MyUser.objects.all()) == number_of_users
+
+
+class ReassignmentTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gestion_user = MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                                      email="corentin@gmail.com", password=default_password)
+        cls.sales_user_1 = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                      email="thomas@gmail.com", password=default_password)
+        cls.sales_user_2 = MyUser.objects.create_user(first_name="Thomas_2", last_name="Bravo", role="sales",
+                                                      email="thomas_2@gmail.com", password=default_password)
+        cls.support_user_1 = MyUser.objects.create_user(first_name="Timothée", last_name="Bravo", role="support",
+                                                        email="timothee@gmail.com", password=default_password)
+        cls.support_user_2 = MyUser.objects.create_user(first_name="Timothée_2", last_name="Bravo", role="support",
+                                                        email="timothee_2@gmail.com", password=default_password)
+        date = make_aware(datetime.datetime(2021, 9, 1, 10, 30))
+        cls.clients = [Client.objects.create(first_name="client_test", last_name=str(i),
+                                             email=f"client_test_{i}@gmail.com", phone_number="+33666666666",
+                                             company_name=f"test_{i}", sales_contact=cls.sales_user_1)
+                       for i in range(3)]
+        cls.contracts = [Contract.objects.create(sales_contact=cls.sales_user_1, client=client, status=False,
+                                                 amount=100, payment_due=date) for client in cls.clients]
+        cls.events = [Event.objects.create(client=contract.client, support=cls.support_user_1, contract=contract,
+                                           attendees=10, date=date) for contract in cls.contracts]
+        cls.other_client = Client.objects.create(first_name="client_test", last_name="other",
+                                                 email="client_test_other@gmail.com", phone_number="+33666666666",
+                                                 company_name="test_other", sales_contact=cls.sales_user_2)
+
+    def test_objects_of_a_sales_user_are_given_to_another_one(self):
+        self.client.force_login(self.gestion_user)
+        # The session, the users, the lock, an UPDATE for each kind of object and the record, however many objects.
+        with self.assertNumQueries(11):
+            resp = self.client.post(f"/api/users/{self.sales_user_1.pk}/reassign", {"new_user": self.sales_user_2.pk})
+        assert resp.status_code == 201
+        assert resp.json()["clients"] == [client.pk for client in self.clients]
+        assert resp.json()["contracts"] == [contract.pk for contract in self.contracts]
+        assert resp.json()["events"] == []
+        assert not Client.objects.filter(sales_contact=self.sales_user_1).exists()
+        assert not Contract.objects.filter(sales_contact=self.sales_user_1).exists()
+        assert Client.objects.filter(sales_contact=self.sales_user_2).count() == 4
+        assert Contract.objects.get(pk=self.contracts[0].pk).date_updated > self.contracts[0].date_updated
+        reassignment = Reassignment.objects.get()
+        assert (reassignment.previous_user, reassignment.new_user, reassignment.performed_by) == \
+            (self.sales_user_1, self.sales_user_2, self.gestion_user)
+        assert MyUser.objects.get(pk=self.sales_user_1.pk).is_active
+
+    def test_the_record_is_kept_when_the_previous_user_is_deleted(self):
+        reassignment = Reassignment.objects.reassign(self.support_user_1, self.support_user_2, deactivate=True)
+        assert reassignment.events == [event.pk for event in self.events]
+        assert not MyUser.objects.get(pk=self.support_user_1.pk).is_active
+        self.support_user_1.delete()
+        assert Event.objects.count() == 3
+        reassignment = Reassignment.objects.get()
+        assert (reassignment.previous_user, reassignment.previous_user_email) == (None, "timothee@gmail.com")
+
+    def test_objects_can_only_be_given_to_a_user_of_the_same_role(self):
+        self.client.force_login(self.gestion_user)
+        for new_user in (self.support_user_1, self.gestion_user, self.sales_user_1):
+            with self.subTest(new_user=new_user):
+                resp = self.client.post(f"/api/users/{self.sales_user_1.pk}/reassign", {"new_user": new_user.pk})
+                assert resp.status_code == 400
+                assert "new_user" in resp.json()
+        assert not Reassignment.objects.exists()
+        assert Client.objects.filter(sales_contact=self.sales_user_1).count() == 3
+
+    def test_only_gestion_users_can_reassign(self):
+        for user in (self.sales_user_2, self.support_user_2):
+            self.client.force_login(user)
+            resp = self.client.post(f"/api/users/{self.sales_user_1.pk}/reassign", {"new_user": self.sales_user_2.pk})
+            assert resp.status_code == 403
+        assert Client.objects.filter(sales_contact=self.sales_user_1).count() == 3
+
+    def test_command(self):
+        out = StringIO()
+        call_command("reassign", "thomas@gmail.com", "thomas_2@gmail.com", "--deactivate", stdout=out)
+        assert out.getvalue() == "Gave 3 clients, 3 contracts and 0 events of thomas@gmail.com to thomas_2@gmail.com.\n"
+        assert not MyUser.objects.get(pk=self.sales_user_1.pk).is_active
+        with self.assertRaises(CommandError):
+            call_command("reassign", "thomas@gmail.com", "nobody@gmail.com")
+        with self.assertRaises(CommandError):
+            call_command("reassign", "thomas@gmail.com", "timothee@gmail.com")
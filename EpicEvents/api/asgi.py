@@ -0,0 +1,132 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler as DjangoASGIHandler, ASGIRequest as DjangoASGIRequest
+from django.db import close_old_connections
+from django.http import StreamingHttpResponse
+from rest_framework.permissions import SAFE_METHODS
+
+from . import profiling
+
+# The `receive` of the request being handled, to notice when its client goes away during a streaming response.
+receive_var = contextvars.ContextVar('receive')
+
+
+class AsyncStreamingHttpResponse(StreamingHttpResponse):
+    """A streaming response whose content is an asynchronous iterator. Only the ASGIHandler of this module sends it.
+
+    Waiting for the next part of the content doesn't hold a thread, so slow clients and long streams don't take up the
+    workers. It's stopped as soon as the client disconnects."""
+    is_async = True
+
+    @property
+    def streaming_content(self):
+        return self.make_bytes_async(self._iterator)
+
+    @streaming_content.setter
+    def streaming_content(self, value):
+        self._iterator = value.__aiter__()
+
+    async def make_bytes_async(self, iterator):
+        async for part in iterator:
+            yield self.make_bytes(part)
+
+    def __iter__(self):
+        raise TypeError("An AsyncStreamingHttpResponse can only be sent by api.asgi.ASGIHandler.")
+
+
+class ASGIRequest(DjangoASGIRequest):
+    # The views may answer with an AsyncStreamingHttpResponse.
+    async_streaming = True
+
+
+class ASGIHandler(DjangoASGIHandler):
+    """The ASGI handler of Django, running the reads of the API concurrently and sending asynchronous streams.
+
+    Django runs the synchronous views one at a time in a single thread of each process, to be safe for the code that
+    isn't thread-safe. The requests with a safe method to the views whose class sets `concurrent_reads` run instead in
+    a pool of `API_READ_THREADS` threads, each with its own connection to the database, which bounds the number of
+    connections. The other requests, like the writes, still run in the single thread."""
+    request_class = ASGIRequest
+
+    def __init__(self):
+        super().__init__()
+        self.read_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'API_READ_THREADS', 8),
+                                                thread_name_prefix='api-read')
+
+    async def __call__(self, scope, receive, send):
+        receive_var.set(receive)
+        await super().__call__(scope, receive, send)
+
+    def make_view_atomic(self, view):
+        view = super().make_view_atomic(view)
+        if asyncio.iscoroutinefunction(view):
+            return view
+        # The profile of the request records the calls of the view in the thread running it.
+        view = profiling.profiled(view)
+        if not getattr(getattr(view, 'cls', None), 'concurrent_reads', False):
+            return view
+
+        async def concurrent_view(request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                return await sync_to_async(view, thread_sensitive=True)(request, *args, **kwargs)
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(
+                self.read_executor, context.run, self.run_read, view, request, args, kwargs)
+        return concurrent_view
+
+    @staticmethod
+    def run_read(view, request, args, kwargs):
+        """Run a view and render its response in a thread of the pool.
+
+        The connection of the thread is handled like the ones of the WSGI workers: it's closed after the request
+        unless CONN_MAX_AGE keeps it."""
+        close_old_connections()
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            return response
+        finally:
+            close_old_connections()
+
+    async def send_response(self, response, send):
+        if not getattr(response, 'is_async', False):
+            return await super().send_response(response, send)
+        headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+        headers += [(b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+                    for cookie in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        async def stream():
+            async for part in response.streaming_content:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body'})
+
+        async def wait_for_disconnect(receive):
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        streaming = asyncio.ensure_future(stream())
+        disconnect = asyncio.ensure_future(wait_for_disconnect(receive_var.get()))
+        try:
+            await asyncio.wait([streaming, disconnect], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Cancelling the stream runs the `finally` of the iterators of its content.
+            for task in (streaming, disconnect):
+                task.cancel()
+            await asyncio.gather(streaming, disconnect, return_exceptions=True)
+            await sync_to_async(response.close, thread_sensitive=True)()
+        if not streaming.cancelled() and streaming.exception() is not None:
+            raise streaming.exception()
+
+
+def get_asgi_application():
+    """Like the function of Django, with the handler of this module."""
+    django.setup(set_prefix=False)
+    return ASGIHandler()
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import queue
+import select
+import threading
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# The channel the triggers of the migration 0005 notify the changes on.
+CHANNEL = 'api_changes'
+
+
+class Subscription:
+    """The changes waiting to be sent to one stream.
+
+    If the stream doesn't keep up and more than `max_size` changes are waiting, they're dropped and `lost` is set, so
+    that the stream can tell its client to fetch everything again."""
+
+    def __init__(self, max_size=1000):
+        self.changes = queue.Queue(max_size)
+        self.lost = False
+
+    def put(self, change):
+        try:
+            self.changes.put_nowait(change)
+        except queue.Full:
+            self.lost = True
+
+    def get(self, timeout):
+        """Return the next change, or None if there was none for `timeout` seconds."""
+        try:
+            return self.changes.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription(Subscription):
+    """The changes waiting to be sent to a stream running in an event loop. It must be made in that loop."""
+
+    def __init__(self, max_size=1000):
+        super().__init__(max_size)
+        self.loop = asyncio.get_running_loop()
+        self.changes = asyncio.Queue(max_size)
+
+    def put(self, change):
+        # The changes are put by the thread of the bus, and the queue can only be used from its loop.
+        try:
+            self.loop.call_soon_threadsafe(self.put_in_loop, change)
+        except RuntimeError:
+            # The loop is closed.
+            pass
+
+    def put_in_loop(self, change):
+        try:
+            self.changes.put_nowait(change)
+        except asyncio.QueueFull:
+            self.lost = True
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.changes.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class ChangeBus:
+    """Give the changes notified by the database to the streams of this process.
+
+    A single thread listens to the notifications, on its own connection, whatever the number of streams, and puts each
+    change in the subscription of every stream. It's started by the first subscription and reconnects if its
+    connection is lost."""
+    reconnect_delay = 5
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.listening = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def subscribe(self, subscription):
+        """Add a subscription and return it. The changes committed after it's returned are put in it."""
+        with self.lock:
+            self.subscriptions.add(subscription)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.listen, name="change-bus", daemon=True)
+                self.thread.start()
+        if not self.listening.wait(timeout=10):
+            logger.warning("The changes aren't listened to yet.")
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def stop(self):
+        """Stop listening and close the connection."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def publish(self, change):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            subscription.put(change)
+
+    def listen(self):
+        while not self.stopping.is_set():
+            connection = connections.create_connection(self.alias)
+            try:
+                connection.ensure_connection()
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                self.listening.set()
+                raw = connection.connection
+                while not self.stopping.is_set():
+                    select.select([raw], [], [], 1)
+                    raw.poll()
+                    while raw.notifies:
+                        self.publish(json.loads(raw.notifies.pop(0).payload))
+            except Exception:
+                logger.exception("The connection listening to the changes was lost.")
+                self.listening.clear()
+                # The changes made while reconnecting are missed, the streams are told to fetch everything again.
+                with self.lock:
+                    for subscription in self.subscriptions:
+                        subscription.lost = True
+            finally:
+                connection.close()
+            self.stopping.wait(self.reconnect_delay)
+
+
+def get_visible_ids(user, change):
+    """Return the primary keys of the changed objects a user is shown, from their role and the objects they have.
+
+    The gestion users see every change. The others see the changes of the objects they're the sales contact or the
+    support of, and the salespeople also see the ones of the clients without sales contact, which they may take."""
+    if user.role == "gestion":
+        return change["ids"]
+    shown = {user.pk}
+    if user.role == "sales" and change["model"] == "client":
+        shown.add(None)
+    return [pk for pk, owners in zip(change["ids"], change["owners"]) if shown.intersection(owners)]
+
+
+bus = ChangeBus()
@@ -0,0 +1,58 @@
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+from rest_framework.settings import api_settings
+
+
+class SplitDateTimeField(serializers.DateTimeField):
+    """A datetime field also accepting the date and the time separately, as the admin sends them.
+
+    They are read from `<name>_0` and `<name>_1`, in the formats YYYY-MM-DD and hh:mm[:ss]."""
+
+    def default_timezone(self):
+        """Return the default timezone, which Django caches.
+
+        No timezone is activated per request in this project, so there is no need to look up the current one, which is
+        much slower, for every value."""
+        return timezone.get_default_timezone() if settings.USE_TZ else None
+
+    def get_value(self, dictionary):
+        date_key, time_key = f"{self.field_name}_0", f"{self.field_name}_1"
+        if date_key in dictionary and time_key in dictionary:
+            return dictionary[date_key], dictionary[time_key]
+        return super().get_value(dictionary)
+
+    def to_internal_value(self, value):
+        if isinstance(value, tuple):
+            value = f"{value[0]}T{value[1]}"
+        input_formats = getattr(self, 'input_formats', api_settings.DATETIME_INPUT_FORMATS)
+        if isinstance(value, str) and ISO_8601 in input_formats:
+            # fromisoformat is much faster than the regular expressions of the default parser. Before Python 3.11,
+            # it only accepts the formats isoformat() outputs, the others are left to the default parser.
+            try:
+                return self.enforce_timezone(datetime.datetime.fromisoformat(value))
+            except ValueError:
+                pass
+        return super().to_internal_value(value)
+
+
+class OrderedManyRelatedField(serializers.ManyRelatedField):
+    """A list of related objects ordered by primary key, like the fast lists return them, rather than in the order the
+    database happens to read them in."""
+
+    def get_attribute(self, instance):
+        relationship = super().get_attribute(instance)
+        return relationship.order_by('pk') if hasattr(relationship, 'order_by') else relationship
+
+
+class PrimaryKeyListField(serializers.PrimaryKeyRelatedField):
+    """The primary keys of the related objects, ordered, when used with `many=True`."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        list_kwargs.update({key: value for key, value in kwargs.items() if key in MANY_RELATION_KWARGS})
+        return OrderedManyRelatedField(**list_kwargs)
@@ -0,0 +1,105 @@
+from django.db.models import Q
+from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.filters import BaseFilterBackend
+
+
+class Filter:
+    """A query parameter that can be used to filter a queryset.
+
+    `lookup` is either the name of the lookup the value is given to, or a callable turning the value into a Q object.
+    `field` is the serializer field used to validate the value. If `default` is given, the filter is applied with it
+    when the parameter isn't."""
+
+    def __init__(self, lookup, field=None, default=empty):
+        self.lookup = lookup
+        self.field = field if field is not None else serializers.CharField()
+        self.default = default
+
+    def get_q(self, value):
+        """Return the Q object corresponding to a validated value."""
+        if callable(self.lookup):
+            return self.lookup(value)
+        return Q(**{self.lookup: value})
+
+
+class MethodFilter(Filter):
+    """A filter delegating to a method of the queryset, for filters that can't be expressed as a Q object.
+
+    It is applied after all the other filters, as it may annotate or order the queryset."""
+
+    def __init__(self, method, field=None):
+        super().__init__(None, field)
+        self.method = method
+
+    def get_q(self, value):
+        return Q()
+
+    def filter_queryset(self, queryset, value):
+        return getattr(queryset, self.method)(value)
+
+
+class OrderingFilter(MethodFilter):
+    """Order the queryset by one of `fields`, or in reverse if it's prefixed with a dash, then by primary key in the same
+    direction, so that the order is stable and an index on the field and the primary key can be read backwards."""
+
+    def __init__(self, *fields):
+        super().__init__(None, serializers.ChoiceField(choices=[
+            prefix + field for field in fields for prefix in ('', '-')]))
+
+    def filter_queryset(self, queryset, value):
+        return queryset.order_by(value, '-pk' if value.startswith('-') else 'pk')
+
+
+class FilterSet:
+    """A declarative set of filters, one per accepted query parameter."""
+    # Those parameters are used by DRF itself and are not filters.
+    ignored_params = ("format",)
+
+    def __init__(self, **filters):
+        self.filters = filters
+
+    def validate(self, params):
+        """Validate the query parameters and return their values. Unknown parameters are rejected."""
+        errors = {}
+        values = {}
+        for name in params:
+            if name in self.ignored_params:
+                continue
+            if name not in self.filters:
+                errors[name] = [f"Unknown filter. Allowed filters are: {', '.join(sorted(self.filters))}."]
+                continue
+            try:
+                values[name] = self.filters[name].field.run_validation(params.get(name))
+            except serializers.ValidationError as error:
+                errors[name] = error.detail
+        for name, declared in self.filters.items():
+            if name not in params and declared.default is not empty:
+                values[name] = declared.default
+        if errors:
+            raise serializers.ValidationError(errors)
+        return values
+
+    def filter_queryset(self, queryset, params):
+        """Filter the queryset with a single call, so that the joins on the same relation are shared."""
+        values = self.validate(params)
+        q = Q()
+        for name, value in values.items():
+            q &= self.filters[name].get_q(value)
+        if q:
+            queryset = queryset.filter(q)
+        # The ordering asked for comes last, so that it replaces the one of a search.
+        for name, value in sorted(values.items(), key=lambda item: isinstance(self.filters[item[0]], OrderingFilter)):
+            if isinstance(self.filters[name], MethodFilter):
+                queryset = self.filters[name].filter_queryset(queryset, value)
+        return queryset
+
+
+class DeclarativeFilterBackend(BaseFilterBackend):
+    """Filter the lists of a viewset with the FilterSet declared in its `filterset` attribute."""
+
+    def filter_queryset(self, request, queryset, view):
+        filterset = getattr(view, "filterset", None)
+        if filterset is None or getattr(view, "action", None) != "list":
+            return queryset
+        return filterset.filter_queryset(queryset, request.query_params)
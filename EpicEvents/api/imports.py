@@ -0,0 +1,243 @@
+import csv
+import re
+
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection, models
+from django.utils import timezone
+from phonenumber_field.modelfields import PhoneNumberField
+
+from accounts.models import MyUser
+from clients.models import Client, Contract
+from events.models import CLIENT_CONSTRAINT, Event
+from .serializers import EventSerializer
+
+# Only the numbers in the E.164 format phonenumber_field stores them in are imported, they aren't parsed in SQL.
+PHONE_NUMBER_REGEX = r'^\+[1-9][0-9]{6,14}$'
+# Close to what the EmailValidator of Django accepts, without the cases that need Python to check.
+EMAIL_REGEX = r'^[^@\s]+@[^@\s]+\.[^@\s.]+$'
+# Integers written as Python would write them, so that they can be compared to the primary keys cast to text.
+INTEGER_REGEX = r'^(0|[1-9][0-9]*)$'
+# Values PostgreSQL accepts that Python can't represent.
+INFINITE_VALUES = "('nan', 'infinity', '+infinity', '-infinity', 'inf', '+inf', '-inf')"
+
+
+class CSVImport:
+    """Import the rows of a CSV file into the table of a model, with PostgreSQL's COPY.
+
+    The file is streamed into a temporary staging table where every column is text, so that memory use doesn't depend
+    on its size and no row is turned into a Python object. Each check is then a single UPDATE marking the rows it
+    rejects, the first error of a row being kept. The checks never cast a value, so that one invalid value can't make a
+    query fail, whatever order the database evaluates the conditions in. The valid rows are then inserted with a single
+    INSERT ... SELECT, and the rejected rows can be written to a CSV file with the reason they were rejected.
+
+    The table of the model is locked against writes from the checks to the insert, so that what was checked is still
+    true when the rows are inserted. The foreign keys to users are given by email, the other ones by primary key."""
+    model = None
+    # The columns the file may have, and the field of the model each one is imported into.
+    fields = {}
+
+    def __init__(self, file):
+        self.file = file
+        self.table = connection.ops.quote_name(self.model._meta.db_table)
+        self.staging = f"import_{self.model._meta.model_name}"
+        self.columns = self.read_header()
+        # The types the checks cast the columns to.
+        self.types = set()
+
+    def read_header(self):
+        header = next(csv.reader([self.file.readline()]), [])
+        unknown = [name for name in header if name not in self.fields]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}. The columns are {', '.join(self.fields)}.")
+        if len(set(header)) != len(header):
+            raise ValueError("A column is given more than once.")
+        missing = [name for name, field in self.fields.items() if name not in header and self.is_required(field)]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}.")
+        return header
+
+    @staticmethod
+    def is_required(field):
+        return not (field.null or field.blank or field.primary_key)
+
+    def run(self, cursor):
+        """Import the file and return the number of rows imported and rejected. It must run in a transaction."""
+        cursor.execute(f"LOCK TABLE {self.table} IN SHARE ROW EXCLUSIVE MODE")
+        self.stage(cursor)
+        checks = self.get_checks()
+        if connection.pg_version < 160000:
+            for type_name in self.types:
+                cursor.execute(
+                    f"CREATE OR REPLACE FUNCTION {self.get_validity_function(type_name)}(value text) RETURNS boolean "
+                    f"LANGUAGE plpgsql IMMUTABLE AS $$ BEGIN PERFORM value::{type_name}; RETURN true; "
+                    f"EXCEPTION WHEN others THEN RETURN false; END $$")
+        for column, message, condition in checks:
+            cursor.execute(f"UPDATE {self.staging} AS s SET error = %s WHERE s.error IS NULL AND ({condition})",
+                           [f"{column}: {message}"])
+        # Datetimes without an offset are in the time zone of the project, as they are for the API. Django reads the
+        # datetimes of the connection in its own time zone, which is set back for the rest of the transaction.
+        cursor.execute("SET LOCAL TIME ZONE %s", [settings.TIME_ZONE])
+        # Most of the time of the insert goes into updating the full-text index of the clients. A longer list of
+        # pending entries lets the database merge them into it in fewer and larger batches.
+        cursor.execute("SET LOCAL work_mem = '256MB'")
+        cursor.execute("SET LOCAL gin_pending_list_limit = '256MB'")
+        try:
+            imported = self.insert(cursor)
+        finally:
+            cursor.execute("SET LOCAL TIME ZONE %s", [connection.timezone_name])
+        cursor.execute(f"SELECT count(*) FROM {self.staging} WHERE error IS NOT NULL")
+        return imported, cursor.fetchone()[0]
+
+    def stage(self, cursor):
+        columns = ", ".join(f"{self.quote(name)} text" for name in self.fields)
+        cursor.execute(f"CREATE TEMPORARY TABLE {self.staging} (file_row bigserial, {columns}, error text) ON COMMIT DROP")
+        names = ", ".join(self.quote(name) for name in self.columns)
+        # The methods of psycopg2 that Django doesn't wrap raise its own exceptions otherwise.
+        with connection.wrap_database_errors:
+            cursor.copy_expert(f"COPY {self.staging} ({names}) FROM STDIN WITH (FORMAT csv)", self.file)
+        cursor.execute(f"ANALYZE {self.staging}")
+
+    @staticmethod
+    def quote(name):
+        return connection.ops.quote_name(name)
+
+    @staticmethod
+    def get_validity_function(type_name):
+        """Return the function telling whether a text can be cast to a type, for the versions before PostgreSQL 16."""
+        return "pg_temp.import_is_valid_" + re.sub(r'\W', '_', type_name)
+
+    def is_valid(self, column, type_name):
+        """Return the SQL telling whether a column can be cast to a type, which doesn't fail when it can't."""
+        self.types.add(type_name)
+        if connection.pg_version >= 160000:
+            return f"pg_input_is_valid({column}, '{type_name}')"
+        return f"{self.get_validity_function(type_name)}({column})"
+
+    def get_checks(self):
+        """Return the checks of the rows, in order, as the column, the message and the condition of the rejected rows.
+
+        The conditions are on the row `s` of the staging table. The ones of the fields come from the model."""
+        checks = []
+        for name in self.columns:
+            checks += self.get_field_checks(name, self.fields[name])
+        return checks
+
+    def get_field_checks(self, name, field):
+        value = f"s.{self.quote(name)}"
+        type_name = field.cast_db_type(connection)
+        # The primary key can be left out of the file, but not of some rows only.
+        if self.is_required(field) or field.primary_key:
+            yield name, "This field is required.", f"coalesce({value}, '') = ''"
+        present = f"coalesce({value}, '') <> ''"
+        if isinstance(field, PhoneNumberField):
+            yield name, "Enter a valid phone number in the E.164 format.", \
+                f"{present} AND {value} !~ '{PHONE_NUMBER_REGEX}'"
+        elif isinstance(field, models.CharField):
+            yield name, f"Ensure this field has no more than {field.max_length} characters.", \
+                f"length({value}) > {field.max_length}"
+        elif isinstance(field, models.ForeignKey) and field.related_model is MyUser:
+            role = field.remote_field.limit_choices_to['role']
+            yield name, f"There is no {role} user with this email.", \
+                f"{present} AND NOT EXISTS (SELECT 1 FROM {self.quote(MyUser._meta.db_table)} AS u " \
+                f"WHERE u.email = {value} AND u.role = '{role}')"
+        elif isinstance(field, (models.AutoField, models.IntegerField, models.ForeignKey)):
+            yield name, "A valid integer is required.", \
+                f"{present} AND NOT ({value} ~ '{INTEGER_REGEX}' AND {self.is_valid(value, type_name)})"
+        elif isinstance(field, models.FloatField):
+            yield name, "A valid number is required.", \
+                f"{present} AND (NOT {self.is_valid(value, type_name)} " \
+                f"OR lower(trim({value})) IN {INFINITE_VALUES})"
+        elif isinstance(field, models.BooleanField):
+            yield name, "Must be a valid boolean.", f"{present} AND NOT {self.is_valid(value, type_name)}"
+        elif isinstance(field, models.DateTimeField):
+            yield name, "Datetime has wrong format.", \
+                f"{present} AND (NOT {self.is_valid(value, type_name)} " \
+                f"OR lower(trim({value})) IN {INFINITE_VALUES})"
+        if isinstance(field, models.EmailField):
+            yield name, "Enter a valid email address.", f"{present} AND {value} !~ '{EMAIL_REGEX}'"
+
+        if isinstance(field, models.ForeignKey) and field.related_model is not MyUser:
+            yield name, f"There is no {field.related_model._meta.verbose_name} with this id.", \
+                f"{present} AND NOT EXISTS (SELECT 1 FROM {self.quote(field.related_model._meta.db_table)} AS r " \
+                f"WHERE r.id::text = {value})"
+        if field.unique:
+            yield name, "Another row of the file has the same value.", \
+                f"s.file_row IN (SELECT file_row FROM (SELECT file_row, row_number() OVER (PARTITION BY {self.quote(name)} " \
+                f"ORDER BY file_row) AS n FROM {self.staging} WHERE {self.quote(name)} IS NOT NULL) AS d WHERE d.n > 1)"
+            yield name, f"{self.model._meta.verbose_name} with this {field.verbose_name} already exists.", \
+                f"EXISTS (SELECT 1 FROM {self.table} AS t WHERE {self.as_text('t', field)} = {value})"
+
+    def as_text(self, alias, field):
+        column = f"{alias}.{self.quote(field.column)}"
+        return column if isinstance(field, models.CharField) else f"{column}::text"
+
+    def insert(self, cursor):
+        """Insert the valid rows into the table of the model and return how many there are."""
+        columns, values, joins, params = [], [], [], []
+        for name in self.columns:
+            field = self.fields[name]
+            value = f"s.{self.quote(name)}"
+            columns.append(self.quote(field.column))
+            if isinstance(field, models.ForeignKey) and field.related_model is MyUser:
+                alias = self.quote(f"user_{name}")
+                joins.append(f"LEFT JOIN {self.quote(MyUser._meta.db_table)} AS {alias} ON {alias}.email = {value}")
+                values.append(f"{alias}.id")
+            elif isinstance(field, models.CharField):
+                values.append(f"NULLIF({value}, '')" if field.null else f"coalesce({value}, '')")
+            else:
+                values.append(f"NULLIF({value}, '')::{field.cast_db_type(connection)}")
+        now = timezone.now()
+        for field in self.model._meta.concrete_fields:
+            if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False):
+                columns.append(self.quote(field.column))
+                values.append("%s")
+                params.append(now)
+        cursor.execute(f"INSERT INTO {self.table} ({', '.join(columns)}) SELECT {', '.join(values)} "
+                       f"FROM {self.staging} AS s {' '.join(joins)} WHERE s.error IS NULL", params)
+        imported = cursor.rowcount
+        if "id" in self.columns:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [self.model]):
+                cursor.execute(sql)
+        return imported
+
+    def write_rejected(self, cursor, file):
+        """Write the rejected rows to a CSV file, with the number of their row in the imported file and their error."""
+        columns = ", ".join(self.quote(name) for name in self.columns)
+        cursor.copy_expert(f"COPY (SELECT file_row AS row, error, {columns} FROM {self.staging} WHERE error IS NOT NULL "
+                           f"ORDER BY file_row) TO STDOUT WITH (FORMAT csv, HEADER)", file)
+
+
+def get_fields(model, names):
+    return {name: model._meta.get_field(name) for name in names}
+
+
+class ClientImport(CSVImport):
+    model = Client
+    fields = get_fields(Client, ['id', 'first_name', 'last_name', 'email', 'phone_number', 'mobile_number',
+                                 'company_name', 'sales_contact'])
+
+
+class ContractImport(CSVImport):
+    model = Contract
+    fields = get_fields(Contract, ['id', 'client', 'sales_contact', 'status', 'amount', 'payment_due'])
+
+    def get_checks(self):
+        return [*super().get_checks(),
+                ("client", "The client has no sales contact.",
+                 f"EXISTS (SELECT 1 FROM {self.quote(Client._meta.db_table)} AS c "
+                 f"WHERE c.id::text = s.client AND c.sales_contact_id IS NULL)")]
+
+
+class EventImport(CSVImport):
+    model = Event
+    fields = get_fields(Event, ['id', 'client', 'contract', 'support', 'attendees', 'date', 'notes'])
+
+    def get_checks(self):
+        return [*super().get_checks(),
+                ("client", EventSerializer.constraint_messages[CLIENT_CONSTRAINT],
+                 f"NOT EXISTS (SELECT 1 FROM {self.quote(Contract._meta.db_table)} AS c "
+                 f"WHERE c.id::text = s.contract AND c.client_id::text = s.client)")]
+
+
+IMPORTS = {"clients": ClientImport, "contracts": ContractImport, "events": EventImport}
@@ -0,0 +1,369 @@
+import logging
+import os
+import select
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DataError, connection, transaction
+from django.http import Http404, QueryDict
+from django.urls import resolve, reverse
+from django.utils import timezone
+from rest_framework import exceptions, serializers
+
+from accounts.models import MyUser, Reassignment
+from clients.models import ReminderRun
+from . import services
+from .imports import IMPORTS
+from .models import CHANNEL, RETRY_DELAY, Job
+from .renderers import JSONRenderer
+from .values import ValuesSerializer
+
+logger = logging.getLogger(__name__)
+
+# The URL of the list of each kind of object, whose viewset the jobs go through like the admin does.
+VIEWS = {'clients': 'client_list', 'contracts': 'contract_list', 'events': 'event_list'}
+
+
+class JobError(Exception):
+    """A failure trying the job again won't fix. The job fails without being tried again."""
+
+
+def get_path(name):
+    """Return the path of a file of the jobs, in JOBS_DIR."""
+    return Path(settings.JOBS_DIR) / name
+
+
+def store_file(upload):
+    """Write an uploaded file to JOBS_DIR, for a job to read it later, and return its name there."""
+    os.makedirs(settings.JOBS_DIR, exist_ok=True)
+    name = f"{uuid.uuid4().hex}.upload"
+    with open(get_path(name), 'wb') as file:
+        for chunk in upload.chunks():
+            file.write(chunk)
+    return name
+
+
+def remove_file(name):
+    try:
+        os.remove(get_path(name))
+    except FileNotFoundError:
+        pass
+
+
+def get_viewset(model):
+    return resolve(reverse(VIEWS[model])).func.cls
+
+
+def get_user(job):
+    if job.created_by is None:
+        raise JobError("The user who started the job was deleted.")
+    return job.created_by
+
+
+class Task:
+    """A kind of job: what it does with its arguments, and who may start it.
+
+    At most `concurrency` jobs of a kind run at once, whatever the number of workers, and a failed job is tried up to
+    `max_attempts` times. If `interval` is set, the workers start a job of this kind every `interval` seconds."""
+    name = None
+    concurrency = 1
+    max_attempts = 3
+    retry_delay = RETRY_DELAY
+    interval = None
+
+    def validate(self, user, arguments):
+        """Return the arguments to save if the user may start the job with them. Raise a ValidationError if they're
+        wrong, or PermissionDenied."""
+        raise NotImplementedError
+
+    def run(self, job):
+        """Do the job and return its result. A file it makes is named in `job.result_file`."""
+        raise NotImplementedError
+
+
+class ExportSerializer(serializers.Serializer):
+    model = serializers.ChoiceField(choices=list(VIEWS))
+    # The query string of the list, with its filters.
+    query = serializers.CharField(default="", allow_blank=True)
+
+
+class ExportTask(Task):
+    """Write a list of clients, contracts or events to a JSON file, as their list endpoint would return it."""
+    name = 'export'
+    concurrency = 2
+    batch_size = 2000
+
+    def get_view(self, user, arguments):
+        return services.get_view(get_viewset(arguments['model']), user, 'list',
+                                 query_params=QueryDict(arguments['query']))
+
+    def validate(self, user, arguments):
+        serializer = ExportSerializer(data=arguments)
+        serializer.is_valid(raise_exception=True)
+        # The filters are checked when the queryset is made, before it's run.
+        services.list_objects(self.get_view(user, serializer.validated_data))
+        return serializer.validated_data
+
+    def run(self, job):
+        view = self.get_view(get_user(job), job.arguments)
+        values = ValuesSerializer(view.get_serializer())
+        rows = values.get_rows(services.list_objects(view))
+        job.set_progress(0, rows.count())
+        renderer = JSONRenderer()
+        job.result_file = f"{job.pk}-{job.arguments['model']}.json"
+        os.makedirs(settings.JOBS_DIR, exist_ok=True)
+        with open(get_path(job.result_file), 'wb') as file:
+            file.write(b'[')
+            batch = []
+            for row in rows.iterator(chunk_size=self.batch_size):
+                batch.append(row)
+                if len(batch) == self.batch_size:
+                    self.write_batch(file, renderer, values, batch, job)
+                    batch = []
+            self.write_batch(file, renderer, values, batch, job)
+            file.write(b']')
+        return {'count': job.progress}
+
+    @staticmethod
+    def write_batch(file, renderer, values, rows, job):
+        if not rows:
+            return
+        if job.progress:
+            file.write(b',')
+        # The brackets of the rendered list are left out, the batches are parts of a single list.
+        file.write(renderer.render(values.to_representation(rows))[1:-1])
+        job.set_progress(job.progress + len(rows))
+
+
+class ImportSerializer(serializers.Serializer):
+    kind = serializers.ChoiceField(choices=list(IMPORTS))
+    # The uploaded CSV file, in JOBS_DIR, named by store_file so that no other file can be read.
+    file = serializers.RegexField(r'^[0-9a-f]{32}\.upload$')
+
+
+class ImportTask(Task):
+    """Import clients, contracts or events from a CSV file, like the `importcsv` command. Only the gestion users may."""
+    name = 'import'
+    # The import locks the table it imports into.
+    concurrency = 1
+
+    def validate(self, user, arguments):
+        if user.role != "gestion":
+            raise exceptions.PermissionDenied()
+        serializer = ImportSerializer(data=arguments)
+        serializer.is_valid(raise_exception=True)
+        with open(get_path(serializer.validated_data['file']), newline='', encoding='utf-8-sig') as file:
+            try:
+                IMPORTS[serializer.validated_data['kind']](file)
+            except (ValueError, UnicodeDecodeError) as error:
+                raise serializers.ValidationError({"file": [str(error)]})
+        return serializer.validated_data
+
+    def run(self, job):
+        kind = job.arguments['kind']
+        with open(get_path(job.arguments['file']), newline='', encoding='utf-8-sig') as file:
+            csv_import = IMPORTS[kind](file)
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    imported, rejected = csv_import.run(cursor)
+                    if rejected:
+                        job.result_file = f"{job.pk}-{kind}.rejected.csv"
+                        with open(get_path(job.result_file), 'w', newline='', encoding='utf-8') as rejected_file:
+                            csv_import.write_rejected(cursor, rejected_file)
+            except DataError as error:
+                # COPY fails on the rows that aren't CSV with the columns of the header.
+                remove_file(job.arguments['file'])
+                raise JobError(f"Nothing was imported: {error}")
+        job.set_progress(imported + rejected, imported + rejected)
+        remove_file(job.arguments['file'])
+        return {'imported': imported, 'rejected': rejected}
+
+
+class DeleteSerializer(serializers.Serializer):
+    model = serializers.ChoiceField(choices=list(VIEWS))
+    ids = serializers.ListField(child=serializers.IntegerField(), max_length=1000000)
+
+
+class DeleteTask(Task):
+    """Delete many clients, contracts or events, one at a time through their viewset, as the admin does.
+
+    The objects the user can't delete, or that are already deleted, are listed in the result, the others are deleted
+    anyway. Each deletion is committed on its own, so trying the job again carries on where it stopped."""
+    name = 'delete'
+
+    def validate(self, user, arguments):
+        serializer = DeleteSerializer(data=arguments)
+        serializer.is_valid(raise_exception=True)
+        services.get_view(get_viewset(serializer.validated_data['model']), user, 'destroy')
+        return serializer.validated_data
+
+    def run(self, job):
+        user = get_user(job)
+        viewset = get_viewset(job.arguments['model'])
+        ids = job.arguments['ids']
+        result = {'deleted': 0, 'not_found': [], 'forbidden': []}
+        job.set_progress(0, len(ids))
+        for pk in ids:
+            try:
+                services.delete_object(services.get_view(viewset, user, 'destroy', pk=pk))
+            except Http404:
+                result['not_found'].append(pk)
+            except exceptions.PermissionDenied:
+                result['forbidden'].append(pk)
+            else:
+                result['deleted'] += 1
+            job.set_progress(job.progress + 1)
+        return result
+
+
+class ReassignTask(Task):
+    """Give all the objects of a user to another user, like the `reassign` action of the users."""
+    name = 'reassign'
+
+    def validate(self, user, arguments):
+        if user.role != "gestion":
+            raise exceptions.PermissionDenied()
+        users = MyUser.objects.in_bulk([arguments.get('previous_user'), arguments.get('new_user')])
+        previous_user, new_user = users.get(arguments.get('previous_user')), users.get(arguments.get('new_user'))
+        if previous_user is None or new_user is None:
+            raise serializers.ValidationError("Both users must exist.")
+        try:
+            Reassignment.objects.check_users(previous_user, new_user)
+        except ValueError as error:
+            raise serializers.ValidationError({"new_user": [str(error)]})
+        return {'previous_user': previous_user.pk, 'new_user': new_user.pk,
+                'deactivate': bool(arguments.get('deactivate', False))}
+
+    def run(self, job):
+        users = MyUser.objects.in_bulk([job.arguments['previous_user'], job.arguments['new_user']])
+        if len(users) < 2:
+            raise JobError("One of the users was deleted.")
+        try:
+            reassignment = Reassignment.objects.reassign(
+                users[job.arguments['previous_user']], users[job.arguments['new_user']], performed_by=job.created_by,
+                deactivate=job.arguments['deactivate'])
+        except ValueError as error:
+            raise JobError(str(error))
+        return {'reassignment': reassignment.pk, 'clients': len(reassignment.clients),
+                'contracts': len(reassignment.contracts), 'events': len(reassignment.events)}
+
+
+class RemindTask(Task):
+    """Remind the sales contacts of their unpaid contracts that became due, see clients.models.ReminderRun.
+
+    The workers start one every PAYMENT_REMINDERS_INTERVAL seconds, and the gestion users may start one sooner."""
+    name = 'remind'
+
+    @property
+    def interval(self):
+        return settings.PAYMENT_REMINDERS_INTERVAL
+
+    def validate(self, user, arguments):
+        if user.role != "gestion":
+            raise exceptions.PermissionDenied()
+        return {}
+
+    def run(self, job):
+        run = ReminderRun.objects.run(progress=job.set_progress)
+        if run is None:
+            return {'run': None}
+        return {'run': run.pk, 'contracts': run.contracts, 'reminders': run.reminders.count()}
+
+
+TASKS = {task.name: task for task in (ExportTask(), ImportTask(), DeleteTask(), ReassignTask(), RemindTask())}
+
+
+class Worker:
+    """Run the jobs of the database in `threads` threads, each with its own connection.
+
+    The worker is woken up by the notifications of the new jobs and by its jobs finishing, and looks for jobs every
+    `poll_interval` seconds otherwise, for the ones that were delayed or scheduled. Every `heartbeat` seconds, it saves
+    the progress of its jobs and that it's still running them. The jobs of a worker not heard of for `stale_after`
+    seconds are taken over by the other workers."""
+    poll_interval = 5
+    heartbeat = 1
+    stale_after = 60
+
+    def __init__(self, threads=4, kinds=None):
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.threads = threads
+        self.limits = {kind: TASKS[kind].concurrency for kind in kinds or TASKS}
+        self.schedules = {kind: TASKS[kind].interval for kind in self.limits if TASKS[kind].interval}
+        self.running = {}
+        self.stopping = threading.Event()
+        self.wakeup_read, self.wakeup_write = os.pipe()
+
+    def stop(self):
+        """Stop taking jobs. The ones running are finished first."""
+        self.stopping.set()
+        self.wake_up()
+
+    def wake_up(self):
+        os.write(self.wakeup_write, b'.')
+
+    def run(self, burst=False):
+        """Run the jobs until the worker is stopped, or until there's no job ready to run if `burst` is set, in which
+        case the scheduled jobs aren't started."""
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        last_heartbeat = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='job') as executor:
+                while True:
+                    for pk, (job, future) in list(self.running.items()):
+                        if future.done():
+                            del self.running[pk]
+                    if time.monotonic() - last_heartbeat >= self.heartbeat:
+                        self.save_heartbeat()
+                        last_heartbeat = time.monotonic()
+                    claimed = None
+                    while not self.stopping.is_set() and len(self.running) < self.threads:
+                        claimed = Job.objects.claim(self.name, self.limits, self.stale_after,
+                                                    schedules={} if burst else self.schedules)
+                        if claimed is None:
+                            break
+                        self.running[claimed.pk] = (claimed, executor.submit(self.run_job, claimed))
+                    if not self.running and (self.stopping.is_set() or burst and claimed is None):
+                        return
+                    self.wait()
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"UNLISTEN {CHANNEL}")
+
+    def wait(self):
+        """Wait for a notification, a job to finish, or the next heartbeat."""
+        raw = connection.connection
+        ready, _, _ = select.select([raw, self.wakeup_read], [], [],
+                                    self.heartbeat if self.running else self.poll_interval)
+        if self.wakeup_read in ready:
+            os.read(self.wakeup_read, 1024)
+        raw.poll()
+        raw.notifies.clear()
+
+    def save_heartbeat(self):
+        now = timezone.now()
+        for job, future in list(self.running.values()):
+            Job.objects.filter(pk=job.pk, status='running', worker=self.name).update(
+                heartbeat=now, progress=job.progress, total=job.total)
+
+    def run_job(self, job):
+        task = TASKS[job.kind]
+        try:
+            result = task.run(job)
+        except JobError as error:
+            connection.close_if_unusable_or_obsolete()
+            job.finish(status='failed', error=str(error))
+        except Exception as error:
+            logger.exception(f"The job {job.pk} failed.")
+            connection.close_if_unusable_or_obsolete()
+            job.retry_or_fail(f"{type(error).__name__}: {error}", task.retry_delay)
+        else:
+            job.succeed(result, job.result_file)
+        finally:
+            connection.close()
+            self.wake_up()
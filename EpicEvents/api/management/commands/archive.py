@@ -0,0 +1,30 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from clients.models import Contract
+
+
+class Command(BaseCommand):
+    help = ("Archive the contracts paid and due before a date, with their event if it took place before then too. The "
+            "archived contracts and events are only listed by the API with `include_archived=true`, and by the admin "
+            "with its filter. It can be stopped and run again at any time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=datetime.date.fromisoformat,
+                            help="The date, as YYYY-MM-DD. By default, ARCHIVE_AFTER_DAYS days ago.")
+        parser.add_argument('--batch-size', type=int, default=Contract.objects.archive_batch_size,
+                            help="The number of contracts archived per transaction.")
+
+    def handle(self, *args, **options):
+        if options['before'] is None:
+            before = timezone.now() - datetime.timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+        else:
+            before = timezone.make_aware(datetime.datetime.combine(options['before'], datetime.time()))
+        contracts, events = Contract.objects.archive(before, options['batch_size'], progress=self.report)
+        self.stdout.write(f"Archived {contracts} contracts and {events} events from before {before:%Y-%m-%d}.")
+
+    def report(self, count):
+        self.stdout.write(f"{count} contracts archived...", ending='\r')
@@ -0,0 +1,146 @@
+import asyncio
+import io
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from accounts.models import MyUser
+from api.asgi import ASGIHandler
+from api.views import ChangeStreamView
+
+
+class Command(BaseCommand):
+    help = ("Compare how many reads of the API a process serves with the WSGI and the ASGI handlers, with the same "
+            "number of threads, while clients read the API and others keep a stream of the changes open. The requests "
+            "are made to the handlers in this process, without a server or a network.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help="The user making the requests.")
+        parser.add_argument('--path', default='/api/clients/list/', help="What the clients read.")
+        parser.add_argument('--requests', type=int, default=500, help="The number of reads of each handler.")
+        parser.add_argument('--concurrency', type=int, default=32, help="The number of clients reading at once.")
+        parser.add_argument('--streams', type=int, default=0, help="The number of streams of the changes kept open.")
+        parser.add_argument('--threads', type=int, default=getattr(settings, 'API_READ_THREADS', 8),
+                            help="The number of WSGI workers, and of threads running the reads with ASGI.")
+
+    def handle(self, *args, **options):
+        try:
+            user = MyUser.objects.get(email=options['email'])
+        except MyUser.DoesNotExist:
+            raise CommandError(f"There's no user {options['email']}.")
+        client = Client()
+        client.force_login(user)
+        self.cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        self.path, self.query_string = options['path'].partition('?')[::2]
+        # The streams check whether to stop whenever they send a message.
+        heartbeat, ChangeStreamView.heartbeat = ChangeStreamView.heartbeat, 0.5
+        try:
+            if options['streams'] >= options['threads']:
+                self.stdout.write(f"WSGI: the {options['streams']} streams take all the workers, no read is served.")
+            else:
+                self.report("WSGI", self.run_wsgi(options['requests'], options['concurrency'], options['streams'],
+                                                  options['threads']))
+            self.report("ASGI", asyncio.run(self.run_asgi(options['requests'], options['concurrency'],
+                                                          options['streams'], options['threads'])))
+        finally:
+            ChangeStreamView.heartbeat = heartbeat
+
+    def report(self, name, results):
+        duration, latencies = results
+        latencies.sort()
+        self.stdout.write(f"{name}: {len(latencies) / duration:.0f} requests/s, latency median "
+                          f"{statistics.median(latencies) * 1000:.0f} ms, 99th percentile "
+                          f"{latencies[int(len(latencies) * 0.99)] * 1000:.0f} ms.")
+
+    def run_clients(self, requests, concurrency, read):
+        """Run `read` `requests` times from `concurrency` threads and return how long it took and the latencies."""
+        latencies = []
+        remaining = iter(range(requests))
+        lock = threading.Lock()
+
+        def run_client():
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                start = time.perf_counter()
+                read()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        clients = [threading.Thread(target=run_client) for _ in range(concurrency)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        return time.perf_counter() - start, latencies
+
+    def run_wsgi(self, requests, concurrency, streams, threads):
+        """Serve the requests like a WSGI server with `threads` workers: each request holds a worker until its response
+        has been sent."""
+        handler = WSGIHandler()
+        stopping = threading.Event()
+
+        def serve(path):
+            environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': self.query_string,
+                       'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost',
+                       'HTTP_COOKIE': self.cookie, 'HTTP_ACCEPT_ENCODING': 'gzip', 'wsgi.input': io.BytesIO(),
+                       'wsgi.url_scheme': 'http'}
+            response = handler(environ, lambda status, headers: None)
+            try:
+                for _ in response:
+                    if stopping.is_set():
+                        break
+            finally:
+                response.close()
+
+        with ThreadPoolExecutor(max_workers=threads) as workers:
+            for _ in range(streams):
+                workers.submit(serve, '/api/changes/')
+            try:
+                return self.run_clients(requests, concurrency, lambda: workers.submit(serve, self.path).result())
+            finally:
+                stopping.set()
+
+    async def run_asgi(self, requests, concurrency, streams, threads):
+        handler = ASGIHandler()
+        handler.read_executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='api-read')
+        loop = asyncio.get_running_loop()
+        stopping = asyncio.Event()
+
+        async def serve(path):
+            received = False
+
+            async def receive():
+                nonlocal received
+                if not received:
+                    received = True
+                    return {'type': 'http.request'}
+                await stopping.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                pass
+
+            scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                     'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                     'query_string': self.query_string.encode(), 'root_path': '', 'server': ('localhost', 80),
+                     'headers': [(b'host', b'localhost'), (b'cookie', self.cookie.encode()),
+                                 (b'accept-encoding', b'gzip')]}
+            await handler(scope, receive, send)
+
+        stream_tasks = [asyncio.ensure_future(serve('/api/changes/')) for _ in range(streams)]
+        try:
+            # The clients are threads, as with WSGI, waiting for the requests served by the loop.
+            return await loop.run_in_executor(None, self.run_clients, requests, concurrency,
+                                              lambda: asyncio.run_coroutine_threadsafe(serve(self.path), loop).result())
+        finally:
+            stopping.set()
+            await asyncio.gather(*stream_tasks)
+            handler.read_executor.shutdown()
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from api.imports import IMPORTS
+
+
+class Command(BaseCommand):
+    help = ("Import clients, contracts or events from a CSV file whose header names the columns. The rows that can't "
+            "be imported are written to another CSV file, with the reason they were rejected.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(IMPORTS), help="What the file has.")
+        parser.add_argument('path', help="The CSV file, in UTF-8.")
+        parser.add_argument('--rejected', help="Where to write the rejected rows. By default, next to the file, "
+                                               "with the .rejected.csv extension.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        rejected_path = options['rejected'] or path.rsplit('.', 1)[0] + '.rejected.csv'
+        try:
+            file = open(path, newline='', encoding='utf-8-sig')
+        except OSError as error:
+            raise CommandError(f"The file can't be read: {error}")
+        with file:
+            try:
+                csv_import = IMPORTS[options['kind']](file)
+            except ValueError as error:
+                raise CommandError(str(error))
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    imported, rejected = csv_import.run(cursor)
+                    if rejected:
+                        with open(rejected_path, 'w', newline='', encoding='utf-8') as rejected_file:
+                            csv_import.write_rejected(cursor, rejected_file)
+            except DatabaseError as error:
+                # COPY fails on the rows that aren't CSV with the columns of the header, and nothing is imported.
+                raise CommandError(f"Nothing was imported: {error}")
+        self.stdout.write(f"Imported {imported} {options['kind']}.")
+        if rejected:
+            self.stdout.write(f"Rejected {rejected} rows, written to {rejected_path}.")
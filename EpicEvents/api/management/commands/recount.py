@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from clients.models import Client
+
+
+class Command(BaseCommand):
+    help = ("Compute the numbers of contracts and events of the clients, and the amounts of their contracts, again from "
+            "the contracts and the events, and fix the clients whose counters are wrong. The database keeps them "
+            "otherwise, this is only needed if its triggers were disabled, like during a restore.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help="The number of clients per transaction.")
+
+    def handle(self, *args, **options):
+        fixed = Client.objects.recount(batch_size=options['batch_size'])
+        self.stdout.write(f"Fixed the counters of {fixed} clients.")
@@ -0,0 +1,28 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import TASKS, Worker
+
+
+class Command(BaseCommand):
+    help = ("Run the background jobs: the exports, imports, deletions and reassignments started through the API or the "
+            "admin. Several workers can run at once, on this machine or others using the same database. SIGTERM and "
+            "SIGINT stop the worker once its jobs are finished.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="The number of jobs run at once by this worker.")
+        parser.add_argument('--kind', action='append', choices=list(TASKS), dest='kinds',
+                            help="Only run the jobs of this kind. It can be given several times.")
+        parser.add_argument('--burst', action='store_true', help="Stop once no job is ready to run.")
+
+    def handle(self, *args, **options):
+        worker = Worker(threads=options['threads'], kinds=options['kinds'])
+        handlers = {signal_number: signal.signal(signal_number, lambda *args: worker.stop())
+                    for signal_number in (signal.SIGTERM, signal.SIGINT)}
+        self.stdout.write(f"Worker {worker.name} running {', '.join(worker.limits)} jobs.")
+        try:
+            worker.run(burst=options['burst'])
+        finally:
+            for signal_number, handler in handlers.items():
+                signal.signal(signal_number, handler)
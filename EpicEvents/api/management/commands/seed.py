@@ -0,0 +1,205 @@
+import array
+import csv
+import datetime
+import io
+import itertools
+import random
+import unicodedata
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from accounts.models import MyUser
+from clients.models import Client, Contract
+from events.models import Event
+
+FIRST_NAMES = ["Camille", "Léa", "Manon", "Chloé", "Inès", "Sarah", "Jade", "Louise", "Emma", "Alice", "Lucas", "Hugo",
+               "Louis", "Nathan", "Gabriel", "Jules", "Arthur", "Adam", "Raphaël", "Théo", "Paul", "Martin"]
+LAST_NAMES = ["Martin", "Bernard", "Thomas", "Petit", "Robert", "Richard", "Durand", "Dubois", "Moreau", "Laurent",
+              "Simon", "Michel", "Lefebvre", "Leroy", "Roux", "David", "Bertrand", "Morel", "Fournier", "Girard"]
+COMPANY_WORDS = ["Atelier", "Groupe", "Studio", "Maison", "Conseil", "Solutions", "Industries", "Événements", "Réseau",
+                 "Services", "Création", "Horizon", "Azur", "Nord", "Océan", "Alpes", "Lumière", "Avenir"]
+DOMAINS = ["gmail.com", "orange.fr", "free.fr", "outlook.fr", "laposte.net", "yahoo.fr"]
+NOTES = ["Buffet for all the attendees.", "Needs a stage and a sound system.", "Outdoor, plan a tent if it rains.",
+         "The client brings their own caterer.", "Parking for the guests.", "Shuttle from the train station."]
+# The data is spread over two years from that date, so that a seed gives the same data whenever it's run.
+START = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+PERIOD = 2 * 365 * 24 * 3600
+# The share of the clients who are only prospects, without a sales contact.
+PROSPECTS = 0.05
+# The exponent of the Zipf distribution of the clients between the salespeople, and of the events between the support
+# users: with 1.2, the top 10% of 50 salespeople have about 60% of the clients.
+OWNERSHIP_SKEW = 1.2
+# The exponent spreading the contracts between the clients: with 3, 10% of the clients have half the contracts and
+# most have none.
+CONTRACTS_SKEW = 3
+
+
+def email_name(name):
+    """Return a name in lowercase without its accents, for the emails."""
+    return unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode().lower()
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with generated users, clients, contracts and events, for benchmarks. The same seed "
+            "gives the same data on the same database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="The number of users of each role.")
+        parser.add_argument('--clients', type=int, default=1000)
+        parser.add_argument('--contracts', type=int, default=2000)
+        parser.add_argument('--events', type=int, default=1000, help="At most one per contract.")
+        parser.add_argument('--seed', type=int, help="By default, a random one, which is written out.")
+        parser.add_argument('--password', default="password", help="The password of all the users.")
+        parser.add_argument('--batch-size', type=int, default=100000, help="The number of rows copied at once.")
+
+    def handle(self, *args, **options):
+        if options['events'] > options['contracts']:
+            raise CommandError("There can't be more events than contracts.")
+        if options['users'] < 1 and (options['clients'] or options['contracts']):
+            raise CommandError("The clients and the contracts need users.")
+        seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        self.random = random.Random(seed)
+        self.batch_size = options['batch_size']
+        models = [MyUser, Client, Contract, Event]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {', '.join(model._meta.db_table for model in models)} "
+                           f"IN SHARE ROW EXCLUSIVE MODE")
+            # Otherwise the deferred foreign keys of millions of rows are all queued until the commit.
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute("SET LOCAL gin_pending_list_limit = '256MB'")
+            self.first_ids = {}
+            for model in models:
+                cursor.execute(f"SELECT coalesce(max(id), 0) + 1 FROM {model._meta.db_table}")
+                self.first_ids[model] = cursor.fetchone()[0]
+            users = self.create_users(options['users'], seed, options['password'])
+            sales_contacts = self.copy_clients(cursor, options['clients'], seed, users['sales'])
+            self.copy_contracts(cursor, options['contracts'], options['events'], sales_contacts, users['sales'],
+                                users['support'])
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+            for model in models:
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+        self.stdout.write(f"Created {options['users']} users of each role, {options['clients']} clients, "
+                          f"{options['contracts']} contracts and {options['events']} events with --seed {seed}.")
+
+    def create_users(self, count, seed, password):
+        """Create the users of each role and return their primary keys, by role."""
+        password = make_password(password)
+        users = [MyUser(email=f"{role}.{seed}-{i}@epicevents.example.com", first_name=self.random.choice(FIRST_NAMES),
+                        last_name=self.random.choice(LAST_NAMES).upper(), role=role, password=password)
+                 for role, _ in MyUser.roles for i in range(count)]
+        if MyUser.objects.filter(email__in=[user.email for user in users]).exists():
+            raise CommandError(f"The database already has the users of the seed {seed}.")
+        users = MyUser.objects.bulk_create(users)
+        return {role: [user.pk for user in users if user.role == role] for role, _ in MyUser.roles}
+
+    def zipf_weights(self, count):
+        """Return the cumulative weights of a Zipf distribution, for `random.choices`."""
+        return list(itertools.accumulate(1 / (rank + 1) ** OWNERSHIP_SKEW for rank in range(count)))
+
+    def random_date(self):
+        return START + datetime.timedelta(seconds=self.random.randrange(PERIOD))
+
+    def phone_number(self, mobile):
+        """Return a French phone number valid for PhoneNumberField."""
+        digits = ''.join(self.random.choices('0123456789', k=7))
+        if mobile:
+            return f"+336{self.random.choice('01245678')}{digits}"
+        return f"+33{self.random.choice('13')}{self.random.randrange(10)}{digits}"
+
+    def copy(self, cursor, model, columns, rows):
+        """Insert the rows with COPY, `batch_size` at a time so that memory doesn't depend on their number."""
+        while self.copy_batch(cursor, model, columns, itertools.islice(rows, self.batch_size)):
+            pass
+
+    def copy_batch(self, cursor, model, columns, rows):
+        """Insert the rows with a single COPY and return how many there were."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        if count:
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {model._meta.db_table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                               buffer)
+        return count
+
+    def copy_clients(self, cursor, count, seed, sales_users):
+        """Insert the clients, most of them owned by a few salespeople. Return the sales contact of each client."""
+        sales_weights = self.zipf_weights(len(sales_users))
+        # The index of the sales contact of each client, or -1 for the prospects. Four bytes per client.
+        sales_contacts = array.array('i')
+
+        def rows():
+            first_id = self.first_ids[Client]
+            for index in range(count):
+                first_name, last_name = self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES)
+                if sales_users and self.random.random() >= PROSPECTS:
+                    sales_contact = self.random.choices(range(len(sales_users)), cum_weights=sales_weights)[0]
+                else:
+                    sales_contact = -1
+                sales_contacts.append(sales_contact)
+                created = self.random_date()
+                email = f"{email_name(first_name)}.{email_name(last_name)}.{seed}-{index}@{self.random.choice(DOMAINS)}"
+                yield (first_id + index, first_name, last_name.upper(), email,
+                       self.phone_number(mobile=False),
+                       self.phone_number(mobile=True) if self.random.random() < 0.6 else None,
+                       f"{self.random.choice(COMPANY_WORDS)} {self.random.choice(COMPANY_WORDS)} {last_name}",
+                       created, created, sales_users[sales_contact] if sales_contact >= 0 else None)
+
+        self.copy(cursor, Client, ['id', 'first_name', 'last_name', 'email', 'phone_number', 'mobile_number',
+                                   'company_name', 'date_created', 'date_updated', 'sales_contact_id'], rows())
+        return sales_contacts
+
+    def copy_contracts(self, cursor, count, event_count, sales_contacts, sales_users, support_users):
+        """Insert the contracts and their events, in a single pass over the contracts.
+
+        The clients of the contracts are skewed towards the first clients. Each contract gets an event with the
+        probability that leaves exactly `event_count` events once all of them are made."""
+        if count and not any(sales_contact >= 0 for sales_contact in sales_contacts):
+            raise CommandError("The contracts need clients with a sales contact.")
+        support_weights = self.zipf_weights(len(support_users))
+        events = []
+
+        def contract_rows():
+            first_id = self.first_ids[Contract]
+            remaining_events = event_count
+            for index in range(count):
+                # The clients without sales contact can't have contracts, another one is drawn instead.
+                client = int(len(sales_contacts) * self.random.random() ** CONTRACTS_SKEW)
+                while sales_contacts[client] < 0:
+                    client = self.random.randrange(len(sales_contacts))
+                created = self.random_date()
+                payment_due = created + datetime.timedelta(days=self.random.randint(15, 120))
+                status = self.random.random() < 0.6
+                yield (first_id + index, self.first_ids[Client] + client, sales_users[sales_contacts[client]], status,
+                       round(self.random.lognormvariate(8, 1), 2), payment_due, created, created)
+                # Selection sampling: exactly `event_count` contracts get an event, without keeping them all.
+                if self.random.random() * (count - index) < remaining_events:
+                    remaining_events -= 1
+                    events.append((self.first_ids[Contract] + index, self.first_ids[Client] + client, created,
+                                   payment_due))
+
+        def event_rows():
+            first_id = self.first_ids[Event]
+            for index, (contract, client, created, payment_due) in enumerate(events):
+                support = support_users[self.random.choices(range(len(support_users)), cum_weights=support_weights)[0]]
+                yield (first_id + index, contract, client, support, self.random.randint(5, 500),
+                       payment_due + datetime.timedelta(days=self.random.randint(-10, 60)),
+                       self.random.choice(NOTES) if self.random.random() < 0.3 else None, created, created)
+
+        contract_columns = ['id', 'client_id', 'sales_contact_id', 'status', 'amount', 'payment_due', 'date_created',
+                            'date_updated']
+        event_columns = ['id', 'contract_id', 'client_id', 'support_id', 'attendees', 'date', 'notes', 'date_created',
+                         'date_updated']
+        contracts = contract_rows()
+        # The events of each batch of contracts are copied after it, so that only a batch of them is kept.
+        while self.copy_batch(cursor, Contract, contract_columns, itertools.islice(contracts, self.batch_size)):
+            self.copy_batch(cursor, Event, event_columns, event_rows())
+            self.first_ids[Event] += len(events)
+            events.clear()
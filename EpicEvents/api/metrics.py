@@ -0,0 +1,237 @@
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# The request being served, whose name of URL labels what's counted meanwhile, like its queries.
+request_var = contextvars.ContextVar('metrics_request', default=None)
+
+
+def get_view_name(request=None):
+    """Return the name of the URL of a request, by default the one being served, or '' if there's none."""
+    if request is None:
+        request = request_var.get()
+    match = getattr(request, 'resolver_match', None)
+    return (match and match.url_name) or ''
+
+
+def merge(totals, values):
+    """Add `values` to `totals`, both mapping the metrics and their labels to a number, or to the counts of a
+    histogram."""
+    for key, value in values.items():
+        if isinstance(value, list):
+            counts = totals.get(key)
+            if counts is None:
+                totals[key] = list(value)
+            else:
+                for i, count in enumerate(value):
+                    counts[i] += count
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+class Registry:
+    """The metrics of this process, which the processes of the server write to METRICS_DIR to add them up.
+
+    Each thread counts in its own dictionary, so that the requests never wait for each other: the lock is only taken
+    the first time a thread counts something and when the values are read. The values of the process are written to
+    its own file after a request, at most every `flush_interval` seconds, and when it exits. The files of the processes
+    gone are kept, so that the counters never go backwards, until the directory is emptied."""
+    flush_interval = 10
+
+    def __init__(self):
+        self.metrics = {}
+        self.reset()
+        # A process forked after counting, like a worker of gunicorn, starts from zero with its own file.
+        os.register_at_fork(after_in_child=self.reset)
+        atexit.register(self.flush)
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # The threads that counted something and their values, then the values of those which stopped.
+        self.threads = []
+        self.stopped = {}
+        self.file_name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+        self.flushed_at = time.monotonic()
+
+    def get_values(self):
+        """Return the values counted by the current thread."""
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = {}
+            with self.lock:
+                self.threads.append((threading.current_thread(), values))
+            return values
+
+    def collect(self):
+        """Return the values counted by all the threads of this process."""
+        with self.lock:
+            running = []
+            for thread, values in self.threads:
+                if thread.is_alive():
+                    running.append((thread, values))
+                else:
+                    merge(self.stopped, values)
+            self.threads = running
+            totals = {}
+            merge(totals, self.stopped)
+            for thread, values in running:
+                # Copying the dictionary doesn't let its thread change it meanwhile.
+                merge(totals, values.copy())
+        return totals
+
+    def collect_all(self):
+        """Return the values counted by all the processes writing to METRICS_DIR, this one included."""
+        totals = self.collect()
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return totals
+        for path in Path(directory).glob('*.json'):
+            if path.name == self.file_name:
+                continue
+            try:
+                with open(path) as file:
+                    samples = json.load(file)
+            except (OSError, ValueError):
+                # The file was removed, or its process is being replaced.
+                continue
+            merge(totals, {(name, tuple(labels)): value for name, labels, value in samples})
+        return totals
+
+    def flush(self):
+        """Write the values of this process to its file in METRICS_DIR."""
+        directory = getattr(settings, 'METRICS_DIR', None)
+        if not directory:
+            return
+        self.flushed_at = time.monotonic()
+        samples = [[name, labels, value] for (name, labels), value in self.collect().items()]
+        path = Path(directory) / self.file_name
+        temporary_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(temporary_path, 'w') as file:
+                json.dump(samples, file)
+            # Renaming it, the other processes never read a file half written.
+            os.replace(temporary_path, path)
+        except OSError:
+            logger.exception("The metrics couldn't be written to %s.", path)
+
+    def flush_if_due(self):
+        if time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def render(self, values):
+        """Return the values in the text format of Prometheus."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for (name, label_values), value in sorted(values.items()):
+                if name == metric.name:
+                    lines.extend(metric.render(dict(zip(metric.labels, label_values)), value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def format_sample(name, labels, value):
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for value in labels.values())
+    labels = ','.join(f'{label}="{value}"' for label, value in zip(labels, escaped))
+    return f"{name}{{{labels}}} {value}" if labels else f"{name} {value}"
+
+
+class Counter:
+    """A number that only goes up, like the number of requests, for each value of its labels."""
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=(), registry=registry):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.registry = registry
+        self.registry.metrics[name] = self
+
+    def inc(self, amount=1, **labels):
+        values = self.registry.get_values()
+        key = (self.name, tuple(labels[label] for label in self.labels))
+        values[key] = values.get(key, 0) + amount
+
+    def render(self, labels, value):
+        return [format_sample(self.name, labels, value)]
+
+
+class Histogram(Counter):
+    """The number of values observed, like the durations of the requests, below each of the `buckets`, with their
+    sum."""
+    type = 'histogram'
+    # In seconds, for durations.
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labels=(), registry=registry, buckets=default_buckets):
+        super().__init__(name, documentation, labels, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        values = self.registry.get_values()
+        key = (self.name, tuple(labels[label] for label in self.labels))
+        # The count of each bucket, the last one without bound, then the sum.
+        counts = values.get(key)
+        if counts is None:
+            counts = values[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self, labels, counts):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            total += count
+            lines.append(format_sample(f"{self.name}_bucket", {**labels, 'le': bound}, total))
+        lines.append(format_sample(f"{self.name}_sum", labels, counts[-1]))
+        lines.append(format_sample(f"{self.name}_count", labels, total))
+        return lines
+
+
+REQUESTS = Counter('epicevents_requests_total', "The requests served, by name of their URL, method and status.",
+                   ('view', 'method', 'status'))
+REQUEST_DURATION = Histogram('epicevents_request_duration_seconds', "The time taken to serve the requests, by name "
+                             "of their URL.", ('view',))
+QUERIES = Counter('epicevents_db_queries_total', "The queries made to the database, by name of the URL of the "
+                  "request making them.", ('view',))
+QUERY_DURATION = Counter('epicevents_db_query_duration_seconds_total', "The time taken by the queries made to the "
+                         "database, by name of the URL of the request making them.", ('view',))
+CACHE_REQUESTS = Counter('epicevents_cache_requests_total', "The reads of the caches, by cache and whether they found "
+                         "the value, `hit`, or not, `miss`.", ('cache', 'result'))
+PERMISSION_DENIED = Counter('epicevents_permission_denied_total', "The requests refused to the user for lack of "
+                            "permission, by name of their URL.", ('view',))
+
+
+def count_queries(execute, sql, params, many, context):
+    """Count a query and its duration. It wraps the execution of every query, see ApiConfig.ready."""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        view = get_view_name()
+        QUERIES.inc(view=view)
+        QUERY_DURATION.inc(time.perf_counter() - start, view=view)
+
+
+def watch_queries(sender, connection, **kwargs):
+    """Count the queries of a new connection to the database."""
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, count_queries)
@@ -0,0 +1,226 @@
+import asyncio
+import time
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics, profiling
+from .models import Profile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class GzipCompressor:
+    """A gzip compressor with the methods of the brotli one."""
+
+    def __init__(self, level):
+        # 31 makes zlib write the gzip header and trailer.
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+def brotli_compressor(quality):
+    return brotli.Compressor(quality=quality)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compress the responses with brotli or gzip, whichever the client prefers.
+
+    Responses shorter than `min_length` are left as they are, compressing them costs more than it saves. The cost of
+    compressing is capped by using the fastest levels for responses longer than `large_length`. Streaming responses are
+    compressed chunk by chunk, and each compressed chunk is flushed, so that the client gets them as they come."""
+    min_length = 1024
+    large_length = 1024 * 1024
+    # The compressor and the levels used for each encoding, for regular and large responses, by order of preference.
+    encodings = {'gzip': (GzipCompressor, 6, 1)}
+    if brotli is not None:
+        encodings = {'br': (brotli_compressor, 5, 1), **encodings}
+
+    def get_encoding(self, accept_encoding):
+        """Return the encoding to use for an Accept-Encoding header, or None if the client accepts none of them."""
+        qualities = {}
+        for item in accept_encoding.split(','):
+            name, *params = item.split(';')
+            quality = 1.0
+            for param in params:
+                key, _, value = param.strip().partition('=')
+                if key == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            qualities[name.strip().lower()] = quality
+        best, best_quality = None, 0.0
+        for encoding in self.encodings:
+            quality = qualities.get(encoding, qualities.get('*', 0.0))
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < self.min_length:
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.get_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        compressor_class, level, large_level = self.encodings[encoding]
+        if response.streaming:
+            if getattr(response, 'is_async', False):
+                compress_stream = self.compress_async_stream
+            else:
+                compress_stream = self.compress_stream
+            response.streaming_content = compress_stream(compressor_class(level), response.streaming_content)
+            # The compressed length isn't known until the stream ends.
+            del response['Content-Length']
+        else:
+            compressor = compressor_class(large_level if len(response.content) > self.large_length else level)
+            compressed = compressor.process(response.content) + compressor.finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # Like the GZipMiddleware of Django, the ETags must be weak once the content is compressed.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def compress_stream(compressor, stream):
+        for chunk in stream:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+
+    @staticmethod
+    async def compress_async_stream(compressor, stream):
+        async for chunk in stream:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+
+
+class MetricsMiddleware:
+    """Count the requests by the name of their URL, with their durations, for the metrics of api.metrics.
+
+    It runs asynchronously under ASGI, so that the requests don't wait for the thread of the synchronous code."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Like the MiddlewareMixin of Django, so that the handler awaits it.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        token = metrics.request_var.set(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.request_var.reset(token)
+        self.record(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        token = metrics.request_var.set(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.request_var.reset(token)
+        self.record(request, response, start)
+        return response
+
+    @staticmethod
+    def record(request, response, start):
+        view = metrics.get_view_name(request)
+        metrics.REQUESTS.inc(view=view, method=request.method, status=str(response.status_code))
+        metrics.REQUEST_DURATION.observe(time.perf_counter() - start, view=view)
+        metrics.registry.flush_if_due()
+
+
+class ProfilerMiddleware:
+    """Profile the requests of the gestion users asked for with `?profile=true` or the header `X-Profile: true`, and
+    one in PROFILE_SAMPLE_RATE requests, and store their profiles, see api.profiling.
+
+    It comes after the AuthenticationMiddleware, so that the user asking for a profile is known before anything is
+    recorded: the other users, and the clients of the API which don't log in with a session, aren't profiled. With
+    WSGI, the calls of the rest of the request are recorded. Under ASGI only the ones of the view are, by the handler
+    of api.asgi, since it runs in another thread than the middlewares. A request that isn't profiled only has its query
+    parameters checked."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        profile = self.get_profile(profiling.is_asked(request) and self.may_ask(request))
+        if profile is None:
+            return self.get_response(request)
+        token = profiling.profile_var.set(profile)
+        try:
+            response = profile.enabled(self.get_response, request)
+        finally:
+            profiling.profile_var.reset(token)
+        self.store(profile, request, response)
+        return response
+
+    async def __acall__(self, request):
+        # Finding the user of the session queries the database, it's only done for the requests asking for a profile.
+        asked = profiling.is_asked(request) and await sync_to_async(self.may_ask, thread_sensitive=True)(request)
+        profile = self.get_profile(asked)
+        if profile is None:
+            return await self.get_response(request)
+        token = profiling.profile_var.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            profiling.profile_var.reset(token)
+        await sync_to_async(self.store, thread_sensitive=True)(profile, request, response)
+        return response
+
+    @staticmethod
+    def may_ask(request):
+        """Return whether the user of the request may ask for a profile, only the gestion users may."""
+        return request.user.is_authenticated and request.user.role == 'gestion'
+
+    @staticmethod
+    def get_profile(asked):
+        if asked or profiling.is_sampled():
+            return profiling.RequestProfile(sampled=not asked)
+        return None
+
+    @staticmethod
+    def store(profile, request, response):
+        profile.finish()
+        Profile.objects.store(profile, request, response)
@@ -0,0 +1,73 @@
+from django.db import migrations
+
+# The channel the changes are notified on, read by api.changes.
+CHANNEL = 'api_changes'
+# The number of objects per notification, whose payload can't be longer than 8000 bytes.
+CHUNK_SIZE = 150
+
+# The users each object matters to, as the primary key and the user of the changed rows in `{rows}`: the sales contact
+# of the clients and of the contracts, and the support and the sales contact of the contract of the events.
+OWNERS = {
+    'clients_client': ('client', "SELECT id, sales_contact_id AS owner FROM {rows}"),
+    'clients_contract': ('contract', "SELECT id, sales_contact_id AS owner FROM {rows}"),
+    'events_event': ('event', "SELECT id, support_id AS owner FROM {rows} UNION "
+                              "SELECT r.id, c.sales_contact_id FROM {rows} AS r "
+                              "JOIN clients_contract AS c ON c.id = r.contract_id"),
+}
+
+
+def notify(model, action, owners, rows):
+    """Return the statement notifying the changes of the rows, grouped by object, in chunks of CHUNK_SIZE objects."""
+    changes = " UNION ".join(owners.format(rows=name) for name in rows)
+    return f"""
+        PERFORM pg_notify('{CHANNEL}', json_build_object(
+            'model', '{model}', 'action', '{action}', 'ids', array_agg(id ORDER BY id),
+            'owners', json_agg(owners ORDER BY id))::text)
+        FROM (
+            SELECT id, owners, (row_number() OVER (ORDER BY id) - 1) / {CHUNK_SIZE} AS chunk
+            FROM (SELECT id, array_agg(DISTINCT owner) AS owners FROM ({changes}) AS changes GROUP BY id) AS objects
+        ) AS chunks
+        GROUP BY chunk;"""
+
+
+def create_triggers():
+    statements = []
+    for table, (model, owners) in OWNERS.items():
+        statements.append(f"""
+            CREATE FUNCTION {table}_notify_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN {notify(model, 'create', owners, ['new_rows'])}
+                ELSIF TG_OP = 'UPDATE' THEN {notify(model, 'update', owners, ['old_rows', 'new_rows'])}
+                ELSE {notify(model, 'delete', owners, ['old_rows'])}
+                END IF;
+                RETURN NULL;
+            END $$;""")
+        # A trigger with transition tables can only have one event.
+        for event, tables in (('INSERT', 'NEW TABLE AS new_rows'),
+                              ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+                              ('DELETE', 'OLD TABLE AS old_rows')):
+            statements.append(f"""
+                CREATE TRIGGER {table}_notify_{event.lower()} AFTER {event} ON {table} REFERENCING {tables}
+                FOR EACH STATEMENT EXECUTE FUNCTION {table}_notify_changes();""")
+    return statements
+
+
+def drop_triggers():
+    return [f"DROP FUNCTION {table}_notify_changes() CASCADE;" for table in OWNERS]
+
+
+class Migration(migrations.Migration):
+    """Notify the changes of the clients, the contracts and the events, whatever made them.
+
+    The triggers are per statement, so that a statement changing many rows sends a few notifications rather than one
+    per row. The notifications are only sent when the transaction is committed."""
+
+    dependencies = [
+        ('api', '0004_auto_20210907_0929'),
+        ('clients', '0007_contract_id_client_unique'),
+        ('events', '0005_event_client_matches_contract'),
+    ]
+
+    operations = [
+        migrations.RunSQL(create_triggers(), drop_triggers()),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-19 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_job'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['kind', 'run_after'], name='api_job_kind_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.7 on 2026-10-19 18:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0007_job_kind_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Profile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('sampled', models.BooleanField(default=False)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.TextField()),
+                ('view', models.CharField(blank=True, max_length=255)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('duration', models.FloatField()),
+                ('query_count', models.PositiveIntegerField()),
+                ('query_duration', models.FloatField()),
+                ('queries', models.JSONField(default=list)),
+                ('summary', models.TextField(blank=True)),
+                ('stats_file', models.CharField(max_length=255)),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='profiles', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
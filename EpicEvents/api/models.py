@@ -0,0 +1,179 @@
+import datetime
+import os
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import profiling
+
+# The channel the workers are told about new jobs on.
+CHANNEL = 'api_jobs'
+# The seconds before a failed job is tried again, doubled at each attempt.
+RETRY_DELAY = 60
+
+
+class JobManager(models.Manager):
+    def enqueue(self, kind, arguments=None, created_by=None, max_attempts=3):
+        """Create a job and wake up the workers. They start it once the transaction is committed."""
+        job = self.create(kind=kind, arguments=arguments or {}, created_by=created_by, max_attempts=max_attempts)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, kind])
+        return job
+
+    def claim(self, worker, limits, stale_after, schedules=None):
+        """Mark the next job that can run as run by `worker` and return it, or None if there's none.
+
+        `limits` maps the kinds of jobs a worker can run to how many of them may run at once, whatever the worker.
+        The jobs whose worker hasn't been heard of for `stale_after` seconds are given up first: the worker is gone,
+        and the job is tried again, or fails if it was its last attempt. `schedules` maps the kinds of jobs started
+        periodically to their interval in seconds: the next one is queued when none is queued or running."""
+        now = timezone.now()
+        with transaction.atomic():
+            # The claims are made one at a time, so that the jobs running are counted right against the limits.
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [CHANNEL])
+            for job in self.filter(status='running', heartbeat__lt=now - datetime.timedelta(seconds=stale_after)):
+                job.retry_or_fail("The worker running the job stopped.")
+            for kind, interval in (schedules or {}).items():
+                # A job queued or running is the last one to run, even if it was delayed.
+                last = self.filter(kind=kind).order_by('-run_after').values_list('run_after', 'status').first()
+                if last is None:
+                    self.create(kind=kind, run_after=now)
+                elif last[1] not in ('queued', 'running'):
+                    self.create(kind=kind, run_after=max(now, last[0] + datetime.timedelta(seconds=interval)))
+            running = dict(self.filter(status='running').values('kind').annotate(count=models.Count('pk'))
+                           .values_list('kind', 'count'))
+            kinds = [kind for kind, limit in limits.items() if running.get(kind, 0) < limit]
+            job = self.filter(status='queued', kind__in=kinds, run_after__lte=now) \
+                .order_by('run_after', 'pk').select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            self.filter(pk=job.pk).update(status='running', worker=worker, attempts=F('attempts') + 1,
+                                          date_started=now, heartbeat=now, progress=0, total=None)
+            job.refresh_from_db()
+        return job
+
+
+class Job(models.Model):
+    """An operation too long for a request, run in the background by the `runjobs` command.
+
+    The kinds of jobs are the tasks of api.jobs. A job failing is tried again later, up to `max_attempts` times."""
+    statuses = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+    kind = models.CharField(max_length=50)
+    arguments = models.JSONField(default=dict)
+    status = models.CharField(choices=statuses, max_length=10, default='queued')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True,
+                                   related_name='jobs')
+    date_created = models.DateTimeField(auto_now_add=True)
+    # A job isn't started before then, which delays the next attempt of a failed job.
+    run_after = models.DateTimeField(default=timezone.now)
+    date_started = models.DateTimeField(null=True, blank=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    # The number of items done, out of `total` if the task knows it.
+    progress = models.PositiveBigIntegerField(default=0)
+    total = models.PositiveBigIntegerField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    # The name of the file the job made, in JOBS_DIR.
+    result_file = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    # The worker running the job, and the last time it said it was.
+    worker = models.CharField(max_length=255, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_after', 'id'], condition=Q(status='queued'), name='api_job_queued_idx'),
+            models.Index(fields=['kind', 'run_after'], name='api_job_kind_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.pk} ({self.status})"
+
+    def set_progress(self, done, total=None):
+        """Tell how far the job is. The worker saves it with its heartbeat, outside the transaction of the job."""
+        self.progress = done
+        if total is not None:
+            self.total = total
+
+    def succeed(self, result=None, result_file=''):
+        return self.finish(status='succeeded', result=result, result_file=result_file, error='',
+                           progress=self.progress, total=self.total)
+
+    def retry_or_fail(self, error, retry_delay=RETRY_DELAY):
+        """Queue the job again in `retry_delay` seconds, doubled at each attempt, or make it fail if it was its last
+        attempt."""
+        if self.attempts < self.max_attempts:
+            delay = datetime.timedelta(seconds=retry_delay * 2 ** (self.attempts - 1))
+            return self.finish(status='queued', error=error, date_finished=None, run_after=timezone.now() + delay)
+        return self.finish(status='failed', error=error)
+
+    def finish(self, **fields):
+        """Save the outcome of the attempt, unless another worker took the job over since it started."""
+        fields = {'date_finished': timezone.now(), 'worker': '', 'heartbeat': None, **fields}
+        updated = Job.objects.filter(pk=self.pk, status='running', worker=self.worker).update(**fields)
+        for name, value in fields.items():
+            setattr(self, name, value)
+        return bool(updated)
+
+
+class ProfileManager(models.Manager):
+    # The most recent profiles kept, the older ones are deleted with their file.
+    max_kept = 500
+
+    def store(self, profile, request, response):
+        """Save the profile of a request with its response, and delete the oldest profiles beyond `max_kept`."""
+        user = getattr(request, 'user', None)
+        match = request.resolver_match
+        stored = self.create(
+            user=user if user is not None and user.is_authenticated else None, sampled=profile.sampled,
+            method=request.method, path=request.get_full_path(), view=(match and match.url_name) or '',
+            status=response.status_code, duration=profile.duration, query_count=profile.query_count,
+            query_duration=profile.query_duration, queries=profile.queries, summary=profile.get_summary(),
+            stats_file=profile.dump())
+        old = self.filter(pk__lte=stored.pk).order_by('-pk')[self.max_kept:]
+        for name in old.values_list('stats_file', flat=True):
+            try:
+                os.remove(profiling.get_path(name))
+            except FileNotFoundError:
+                pass
+        self.filter(pk__in=old.values('pk')).delete()
+        return stored
+
+
+class Profile(models.Model):
+    """The profile of a request, asked for by a gestion user or sampled, see api.middleware.ProfilerMiddleware."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='profiles')
+    date_created = models.DateTimeField(auto_now_add=True)
+    # Whether the request was profiled by sampling rather than asked for.
+    sampled = models.BooleanField(default=False)
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    # The name of the URL of the request, like `event_list`.
+    view = models.CharField(max_length=255, blank=True)
+    status = models.PositiveSmallIntegerField()
+    # In seconds, until the response was returned, without sending a streamed content.
+    duration = models.FloatField()
+    query_count = models.PositiveIntegerField()
+    query_duration = models.FloatField()
+    # The first queries, like `{"start": 0.012, "duration": 0.003, "sql": "SELECT ..."}`, in seconds since the start.
+    queries = models.JSONField(default=list)
+    # The functions taking the longest, as printed by pstats.
+    summary = models.TextField(blank=True)
+    # The name of the file with the calls recorded by cProfile, in PROFILES_DIR.
+    stats_file = models.CharField(max_length=255)
+
+    objects = ProfileManager()
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration * 1000:.0f} ms)"
@@ -1,3 +1,7 @@
+import hmac
+
+from django.conf import settings
+from django.db.models import Q
 from rest_framework import permissions
 
 
@@ -14,6 +18,15 @@ class IsContactOrReadOnly(permissions.BasePermission):
             (view.queryset.filter(pk=obj.id, sales_contact__isnull=True).exists() and request.user.role == "sales") or \
             request.user.role == "gestion"  # Either the user is the sales_contact OR there is no sales_contact OR the user is a gestion user.
 
+    def get_changeable(self, request, view):
+        """Return the Q object matching the objects has_object_permission lets the user change, or True if it's all
+        of them, to check many objects in a single query."""
+        if request.user.role == "gestion":
+            return True
+        if request.user.role == "sales":
+            return Q(sales_contact=request.user) | Q(sales_contact__isnull=True)
+        return Q(sales_contact=request.user)
+
 
 class IsContactOrSupportOrReadOnly(permissions.BasePermission):
 
@@ -28,7 +41,26 @@ class IsContactOrSupportOrReadOnly(permissions.BasePermission):
         return view.queryset.filter(pk=obj.id, support=request.user).exists() or request.user.role == "gestion"
         # Only the corresponding support or a gestion user can edit those objects.
 
+    def get_changeable(self, request, view):
+        """Return the Q object matching the objects has_object_permission lets the user change, or True if it's all
+        of them, to check many objects in a single query."""
+        if request.user.role == "gestion":
+            return True
+        return Q(support=request.user)
+
 
 class IsManager(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user.role == "gestion"
+
+
+class CanReadMetrics(permissions.BasePermission):
+    """Let the gestion users read the metrics, and Prometheus with the METRICS_TOKEN of the settings as a bearer
+    token."""
+
+    def has_permission(self, request, view):
+        token = getattr(settings, "METRICS_TOKEN", None)
+        keyword, _, credentials = request.headers.get("Authorization", "").partition(" ")
+        if token and keyword.lower() == "bearer" and hmac.compare_digest(credentials.encode(), token.encode()):
+            return True
+        return request.user.is_authenticated and request.user.role == "gestion"
@@ -0,0 +1,127 @@
+import cProfile
+import contextvars
+import functools
+import io
+import os
+import pstats
+import random
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+
+# The profile of the request being served, if it's profiled.
+profile_var = contextvars.ContextVar('profile', default=None)
+# The query parameter and the header asking for a request to be profiled, like `?profile=true`.
+PARAMETER = 'profile'
+HEADER = 'HTTP_X_PROFILE'
+
+
+def is_asked(request):
+    """Return whether the request asks to be profiled. The query parameter is removed, the views don't expect it."""
+    asked = request.META.get(HEADER, '').lower() in ('1', 'true')
+    if PARAMETER in request.GET:
+        asked = asked or request.GET[PARAMETER].lower() in ('1', 'true')
+        request.GET = request.GET.copy()
+        del request.GET[PARAMETER]
+    return asked
+
+
+def is_sampled():
+    """Return whether to profile a request, for one in PROFILE_SAMPLE_RATE requests, or none if it's 0."""
+    rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+    return bool(rate) and random.randrange(rate) == 0
+
+
+class RequestProfile:
+    """The profile of a request: its calls, recorded by cProfile, and the timeline of its queries.
+
+    cProfile only records the calls of the threads the profile is enabled in, see `enabled`. The queries are recorded
+    whatever their thread, without their parameters, up to `max_queries`."""
+    max_queries = 1000
+
+    def __init__(self, sampled=False):
+        self.sampled = sampled
+        self.profiler = cProfile.Profile()
+        self.running = False
+        self.start = time.perf_counter()
+        self.duration = None
+        self.queries = []
+        self.query_count = 0
+        self.query_duration = 0.0
+
+    def enabled(self, function, *args, **kwargs):
+        """Call a function with the profiler enabled in the current thread, unless it already is."""
+        if self.running:
+            return function(*args, **kwargs)
+        self.running = True
+        self.profiler.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.profiler.disable()
+            self.running = False
+
+    def add_query(self, sql, start, end):
+        self.query_count += 1
+        self.query_duration += end - start
+        if len(self.queries) < self.max_queries:
+            self.queries.append({'start': round(start - self.start, 6), 'duration': round(end - start, 6),
+                                 'sql': sql})
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+
+    def get_summary(self, limit=40):
+        """Return the `limit` functions taking the longest, with the ones they call, as printed by pstats."""
+        stream = io.StringIO()
+        try:
+            pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(limit)
+        except TypeError:
+            # Nothing was recorded, the view ran in a thread the profile wasn't enabled in.
+            return ''
+        return stream.getvalue()
+
+    def dump(self):
+        """Write the calls to a file in PROFILES_DIR, for pstats or snakeviz, and return its name there."""
+        os.makedirs(settings.PROFILES_DIR, exist_ok=True)
+        name = f"{uuid.uuid4().hex}.prof"
+        self.profiler.dump_stats(get_path(name))
+        return name
+
+
+def get_path(name):
+    """Return the path of a file of the profiles, in PROFILES_DIR."""
+    return Path(settings.PROFILES_DIR) / name
+
+
+def profiled(view):
+    """Run a synchronous view with the profile of the request enabled in the thread running it.
+
+    The ASGI handler of api.asgi runs the views in other threads than the middleware, see ProfilerMiddleware."""
+    @functools.wraps(view)
+    def profiled_view(request, *args, **kwargs):
+        profile = profile_var.get()
+        if profile is None:
+            return view(request, *args, **kwargs)
+        return profile.enabled(view, request, *args, **kwargs)
+    return profiled_view
+
+
+def record_queries(execute, sql, params, many, context):
+    """Add the query to the profile of the request, if it's profiled. It wraps the execution of every query."""
+    profile = profile_var.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, start, time.perf_counter())
+
+
+def watch_queries(sender, connection, **kwargs):
+    """Record the queries of a new connection to the database in the profiles."""
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
@@ -0,0 +1,41 @@
+from phonenumber_field.phonenumber import PhoneNumber
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONEncoder(encoders.JSONEncoder):
+    """The encoder of DRF, also encoding the phone numbers like their fields do."""
+
+    def default(self, obj):
+        if isinstance(obj, PhoneNumber):
+            return str(obj)
+        return super().default(obj)
+
+
+encoder = JSONEncoder()
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """Render JSON with orjson when it is installed, which is several times faster than the json module.
+
+    The output is the same as the one of the JSONRenderer of DRF, except for NaN and infinite floats, which DRF refuses
+    and orjson renders as null.
+    The json module is used when orjson isn't installed, or for what orjson can't do, like indenting by 4 spaces."""
+    encoder_class = JSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact \
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=encoder.default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # Like integers too large for 64 bits.
+            return super().render(data, accepted_media_type, renderer_context)
+        # Like DRF, escape the line terminators that JavaScript doesn't allow in strings.
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
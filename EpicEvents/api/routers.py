@@ -0,0 +1,75 @@
+from django.urls import re_path
+from rest_framework.routers import DynamicRoute, Route, SimpleRouter
+
+
+class LazyViewSetView:
+    """A view calling `as_view` on a viewset the first time it is used rather than when the URLs are loaded."""
+    # DRF views are exempted from the CSRF middleware, the authentication classes check it themselves.
+    csrf_exempt = True
+
+    def __init__(self, viewset, actions, **initkwargs):
+        self.cls = viewset
+        self.actions = actions
+        self.initkwargs = initkwargs
+        self._view = None
+
+    @property
+    def view(self):
+        if self._view is None:
+            self._view = self.cls.as_view(self.actions, **self.initkwargs)
+        return self._view
+
+    def __call__(self, request, *args, **kwargs):
+        return self.view(request, *args, **kwargs)
+
+
+class APIRouter(SimpleRouter):
+    """A router generating a URL for each action of the registered viewsets.
+
+    The URLs are the ones the API had when each action had its own view, so that existing clients keep working."""
+    routes = [
+        # Listing with POST is kept for compatibility, the responses to it are never cached.
+        Route(url=r'^{prefix}/list/$', mapping={'get': 'list', 'post': 'list'}, name='{basename}_list',
+              detail=False, initkwargs={'suffix': 'List'}),
+        Route(url=r'^{prefix}/create/$', mapping={'post': 'create'}, name='{basename}_create',
+              detail=False, initkwargs={}),
+        DynamicRoute(url=r'^{prefix}/{url_path}/$', name='{basename}_{url_name}', detail=False, initkwargs={}),
+        Route(url=r'^{prefix}/{lookup}/$', mapping={'get': 'retrieve'}, name='{basename}_find',
+              detail=True, initkwargs={'suffix': 'Instance'}),
+        Route(url=r'^{prefix}/{lookup}/edit$', mapping={'post': 'partial_update'}, name='{basename}_change',
+              detail=True, initkwargs={}),
+        Route(url=r'^{prefix}/delete/{lookup}$', mapping={'post': 'destroy'}, name='{basename}_delete',
+              detail=True, initkwargs={}),
+        DynamicRoute(url=r'^{prefix}/{lookup}/{url_path}$', name='{basename}_{url_name}', detail=True, initkwargs={}),
+    ]
+
+    def __init__(self):
+        super().__init__()
+        self.prefix_overrides = {}
+
+    def register(self, prefix, viewset, basename=None, prefix_overrides=None):
+        """Register a viewset. `prefix_overrides` maps the name of a route to a prefix used instead of `prefix`."""
+        super().register(prefix, viewset, basename)
+        self.prefix_overrides[self.registry[-1][2]] = prefix_overrides or {}
+
+    def get_lookup_regex(self, viewset, lookup_prefix=''):
+        """Only accept integers as primary keys, like the int converter did."""
+        lookup_field = getattr(viewset, 'lookup_field', 'pk')
+        lookup_url_kwarg = getattr(viewset, 'lookup_url_kwarg', None) or lookup_field
+        lookup_value = getattr(viewset, 'lookup_value_regex', '[0-9]+')
+        return f'(?P<{lookup_prefix}{lookup_url_kwarg}>{lookup_value})'
+
+    def get_urls(self):
+        urls = []
+        for prefix, viewset, basename in self.registry:
+            lookup = self.get_lookup_regex(viewset)
+            for route in self.get_routes(viewset):
+                mapping = self.get_method_map(viewset, route.mapping)
+                if not mapping:
+                    continue
+                name = route.name.format(basename=basename)
+                route_prefix = self.prefix_overrides[basename].get(name, prefix)
+                regex = route.url.format(prefix=route_prefix, lookup=lookup)
+                initkwargs = {**route.initkwargs, 'basename': basename, 'detail': route.detail}
+                urls.append(re_path(regex, LazyViewSetView(viewset, mapping, **initkwargs), name=name))
+        return urls
@@ -1,8 +1,14 @@
+import json
+
 from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
-from accounts.models import MyUser
+from rest_framework.settings import api_settings
+from accounts.models import MyUser, Reassignment
+from .models import Job, Profile
 from clients.models import Contract, Client
-from events.models import Event
+from events.models import CLIENT_CONSTRAINT, Event
+from .fields import PrimaryKeyListField, SplitDateTimeField
 
 
 class MyUserSerializer(serializers.ModelSerializer):
@@ -31,33 +37,111 @@ class MyUserSerializer(serializers.ModelSerializer):
 
 
 class ClientSerializer(serializers.ModelSerializer):
-    events = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
-    contracts = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    events = PrimaryKeyListField(many=True, read_only=True)
+    contracts = PrimaryKeyListField(many=True, read_only=True)
 
     class Meta:
         model = Client
         fields = ['id', 'first_name', 'last_name', 'email', 'phone_number', 'mobile_number', 'company_name',
-                  'date_created', 'date_updated', 'sales_contact', 'events', 'contracts']
+                  'date_created', 'date_updated', 'sales_contact', 'events', 'contracts', 'event_count',
+                  'contract_count', 'total_amount', 'unpaid_amount']
         read_only_fields = ['id', 'date_created', 'date_updated']
 
 
+def get_constraint_name(error):
+    """Return the name of the constraint of the database an IntegrityError was raised by, if it's known."""
+    return getattr(getattr(error.__cause__, 'diag', None), 'constraint_name', None)
+
+
 class EventSerializer(serializers.ModelSerializer):
+    date = SplitDateTimeField()
+    # The messages for the errors raised by the constraints of the database, by name of constraint.
+    constraint_messages = {CLIENT_CONSTRAINT: "The client must be the same for the event and the contract!"}
+
     class Meta:
         model = Event
-        fields = ['id', 'client', 'date_created', 'date_updated', 'support', 'contract', 'attendees', 'date', 'notes']
-        read_only_fields = ['id', 'date_created', 'date_updated']
+        fields = ['id', 'client', 'date_created', 'date_updated', 'support', 'contract', 'attendees', 'date', 'notes',
+                  'archived']
+        read_only_fields = ['id', 'date_created', 'date_updated', 'archived']
 
-    def validate(self, data):
-        """Ensure that the client and the client in the contract are the samen, in addition to all usual checks."""
-        if data["contract"].client != data["client"]:
-            raise serializers.ValidationError("The client must be the same for the event and the contract!")
-        return super().validate(data)
+    def save(self, **kwargs):
+        """Save the event. The database ensures that the client and the client in the contract are the same."""
+        try:
+            with transaction.atomic():
+                return super().save(**kwargs)
+        except IntegrityError as error:
+            message = self.constraint_messages.get(get_constraint_name(error))
+            if message is None:
+                raise
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]})
 
 
 class ContractSerializer(serializers.ModelSerializer):
+    payment_due = SplitDateTimeField()
+
     class Meta:
         model = Contract
-        fields = ['id', 'sales_contact', 'client', 'date_created', 'date_updated', 'status', 'amount', 'payment_due']
-        read_only_fields = ['id', 'date_created', 'date_updated']
+        fields = ['id', 'sales_contact', 'client', 'date_created', 'date_updated', 'status', 'amount', 'payment_due',
+                  'archived']
+        read_only_fields = ['id', 'date_created', 'date_updated', 'archived']
+
 
+class BatchRequestSerializer(serializers.Serializer):
+    """One of the requests of a batch."""
+    method = serializers.ChoiceField(choices=["GET", "POST", "PUT", "PATCH", "DELETE"])
+    url = serializers.CharField()
+    body = serializers.JSONField(required=False, default=dict)
 
+
+class BulkUpdateSerializer(serializers.Serializer):
+    """The changes to make to one of the objects of a bulk update."""
+    id = serializers.IntegerField()
+    changes = serializers.DictField()
+
+
+class ReassignSerializer(serializers.Serializer):
+    """The user the objects of another user are given to, now or by a job in the background."""
+    new_user = serializers.PrimaryKeyRelatedField(queryset=MyUser.objects.all())
+    deactivate = serializers.BooleanField(default=False)
+    background = serializers.BooleanField(default=False)
+
+
+class ReassignmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Reassignment
+        fields = ['id', 'previous_user', 'previous_user_email', 'new_user', 'performed_by', 'date', 'clients',
+                  'contracts', 'events']
+        read_only_fields = fields
+
+
+class JobCreateSerializer(serializers.Serializer):
+    """A job to start, with the CSV `file` of the imports. In a multipart body, `arguments` is a JSON string."""
+    kind = serializers.CharField()
+    arguments = serializers.JSONField(default=dict)
+    file = serializers.FileField(required=False)
+
+    def validate_arguments(self, value):
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                raise serializers.ValidationError("Value must be valid JSON.")
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Expected an object.")
+        return value
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'arguments', 'status', 'created_by', 'date_created', 'run_after', 'date_started',
+                  'date_finished', 'attempts', 'max_attempts', 'progress', 'total', 'result', 'result_file', 'error']
+        read_only_fields = fields
+
+
+class ProfileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Profile
+        fields = ['id', 'user', 'date_created', 'sampled', 'method', 'path', 'view', 'status', 'duration',
+                  'query_count', 'query_duration', 'queries', 'summary', 'stats_file']
+        read_only_fields = fields
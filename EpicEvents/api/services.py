@@ -0,0 +1,179 @@
+import json
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import ExpressionWrapper, Value
+from django.http import QueryDict
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+from rest_framework.validators import UniqueValidator
+
+from .serializers import get_constraint_name
+
+# The HTTP method each action is made with through the API, which the permission classes rely on.
+ACTION_METHODS = {
+    "list": "GET",
+    "retrieve": "GET",
+    "create": "POST",
+    "update": "PUT",
+    "partial_update": "PATCH",
+    "destroy": "DELETE",
+    "bulk_update": "PATCH",
+    "reassign": "POST",
+}
+
+
+class ServiceRequest:
+    """Stand-in for the DRF request, for actions made in-process by a user who is already authenticated.
+
+    It only holds what the viewsets and their permission classes read from a request."""
+    authenticators = ()
+
+    def __init__(self, user, method, data=None, query_params=None):
+        self.user = user
+        self.method = method
+        self.data = data if data is not None else {}
+        self.query_params = query_params if query_params is not None else QueryDict()
+        self.headers = {}
+
+
+def get_view(viewset_class, user, action, data=None, query_params=None, **kwargs):
+    """Return a viewset ready to run an action for a user, without running the request pipeline of DRF.
+
+    The permissions of the viewset are checked, and PermissionDenied is raised if the user isn't allowed to do it.
+    `kwargs` are the keyword arguments the URL of the action would have given, like the primary key. `data` and
+    `query_params` are the ones of the request, for the actions that read them."""
+    view = viewset_class(action=action, args=(), kwargs=kwargs, format_kwarg=None,
+                         request=ServiceRequest(user, ACTION_METHODS[action], data, query_params))
+    view.check_permissions(view.request)
+    return view
+
+
+def run_action(viewset_class, user, action, data=None, query_params=None, **kwargs):
+    """Run an action of a viewset for a user and return its response, which isn't rendered."""
+    view = get_view(viewset_class, user, action, data, query_params, **kwargs)
+    return getattr(view, action)(view.request, **kwargs)
+
+
+def list_objects(view):
+    """Return the queryset of the objects the view lists."""
+    return view.filter_queryset(view.get_queryset())
+
+
+def create_object(view, data):
+    """Validate the data and create the object. Return the serializer of the new object."""
+    serializer = view.get_serializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    view.perform_create(serializer)
+    return serializer
+
+
+def update_object(view, data, partial=False):
+    """Validate the data and update the object of the view. Return the serializer of the updated object."""
+    instance = view.get_object()
+    serializer = view.get_serializer(instance, data=data, partial=partial)
+    serializer.is_valid(raise_exception=True)
+    view.perform_update(serializer)
+
+    if getattr(instance, '_prefetched_objects_cache', None):
+        instance._prefetched_objects_cache = {}
+    return serializer
+
+
+def delete_object(view):
+    """Delete the object of the view."""
+    view.perform_destroy(view.get_object())
+
+
+def get_changeable(view):
+    """Return an expression telling whether the user of the view may change each object, from its permissions.
+
+    It's what their `has_object_permission` would say for each object, but for many objects in a single query."""
+    changeable = True
+    for permission in view.get_permissions():
+        if not hasattr(permission, "get_changeable"):
+            # Like the permissions of DRF, it has no object permissions.
+            continue
+        q = permission.get_changeable(view.request, view)
+        if q is not True:
+            changeable = q if changeable is True else changeable & q
+    if changeable is True:
+        return Value(True)
+    return ExpressionWrapper(changeable, output_field=models.BooleanField())
+
+
+def can_share_validation(serializer_class, fields):
+    """Return whether the changes of those fields can be validated once for all the objects they're made to.
+
+    It isn't the case when their validation depends on the object, like for unique fields."""
+    if serializer_class.validate is not serializers.Serializer.validate:
+        return False
+    serializer = serializer_class()
+    if serializer.validators:
+        return False
+    return not any(isinstance(validator, UniqueValidator)
+                   for name in fields if name in serializer.fields for validator in serializer.fields[name].validators)
+
+
+def bulk_update_objects(view, changes):
+    """Apply partial changes to many objects at once. `changes` maps the primary keys of the objects to their changes.
+
+    The permissions of the user are checked with a single query, the same changes are validated once when they don't
+    depend on the object, and the objects getting the same changes are updated with a single UPDATE, all in one
+    transaction. Return the outcome of each object, by primary key: a status code, and the errors if there are some."""
+    serializer_class = view.get_serializer_class()
+    queryset = view.get_queryset()
+    outcomes = {}
+    shared_validations = {}
+    validations = {}
+    # The objects to update, by validated changes.
+    updates = {}
+    with transaction.atomic():
+        objects = queryset.filter(pk__in=changes).annotate(changeable=get_changeable(view)).select_for_update()
+        objects = {obj.pk: obj for obj in objects}
+        for pk, data in changes.items():
+            obj = objects.get(pk)
+            if obj is None:
+                outcomes[pk] = {"status": 404, "errors": {"detail": "Not found."}}
+                continue
+            if not obj.changeable:
+                outcomes[pk] = {"status": 403,
+                                "errors": {"detail": "You do not have permission to perform this action."}}
+                continue
+            fields = frozenset(data)
+            if fields not in shared_validations:
+                shared_validations[fields] = can_share_validation(serializer_class, fields)
+            key = json.dumps(data, sort_keys=True, default=str) if shared_validations[fields] else pk
+            if key not in validations:
+                serializer = view.get_serializer(obj, data=data, partial=True)
+                serializer.is_valid()
+                validations[key] = (serializer.errors, serializer.validated_data)
+            errors, validated_data = validations[key]
+            if errors:
+                outcomes[pk] = {"status": 400, "errors": errors}
+                continue
+            update = tuple((name, value.pk if isinstance(value, models.Model) else value)
+                           for name, value in sorted(validated_data.items()))
+            try:
+                hash(update)
+            except TypeError:
+                update = pk
+            updates.setdefault(update, (validated_data, []))[1].append(pk)
+
+        auto_now = [field.name for field in queryset.model._meta.concrete_fields if getattr(field, "auto_now", False)]
+        now = timezone.now()
+        for validated_data, pks in updates.values():
+            try:
+                with transaction.atomic():
+                    queryset.model._default_manager.filter(pk__in=pks).update(
+                        **validated_data, **{name: now for name in auto_now})
+            except IntegrityError as error:
+                message = getattr(serializer_class, "constraint_messages", {}).get(get_constraint_name(error))
+                if message is None:
+                    raise
+                for pk in pks:
+                    outcomes[pk] = {"status": 400, "errors": {api_settings.NON_FIELD_ERRORS_KEY: [message]}}
+            else:
+                for pk in pks:
+                    outcomes[pk] = {"status": 200}
+    return {pk: outcomes[pk] for pk in changes}
@@ -0,0 +1,1622 @@
+import asyncio
+import base64
+import collections
+import csv
+import datetime
+import decimal
+import io
+import itertools
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import timeit
+import unittest
+import zlib
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import Resolver404, resolve, reverse
+from django.utils import timezone
+from django.utils.timezone import make_aware
+from phonenumber_field.phonenumber import PhoneNumber
+from rest_framework import exceptions, parsers, renderers
+from rest_framework.views import APIView
+
+from accounts.models import MyUser
+from clients.models import Client, Contract
+from events.models import Event
+from . import asgi, changes, jobs, metrics, middleware, profiling, renderers as api_renderers, services
+from .models import Job, Profile
+from .parsers import JSONParser
+from .routers import LazyViewSetView
+from .serializers import ClientSerializer, ContractSerializer
+from .views import BatchAPIView, ChangeStreamView, ClientAPIViewSet, ContractAPIViewSet, EventAPIViewSet, UserAPIViewSet
+
+default_password = "correcthorsebatterystaple"
+
+
+class FiltersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gestion_logs = {"email": "corentin@gmail.com", "password": default_password}
+        cls.gestion_user = MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                                      email="corentin@gmail.com", password=default_password)
+        cls.sales_user_1 = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                      email="thomas@gmail.com", password=default_password)
+        cls.sales_user_2 = MyUser.objects.create_user(first_name="Thomas_2", last_name="Bravo", role="sales",
+                                                      email="thomas_2@gmail.com", password=default_password)
+        cls.support_user_1 = MyUser.objects.create_user(first_name="Timothée", last_name="Bravo", role="support",
+                                                        email="timothee@gmail.com", password=default_password)
+        cls.support_user_2 = MyUser.objects.create_user(first_name="Timothée_2", last_name="Bravo", role="support",
+                                                        email="timothee_2@gmail.com", password=default_password)
+        cls.client1 = Client.objects.create(first_name="client_test", last_name="1", email="client_test_1@gmail.com",
+                                            phone_number="+33666666666", company_name="test_1",
+                                            sales_contact=cls.sales_user_1)
+        cls.client2 = Client.objects.create(first_name="client_test", last_name="2", email="client_test_2@gmail.com",
+                                            phone_number="+33677777777", company_name="test_2",
+                                            sales_contact=cls.sales_user_1)
+        cls.client3 = Client.objects.create(first_name="client_test", last_name="3", email="client_test_3@gmail.com",
+                                            phone_number="+33688888888", company_name="test_2",
+                                            sales_contact=cls.sales_user_2)
+        past = make_aware(datetime.datetime.now() - datetime.timedelta(days=10))
+        future = make_aware(datetime.datetime.now() + datetime.timedelta(days=10))
+        cls.contract1 = Contract.objects.create(sales_contact=cls.sales_user_1, client=cls.client1, status=False,
+                                                amount=100, payment_due=past)
+        cls.contract2 = Contract.objects.create(sales_contact=cls.sales_user_1, client=cls.client2, status=False,
+                                                amount=200, payment_due=future)
+        cls.contract3 = Contract.objects.create(sales_contact=cls.sales_user_2, client=cls.client3, status=False,
+                                                amount=300, payment_due=past)
+        cls.event1 = Event.objects.create(client=cls.client1, support=cls.support_user_1, contract=cls.contract1,
+                                          attendees=10, date=future)
+        cls.event2 = Event.objects.create(client=cls.client2, support=cls.support_user_2, contract=cls.contract2,
+                                          attendees=10, date=future)
+        cls.event3 = Event.objects.create(client=cls.client3, support=cls.support_user_1, contract=cls.contract3,
+                                          attendees=10, date=future)
+        # For each list, every filter is given a value and the objects it must return.
+        cls.matrix = {
+            "/api/users/list/": {
+                "email": ("thomas@gmail.com", {cls.sales_user_1}),
+                "role": ("sales", {cls.sales_user_1, cls.sales_user_2}),
+            },
+            "/api/clients/list/": {
+                "email": ("client_test_2@gmail.com", {cls.client2}),
+                "company": ("test_2", {cls.client2, cls.client3}),
+                "contact": ("thomas@gmail.com", {cls.client1, cls.client2}),
+            },
+            "/api/contracts/list/": {
+                "due": ("true", {cls.contract1, cls.contract3}),
+                "client": ("test_2", {cls.contract2, cls.contract3}),
+                "contact": ("thomas@gmail.com", {cls.contract1, cls.contract2}),
+                "include_archived": ("true", {cls.contract1, cls.contract2, cls.contract3}),
+            },
+            "/api/events/list/": {
+                "client": ("test_2", {cls.event2, cls.event3}),
+                "support": ("timothee@gmail.com", {cls.event1, cls.event3}),
+                "contact": ("thomas@gmail.com", {cls.event1, cls.event2}),
+                "include_archived": ("true", {cls.event1, cls.event2, cls.event3}),
+            },
+        }
+
+    def test_every_combination_of_filters_returns_the_right_objects(self):
+        self.client.login(**self.gestion_logs)
+        for url, filters in self.matrix.items():
+            for size in range(1, len(filters) + 1):
+                for names in itertools.combinations(filters, size):
+                    params = {name: filters[name][0] for name in names}
+                    expected = set.intersection(*(filters[name][1] for name in names))
+                    with self.subTest(url=url, params=params):
+                        resp = self.client.get(url, params)
+                        assert resp.status_code == 200
+                        assert {item["id"] for item in resp.data} == {obj.pk for obj in expected}
+
+    def test_lists_without_filters_return_everything(self):
+        self.client.login(**self.gestion_logs)
+        for url, model in (("/api/users/list/", MyUser), ("/api/clients/list/", Client),
+                           ("/api/contracts/list/", Contract), ("/api/events/list/", Event)):
+            resp = self.client.get(url)
+            assert resp.status_code == 200
+            assert len(resp.data) == model.objects.count()
+
+    def test_due_false_does_not_filter(self):
+        self.client.login(**self.gestion_logs)
+        resp = self.client.get("/api/contracts/list/", {"due": "false"})
+        assert resp.status_code == 200
+        assert len(resp.data) == Contract.objects.count()
+
+    def test_unknown_filters_are_rejected(self):
+        self.client.login(**self.gestion_logs)
+        for url in self.matrix:
+            resp = self.client.get(url, {"company_namel": "test_2"})
+            assert resp.status_code == 400
+            assert "company_namel" in resp.data
+
+    def test_archived_objects_are_only_listed_when_included(self):
+        Contract.objects.filter(pk=self.contract1.pk).update(archived=True)
+        Event.objects.filter(pk=self.event1.pk).update(archived=True)
+        self.client.login(**self.gestion_logs)
+        for url, archived, model in (("/api/contracts/list/", self.contract1, Contract),
+                                     ("/api/events/list/", self.event1, Event)):
+            resp = self.client.get(url)
+            assert {item["id"] for item in resp.data} == set(model.objects.exclude(pk=archived.pk)
+                                                             .values_list("pk", flat=True))
+            resp = self.client.get(url, {"include_archived": "true", "contact": "thomas@gmail.com"})
+            assert archived.pk in {item["id"] for item in resp.data}
+            assert [item["archived"] for item in resp.data if item["id"] == archived.pk] == [True]
+            resp = self.client.get(url.replace("list", str(archived.pk)))
+            assert (resp.status_code, resp.data["archived"]) == (200, True)
+
+    def test_clients_are_ordered_by_their_counters(self):
+        Contract.objects.create(sales_contact=self.sales_user_1, client=self.client2, status=True, amount=50,
+                                payment_due=self.contract1.payment_due)
+        self.client.login(**self.gestion_logs)
+        for ordering, expected in (("-contract_count", [self.client2, self.client3, self.client1]),
+                                   ("unpaid_amount", [self.client1, self.client2, self.client3]),
+                                   ("-total_amount", [self.client3, self.client2, self.client1])):
+            resp = self.client.get("/api/clients/list/", {"ordering": ordering})
+            assert [item["id"] for item in resp.data] == [client.pk for client in expected]
+        resp = self.client.get("/api/clients/list/", {"ordering": "-total_amount", "search": "test"})
+        assert [item["id"] for item in resp.data] == [self.client3.pk, self.client2.pk, self.client1.pk]
+        assert resp.data[1]["contract_count"] == 2
+        assert resp.data[1]["total_amount"] == 250
+
+    def test_invalid_values_are_rejected(self):
+        self.client.login(**self.gestion_logs)
+        for url, params in (("/api/users/list/", {"role": "boss"}),
+                            ("/api/clients/list/", {"contact": "thomas", "ordering": "email"}),
+                            ("/api/contracts/list/", {"due": "maybe"}),
+                            ("/api/events/list/", {"support": ""})):
+            resp = self.client.get(url, params)
+            assert resp.status_code == 400
+            assert set(resp.data) == set(params)
+
+    def test_filters_are_combined_in_a_single_query(self):
+        self.client.login(**self.gestion_logs)
+        self.client.get("/api/events/list/", {"client": "test_2"})  # Loads the session and the user.
+        with self.assertNumQueries(3):  # The session, the user and the list itself.
+            self.client.get("/api/events/list/", {"client": "test_2", "support": "timothee@gmail.com",
+                                                  "contact": "thomas@gmail.com"})
+
+
+class ClientSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gestion_logs = {"email": "corentin@gmail.com", "password": default_password}
+        MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                   email="corentin@gmail.com", password=default_password)
+        cls.client1 = Client.objects.create(first_name="Jean", last_name="Dupont", email="jean.dupont@acme.fr",
+                                            phone_number="+33666666666", company_name="Acme Corporation")
+        cls.client2 = Client.objects.create(first_name="Marie", last_name="Curie", email="marie@radium.fr",
+                                            phone_number="+33677777777", company_name="Radium Industries")
+        cls.client3 = Client.objects.create(first_name="Acmeline", last_name="Martin", email="am@martin.fr",
+                                            phone_number="+33688888888", company_name="Martin & Fils")
+
+    def test_search_matches_prefixes_of_every_field(self):
+        self.client.login(**self.gestion_logs)
+        for search, expected in (("acm", {self.client1, self.client3}),
+                                 ("Acme Corp", {self.client1}),
+                                 ("dup", {self.client1}),
+                                 ("MARIE", {self.client2}),
+                                 ("radium.fr", {self.client2}),
+                                 ("martin fils", {self.client3}),
+                                 ("nobody", set())):
+            with self.subTest(search=search):
+                resp = self.client.get("/api/clients/list/", {"search": search})
+                assert resp.status_code == 200
+                assert {item["id"] for item in resp.data} == {client.pk for client in expected}
+
+    def test_search_ranks_the_best_matches_first(self):
+        self.client.login(**self.gestion_logs)
+        resp = self.client.get("/api/clients/list/", {"search": "acme"})
+        assert [item["id"] for item in resp.data][0] == self.client1.pk
+
+    def test_search_can_be_combined_with_other_filters(self):
+        self.client.login(**self.gestion_logs)
+        resp = self.client.get("/api/clients/list/", {"search": "acm", "company": "Martin & Fils"})
+        assert [item["id"] for item in resp.data] == [self.client3.pk]
+
+    def test_search_uses_the_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            assert "client_search_idx" in Client.objects.search("acme").explain()
+
+    def test_admin_search_uses_the_same_search(self):
+        self.client.login(**self.gestion_logs)
+        resp = self.client.get("/admin/clients/client/", {"q": "acm"})
+        assert resp.status_code == 200
+        assert list(resp.context["cl"].result_list) == list(Client.objects.search("acm").order_by("date_created"))
+
+
+class URLsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gestion_logs = {"email": "corentin@gmail.com", "password": default_password}
+        MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                   email="corentin@gmail.com", password=default_password)
+
+    def test_the_urls_of_each_action_are_kept(self):
+        for prefix, basename in (("users", "user"), ("clients", "client"), ("contracts", "contract"),
+                                 ("events", "event")):
+            edit_prefix = "contract" if basename == "contract" else prefix
+            for url, name, actions in ((f"/api/{prefix}/list/", "list", {"get": "list", "post": "list"}),
+                                       (f"/api/{prefix}/create/", "create", {"post": "create"}),
+                                       (f"/api/{prefix}/12/", "find", {"get": "retrieve"}),
+                                       (f"/api/{edit_prefix}/12/edit", "change", {"post": "partial_update"}),
+                                       (f"/api/{prefix}/delete/12", "delete", {"post": "destroy"})):
+                with self.subTest(url=url):
+                    match = resolve(url)
+                    assert match.url_name == f"{basename}_{name}"
+                    # DRF adds HEAD to the views answering GET once they are used.
+                    assert {method: action for method, action in match.func.actions.items() if method != "head"} \
+                        == actions
+                    assert reverse(f"{basename}_{name}", kwargs=match.kwargs) == url
+
+    def test_primary_keys_must_be_integers(self):
+        with self.assertRaises(Resolver404):
+            resolve("/api/users/abc/")
+
+    def test_views_are_built_when_first_used(self):
+        view = LazyViewSetView(UserAPIViewSet, {"get": "list"})
+        assert view._view is None
+        self.client.login(**self.gestion_logs)
+        request = RequestFactory().get("/api/users/list/")
+        request.user = MyUser.objects.get(email="corentin@gmail.com")
+        assert view(request).status_code == 200
+        assert view._view is not None
+
+    def test_views_can_still_be_imported_by_name(self):
+        from api.urls import user_list
+        assert user_list is resolve("/api/users/list/").func
+
+    def test_only_lists_obtained_with_get_may_be_cached(self):
+        self.client.login(**self.gestion_logs)
+        resp = self.client.get("/api/users/list/")
+        assert "private" in resp["Cache-Control"]
+        assert "Cookie" in resp["Vary"]
+        resp = self.client.post("/api/users/list/")
+        assert resp.status_code == 200
+        assert "no-store" in resp["Cache-Control"]
+
+    def test_resolving_urls_is_fast(self):
+        paths = [url for prefix in ("users", "clients", "contracts", "events")
+                 for url in (f"/api/{prefix}/list/", f"/api/{prefix}/12/", f"/api/{prefix}/delete/12")]
+        number = 200
+        duration = timeit.timeit(lambda: [resolve(path) for path in paths], number=number)
+        assert duration / number / len(paths) < 0.001
+
+
+class ServicesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gestion_logs = {"email": "corentin@gmail.com", "password": default_password}
+        cls.gestion_user = MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                                      email="corentin@gmail.com", password=default_password)
+        cls.sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                    email="thomas@gmail.com", password=default_password)
+        cls.support_user = MyUser.objects.create_user(first_name="Timothée", last_name="Bravo", role="support",
+                                                      email="timothee@gmail.com", password=default_password)
+        cls.client1 = Client.objects.create(first_name="client_test", last_name="1", email="client_test_1@gmail.com",
+                                            phone_number="+33666666666", company_name="test_1",
+                                            sales_contact=cls.sales_user)
+
+    def test_permissions_are_checked_for_the_user(self):
+        with self.assertRaises(exceptions.PermissionDenied):
+            services.get_view(UserAPIViewSet, self.sales_user, "list")
+        with self.assertRaises(exceptions.PermissionDenied):
+            services.get_view(ClientAPIViewSet, self.support_user, "create")
+        other_sales_user = MyUser.objects.create_user(first_name="Thomas_2", last_name="Bravo", role="sales",
+                                                      email="thomas_2@gmail.com", password=default_password)
+        view = services.get_view(ClientAPIViewSet, other_sales_user, "partial_update", pk=self.client1.pk)
+        with self.assertRaises(exceptions.PermissionDenied):
+            services.update_object(view, {"company_name": "test_2"}, partial=True)
+
+    def test_data_is_validated(self):
+        view = services.get_view(ClientAPIViewSet, self.sales_user, "create")
+        with self.assertRaises(exceptions.ValidationError):
+            services.create_object(view, {"first_name": "client_test", "email": "not an email"})
+
+    def test_objects_can_be_managed_without_a_request(self):
+        view = services.get_view(ClientAPIViewSet, self.sales_user, "create")
+        client = services.create_object(view, {"first_name": "client_test", "last_name": "2",
+                                               "email": "client_test_2@gmail.com", "phone_number": "+33677777777",
+                                               "company_name": "test_2"}).instance
+        view = services.get_view(ClientAPIViewSet, self.sales_user, "partial_update", pk=client.pk)
+        services.update_object(view, {"company_name": "test_3"}, partial=True)
+        assert Client.objects.get(pk=client.pk).company_name == "test_3"
+        assert set(services.list_objects(services.get_view(ClientAPIViewSet, self.sales_user, "list"))) == \
+            {self.client1, client}
+        services.delete_object(services.get_view(ClientAPIViewSet, self.sales_user, "destroy", pk=client.pk))
+        assert not Client.objects.filter(pk=client.pk).exists()
+
+    def test_admin_does_not_run_the_api_request_pipeline(self):
+        self.client.login(**self.gestion_logs)
+        with patch.object(APIView, "dispatch") as dispatch:
+            resp = self.client.get("/admin/clients/client/")
+            assert resp.status_code == 200
+            resp = self.client.post(f"/admin/clients/client/{self.client1.pk}/change/",
+                                    {"first_name": "client_test", "last_name": "1", "email": "client_test_1@gmail.com",
+                                     "phone_number": "+33666666666", "company_name": "test_2",
+                                     "sales_contact": self.sales_user.pk})
+            assert resp.status_code == 302
+        dispatch.assert_not_called()
+        assert Client.objects.get(pk=self.client1.pk).company_name == "test_2"
+
+
+class SplitDateTimeFieldTest(TestCase):
+    def test_split_date_and_time_are_merged(self):
+        serializer = ContractSerializer(data={"payment_due_0": "2021-09-01", "payment_due_1": "10:30:00"}, partial=True)
+        assert serializer.is_valid(), serializer.errors
+        assert serializer.validated_data["payment_due"] == make_aware(datetime.datetime(2021, 9, 1, 10, 30))
+
+    def test_split_date_and_time_take_precedence(self):
+        serializer = ContractSerializer(data={"payment_due": "2020-01-01T00:00:00", "payment_due_0": "2021-09-01",
+                                              "payment_due_1": "10:30:00"}, partial=True)
+        assert serializer.is_valid(), serializer.errors
+        assert serializer.validated_data["payment_due"] == make_aware(datetime.datetime(2021, 9, 1, 10, 30))
+
+    def test_iso_8601_is_accepted(self):
+        for value, expected in (("2021-09-01T10:30:00", make_aware(datetime.datetime(2021, 9, 1, 10, 30))),
+                                ("2021-09-01 10:30", make_aware(datetime.datetime(2021, 9, 1, 10, 30))),
+                                ("2021-09-01T10:30:00Z", datetime.datetime(2021, 9, 1, 10, 30, tzinfo=datetime.timezone.utc)),
+                                ("2021-09-01T10:30:00+02:00", make_aware(datetime.datetime(2021, 9, 1, 10, 30)))):
+            with self.subTest(value=value):
+                serializer = ContractSerializer(data={"payment_due": value}, partial=True)
+                assert serializer.is_valid(), serializer.errors
+                assert serializer.validated_data["payment_due"] == expected
+
+    def test_invalid_dates_are_rejected(self):
+        for data in ({"payment_due": "yesterday"}, {"payment_due_0": "2021-13-01", "payment_due_1": "10:30:00"},
+                     {"payment_due_0": "2021-09-01", "payment_due_1": "25:00:00"}):
+            with self.subTest(data=data):
+                serializer = ContractSerializer(data=data, partial=True)
+                assert not serializer.is_valid()
+                assert "payment_due" in serializer.errors
+
+
+class FastListTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gestion_logs = {"email": "corentin@gmail.com", "password": default_password}
+        MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                   email="corentin@gmail.com", password=default_password)
+        sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                email="thomas@gmail.com", password=default_password)
+        support_user = MyUser.objects.create_user(first_name="Timothée", last_name="Bravo", role="support",
+                                                  email="timothee@gmail.com", password=default_password)
+        # Values that each field may format differently: missing relations, empty and invalid phone numbers,
+        # microseconds, dates in UTC and on both sides of daylight saving time.
+        cls.clients = [
+            Client.objects.create(first_name="client_test", last_name="1", email="client_test_1@gmail.com",
+                                  phone_number="+33666666666", mobile_number="", company_name="test_1"),
+            Client.objects.create(first_name="client_test", last_name="2", email="client_test_2@gmail.com",
+                                  phone_number="+1 202-555-0143", mobile_number="+33677777777",
+                                  company_name="test_2", sales_contact=sales_user),
+            Client.objects.create(first_name="client_test", last_name="3", email="client_test_3@gmail.com",
+                                  phone_number="12345", company_name="test_3", sales_contact=sales_user),
+        ]
+        dates = [datetime.datetime(2021, 1, 1, 12, 0, tzinfo=datetime.timezone.utc),
+                 make_aware(datetime.datetime(2021, 7, 14, 23, 59, 59, 999999)),
+                 make_aware(datetime.datetime(2021, 10, 31, 2, 30), is_dst=False)]
+        for i, date in enumerate(dates * 2):
+            client = cls.clients[1 + i % 2]
+            contract = Contract.objects.create(sales_contact=sales_user, client=client, status=bool(i % 2),
+                                               amount=i * 100.5, payment_due=date)
+            Event.objects.create(client=client, support=support_user, contract=contract, attendees=i, date=date,
+                                 notes=None if i % 2 else "note")
+
+    def test_fast_lists_are_identical_to_the_serializers(self):
+        self.client.login(**self.gestion_logs)
+        for viewset, url in ((ClientAPIViewSet, "/api/clients/list/"), (ClientAPIViewSet, "/api/clients/list/?search=test"),
+                             (EventAPIViewSet, "/api/events/list/"), (ContractAPIViewSet, "/api/contracts/list/")):
+            with self.subTest(url=url):
+                assert viewset.fast_list
+                fast = self.client.get(url)
+                with patch.object(viewset, "fast_list", False):
+                    slow = self.client.get(url)
+                assert fast.status_code == slow.status_code == 200
+                assert len(fast.json()) > 1
+                assert fast.content == slow.content
+
+    def test_fast_lists_are_identical_in_every_timezone(self):
+        self.client.login(**self.gestion_logs)
+        for name in ("UTC", "America/New_York", "Asia/Kolkata"):
+            with self.subTest(timezone=name), self.settings(TIME_ZONE=name):
+                fast = self.client.get("/api/events/list/")
+                with patch.object(EventAPIViewSet, "fast_list", False):
+                    slow = self.client.get("/api/events/list/")
+                assert fast.content == slow.content
+
+    def test_fast_lists_take_a_constant_number_of_queries(self):
+        self.client.login(**self.gestion_logs)
+        self.client.get("/api/clients/list/")  # The first request after the login also updates the session.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/clients/list/")
+        for i in range(10):
+            Client.objects.create(first_name="client_test", last_name=str(i), email=f"client_{i}@gmail.com",
+                                  phone_number="+33666666666", company_name="test_4")
+        with self.assertNumQueries(len(queries)):
+            resp = self.client.get("/api/clients/list/")
+        assert len(resp.json()) == 13
+
+
+class JSONTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Rows like the ones of the lists, 10k of them.
+        date = make_aware(datetime.datetime(2021, 7, 14, 20, 30, 15, 123456))
+        cls.rows = [{"id": i, "client": i // 3, "date_created": date.isoformat(), "support": None, "contract": i,
+                     "attendees": i * 7, "amount": i / 3, "status": bool(i % 2), "events": list(range(i % 5)),
+                     "notes": "Réunion\u2028annuelle" if i % 10 == 0 else "", "phone_number": "+33666666666"}
+                    for i in range(10000)]
+
+    def render(self, data, **kwargs):
+        return api_renderers.JSONRenderer().render(data, **kwargs)
+
+    def render_with_json_module(self, data, **kwargs):
+        with patch.object(api_renderers, "orjson", None):
+            return api_renderers.JSONRenderer().render(data, **kwargs)
+
+    def parse(self, content, **kwargs):
+        return JSONParser().parse(io.BytesIO(content), **kwargs)
+
+    def test_output_is_the_same_as_the_renderer_of_drf(self):
+        assert self.render(self.rows) == renderers.JSONRenderer().render(self.rows)
+        assert self.render(None) == b""
+        indented = self.render(self.rows[:10], renderer_context={"indent": 4})
+        assert indented == renderers.JSONRenderer().render(self.rows[:10], renderer_context={"indent": 4})
+
+    def test_datetimes_decimals_and_phone_numbers_are_encoded(self):
+        data = {"utc": datetime.datetime(2021, 1, 1, 12, 0, tzinfo=datetime.timezone.utc),
+                "local": make_aware(datetime.datetime(2021, 7, 14, 20, 30, 15, 123456)),
+                "day": datetime.date(2021, 7, 14), "amount": decimal.Decimal("320.54"),
+                "phone_number": PhoneNumber.from_string("+33 6 66 66 66 66"), 2: "key"}
+        expected = (b'{"utc":"2021-01-01T12:00:00Z","local":"2021-07-14T20:30:15.123456+02:00","day":"2021-07-14",'
+                    b'"amount":320.54,"phone_number":"+33666666666","2":"key"}')
+        assert self.render(data) == expected
+        assert self.render_with_json_module(data) == expected
+
+    def test_input_is_parsed_like_the_parser_of_drf(self):
+        for content in (renderers.JSONRenderer().render(self.rows[:100]), b'[18446744073709551616, 2]',
+                        '{"notes": "Réunion"}'.encode()):
+            with self.subTest(content=content[:20]):
+                assert repr(self.parse(content)) == repr(parsers.JSONParser().parse(io.BytesIO(content)))
+        content = '{"notes": "Réunion"}'.encode("latin-1")
+        assert self.parse(content, parser_context={"encoding": "latin-1"}) == {"notes": "Réunion"}
+        for content in (b'{"notes": ', b'{"amount": NaN}'):
+            with self.subTest(content=content), self.assertRaises(exceptions.ParseError):
+                self.parse(content)
+
+    def test_api_requests_and_responses_use_them(self):
+        gestion_user = MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                                  email="corentin@gmail.com", password=default_password)
+        self.client.force_login(gestion_user)
+        resp = self.client.post("/api/clients/create/", {"first_name": "client_test", "last_name": "1",
+                                                         "email": "client_test_1@gmail.com",
+                                                         "phone_number": "+33666666666", "company_name": "test_1"},
+                                content_type="application/json")
+        assert resp.status_code == 201, resp.content
+        resp = self.client.get("/api/clients/list/")
+        assert resp.content == renderers.JSONRenderer().render(resp.json())
+
+    @unittest.skipIf(api_renderers.orjson is None, "orjson isn't installed.")
+    def test_orjson_is_faster_on_large_lists(self):
+        content = self.render(self.rows)
+        timings = {
+            "encode": (min(timeit.repeat(lambda: self.render(self.rows), number=1, repeat=5)),
+                       min(timeit.repeat(lambda: self.render_with_json_module(self.rows), number=1, repeat=5))),
+            "decode": (min(timeit.repeat(lambda: self.parse(content), number=1, repeat=5)),
+                       min(timeit.repeat(lambda: parsers.JSONParser().parse(io.BytesIO(content)), number=1,
+                                         repeat=5))),
+        }
+        for operation, (fast, slow) in timings.items():
+            with self.subTest(operation=operation, orjson=fast, json=slow):
+                assert fast < slow
+
+
+class CompressionTest(SimpleTestCase):
+    content = b'{"id":1,"events":[1,2,3],"contracts":[4,5,6]},' * 100
+
+    def get_response(self, response, accept_encoding="gzip, deflate"):
+        request = RequestFactory().get("/api/clients/list/", HTTP_ACCEPT_ENCODING=accept_encoding)
+        return middleware.CompressionMiddleware(lambda request: response)(request)
+
+    def test_large_responses_are_compressed(self):
+        response = self.get_response(HttpResponse(self.content))
+        assert response["Content-Encoding"] == "gzip"
+        assert response["Vary"] == "Accept-Encoding"
+        assert int(response["Content-Length"]) == len(response.content) < len(self.content)
+        assert zlib.decompress(response.content, 31) == self.content
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.get_response(HttpResponse(self.content[:500]))
+        assert not response.has_header("Content-Encoding")
+        assert response.content == self.content[:500]
+
+    def test_the_encodings_accepted_by_the_client_are_followed(self):
+        preferred = "gzip" if middleware.brotli is None else "br"
+        for accept_encoding, encoding in (("", None), ("identity", None), ("gzip;q=0", None), ("deflate", None),
+                                          ("*", preferred), ("GZIP;q=0.5, identity", "gzip"),
+                                          ("*;q=0.1, gzip;q=0", None if preferred == "gzip" else "br")):
+            with self.subTest(accept_encoding=accept_encoding):
+                assert middleware.CompressionMiddleware(None).get_encoding(accept_encoding) == encoding
+                response = self.get_response(HttpResponse(self.content), accept_encoding)
+                assert response.get("Content-Encoding") == encoding
+
+    def test_streaming_responses_are_compressed_chunk_by_chunk(self):
+        chunks = [self.content[i:i + 100] for i in range(0, len(self.content), 100)]
+        response = self.get_response(StreamingHttpResponse(iter(chunks)))
+        assert response["Content-Encoding"] == "gzip"
+        assert not response.has_header("Content-Length")
+        decompressor = zlib.decompressobj(31)
+        received = []
+        for chunk, compressed in zip(chunks, response.streaming_content):
+            # Each chunk can be read by the client as soon as it is received.
+            received.append(decompressor.decompress(compressed))
+            assert received[-1] == chunk
+        assert b"".join(received) + decompressor.decompress(b"".join(response.streaming_content)) == self.content
+
+    def test_large_responses_are_compressed_faster(self):
+        content = self.content * 300
+        assert len(content) > middleware.CompressionMiddleware.large_length
+        response = self.get_response(HttpResponse(content))
+        assert zlib.decompress(response.content, 31) == content
+        assert len(response.content) > len(zlib.compress(content, 6))
+
+    def test_asynchronous_streaming_responses_are_compressed_chunk_by_chunk(self):
+        chunks = [self.content[i:i + 100] for i in range(0, len(self.content), 100)]
+
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+
+        async def read(response):
+            return [compressed async for compressed in response.streaming_content]
+
+        response = self.get_response(asgi.AsyncStreamingHttpResponse(stream()))
+        assert response["Content-Encoding"] == "gzip"
+        decompressor = zlib.decompressobj(31)
+        received = [decompressor.decompress(compressed) for compressed in async_to_sync(read)(response)]
+        assert received[:-1] == chunks
+        assert b"".join(received) == self.content
+
+    @unittest.skipIf(middleware.brotli is None, "brotli isn't installed.")
+    def test_brotli_is_preferred(self):
+        response = self.get_response(HttpResponse(self.content), "gzip, deflate, br")
+        assert response["Content-Encoding"] == "br"
+        assert middleware.brotli.decompress(response.content) == self.content
+
+
+class BatchTestMixin:
+    def create_objects(self):
+        self.gestion_user = MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                                       email="corentin@gmail.com", password=default_password)
+        self.sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                     email="thomas@gmail.com", password=default_password)
+        self.support_user = MyUser.objects.create_user(first_name="Timothée", last_name="Bravo", role="support",
+                                                       email="timothee@gmail.com", password=default_password)
+        self.client1 = Client.objects.create(first_name="client_test", last_name="1", email="client_test_1@gmail.com",
+                                             phone_number="+33666666666", company_name="test_1",
+                                             sales_contact=self.sales_user)
+        self.contract1 = Contract.objects.create(sales_contact=self.sales_user, client=self.client1, status=False,
+                                                 amount=100, payment_due=make_aware(datetime.datetime.now()))
+        self.event1 = Event.objects.create(client=self.client1, support=self.support_user, contract=self.contract1,
+                                           attendees=10, date=make_aware(datetime.datetime.now()))
+        # The requests the page of an event makes.
+        self.event_page = [f"/api/events/{self.event1.pk}/", f"/api/clients/{self.client1.pk}/",
+                           f"/api/contracts/{self.contract1.pk}/", f"/api/users/{self.support_user.pk}/"]
+
+    def batch(self, *requests):
+        return self.client.post("/api/batch/", [{"method": method, "url": url, **({"body": body} if body else {})}
+                                                for method, url, body in requests], content_type="application/json")
+
+
+@patch.object(BatchAPIView, "max_workers", 1)
+class BatchTest(BatchTestMixin, TestCase):
+    def setUp(self):
+        self.create_objects()
+        self.client.force_login(self.gestion_user)
+
+    def test_responses_are_the_ones_of_each_request(self):
+        resp = self.batch(*[("GET", url, None) for url in self.event_page])
+        assert resp.status_code == 200
+        assert resp.json() == [{"status": 200, "body": self.client.get(url).json()} for url in self.event_page]
+
+    def test_identical_requests_are_run_once(self):
+        url = f"/api/events/{self.event1.pk}/"
+        self.batch(("GET", url, None))
+        with CaptureQueriesContext(connection) as queries:
+            self.batch(("GET", url, None))
+        with self.assertNumQueries(len(queries)):
+            resp = self.batch(("GET", url, None), ("GET", url, None), ("GET", url, None))
+        assert [item["body"]["id"] for item in resp.json()] == [self.event1.pk] * 3
+
+    def test_each_request_has_its_own_status(self):
+        self.client.force_login(self.support_user)
+        resp = self.batch(("GET", f"/api/events/{self.event1.pk}/", None), ("GET", "/api/events/0/", None),
+                          ("GET", "/api/users/list/", None), ("DELETE", f"/api/events/{self.event1.pk}/", None),
+                          ("GET", "/admin/", None), ("GET", "/api/batch/", None),
+                          ("GET", "/api/clients/list/?unknown=1", None))
+        assert resp.status_code == 200
+        assert [item["status"] for item in resp.json()] == [200, 404, 403, 405, 404, 404, 400]
+
+    def test_actions_without_data_are_refused(self):
+        resp = self.batch(("GET", "/api/jobs/1/result", None), ("GET", "/api/profiles/1/stats", None),
+                          ("GET", f"/api/events/{self.event1.pk}/", None))
+        assert resp.status_code == 200
+        assert [item["status"] for item in resp.json()] == [405, 405, 200]
+        assert resp.json()[0]["body"] == {"detail": "The action result can't be run in a batch."}
+
+    def test_writes_are_run_in_order(self):
+        resp = self.batch(("POST", f"/api/events/{self.event1.pk}/edit", {"notes": "note"}),
+                          ("GET", f"/api/events/{self.event1.pk}/", None),
+                          ("POST", "/api/clients/create/", {"first_name": "client_test"}),
+                          ("GET", "/api/clients/list/?company=test_1", None))
+        assert [item["status"] for item in resp.json()] == [200, 200, 400, 200]
+        assert resp.json()[1]["body"]["notes"] == "note"
+        assert "email" in resp.json()[2]["body"]
+        assert Event.objects.get(pk=self.event1.pk).notes == "note"
+
+    def test_invalid_batches_are_rejected(self):
+        assert self.batch(*[("GET", f"/api/events/{self.event1.pk}/", None)] * 21).status_code == 400
+        assert self.client.post("/api/batch/", [{"method": "GET"}], content_type="application/json").status_code \
+            == 400
+        self.client.logout()
+        assert self.batch(("GET", f"/api/events/{self.event1.pk}/", None)).status_code == 403
+
+
+class ConcurrentBatchTest(BatchTestMixin, TransactionTestCase):
+    def setUp(self):
+        self.create_objects()
+        self.client.force_login(self.gestion_user)
+
+    def test_read_only_batches_are_run_concurrently(self):
+        with patch.object(BatchAPIView, "run_in_thread", side_effect=BatchAPIView.run_in_thread, autospec=True) \
+                as run_in_thread:
+            resp = self.batch(*[("GET", url, None) for url in self.event_page])
+        assert run_in_thread.call_count == 4
+        assert resp.json() == [{"status": 200, "body": self.client.get(url).json()} for url in self.event_page]
+
+
+class IdempotencyTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                    email="thomas@gmail.com", password=default_password)
+        cls.data = {"first_name": "client_test", "last_name": "1", "email": "client_test_1@gmail.com",
+                    "phone_number": "+33666666666", "company_name": "test_1"}
+
+    def setUp(self):
+        self.client.force_login(self.sales_user)
+
+    def create(self, data=None, key="8e03978e-40d5-43e8-bc93-6894a57f9324"):
+        headers = {"HTTP_IDEMPOTENCY_KEY": key} if key else {}
+        return self.client.post("/api/clients/create/", data or self.data, content_type="application/json", **headers)
+
+    def test_retries_get_the_original_response(self):
+        first = self.create()
+        assert first.status_code == 201
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.create()
+        assert retry.status_code == 201
+        assert retry.json() == first.json()
+        assert retry["Idempotent-Replayed"] == "true"
+        assert not [query for query in queries if 'INSERT INTO "clients_client"' in query["sql"]]
+        assert Client.objects.count() == 1
+
+    def test_requests_without_a_key_are_not_stored(self):
+        assert self.create(key=None).status_code == 201
+        assert self.create(key=None).status_code == 400
+
+    def test_a_key_can_not_be_used_with_other_data(self):
+        self.create()
+        resp = self.create({**self.data, "email": "client_test_2@gmail.com"})
+        assert resp.status_code == 422
+        assert Client.objects.count() == 1
+
+    def test_keys_are_specific_to_users_and_endpoints(self):
+        self.create()
+        other_sales_user = MyUser.objects.create_user(first_name="Thomas_2", last_name="Bravo", role="sales",
+                                                      email="thomas_2@gmail.com", password=default_password)
+        self.client.force_login(other_sales_user)
+        assert self.create({**self.data, "email": "client_test_2@gmail.com"}).status_code == 201
+        resp = self.client.post("/api/contracts/create/", {}, content_type="application/json",
+                                HTTP_IDEMPOTENCY_KEY="8e03978e-40d5-43e8-bc93-6894a57f9324")
+        assert resp.status_code == 400
+
+    def test_failed_creations_can_be_fixed_and_tried_again(self):
+        assert self.create({**self.data, "email": "not an email"}).status_code == 400
+        assert self.create().status_code == 201
+
+    def test_concurrent_tries_are_refused(self):
+        create_object = services.create_object
+        statuses = []
+
+        def create_during_retry(view, data):
+            statuses.append(self.create().status_code)
+            return create_object(view, data)
+
+        with patch.object(services, "create_object", side_effect=create_during_retry):
+            assert self.create().status_code == 201
+        assert statuses == [409]
+        assert Client.objects.count() == 1
+
+
+class BulkUpdateTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gestion_user = MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                                      email="corentin@gmail.com", password=default_password)
+        cls.sales_user_1 = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                      email="thomas@gmail.com", password=default_password)
+        cls.sales_user_2 = MyUser.objects.create_user(first_name="Thomas_2", last_name="Bravo", role="sales",
+                                                      email="thomas_2@gmail.com", password=default_password)
+        cls.support_user_1 = MyUser.objects.create_user(first_name="Timothée", last_name="Bravo", role="support",
+                                                        email="timothee@gmail.com", password=default_password)
+        cls.support_user_2 = MyUser.objects.create_user(first_name="Timothée_2", last_name="Bravo", role="support",
+                                                        email="timothee_2@gmail.com", password=default_password)
+        cls.client1 = Client.objects.create(first_name="client_test", last_name="1", email="client_test_1@gmail.com",
+                                            phone_number="+33666666666", company_name="test_1",
+                                            sales_contact=cls.sales_user_1)
+        cls.client2 = Client.objects.create(first_name="client_test", last_name="2", email="client_test_2@gmail.com",
+                                            phone_number="+33677777777", company_name="test_2",
+                                            sales_contact=cls.sales_user_2)
+        date = make_aware(datetime.datetime(2021, 9, 1, 10, 30))
+        cls.contracts = [Contract.objects.create(sales_contact=cls.sales_user_1 if i % 2 else cls.sales_user_2,
+                                                 client=cls.client1, status=False, amount=100, payment_due=date)
+                         for i in range(6)]
+        cls.events = [Event.objects.create(client=cls.client1, support=cls.support_user_1 if i % 2 else
+                                           cls.support_user_2, contract=contract, attendees=10, date=date)
+                      for i, contract in enumerate(cls.contracts)]
+
+    def bulk_update(self, url, changes):
+        return self.client.post(url, [{"id": pk, "changes": change} for pk, change in changes],
+                                content_type="application/json")
+
+    def test_contracts_can_be_marked_as_paid_in_a_constant_number_of_queries(self):
+        self.client.force_login(self.gestion_user)
+        self.bulk_update("/api/contracts/bulk-edit/", [(self.contracts[0].pk, {"status": True})])
+        with CaptureQueriesContext(connection) as queries:
+            self.bulk_update("/api/contracts/bulk-edit/", [(self.contracts[0].pk, {"status": True})])
+        more_contracts = [Contract.objects.create(sales_contact=self.sales_user_1, client=self.client1, status=False,
+                                                  amount=100, payment_due=self.contracts[0].payment_due)
+                          for i in range(20)]
+        with self.assertNumQueries(len(queries)):
+            resp = self.bulk_update("/api/contracts/bulk-edit/",
+                                    [(contract.pk, {"status": True}) for contract in self.contracts + more_contracts])
+        assert resp.status_code == 200
+        assert {item["status"] for item in resp.json()} == {200}
+        assert not Contract.objects.filter(status=False).exists()
+        assert Contract.objects.get(pk=self.contracts[1].pk).date_updated > self.contracts[1].date_updated
+
+    def test_each_object_has_its_own_outcome(self):
+        self.client.force_login(self.sales_user_1)
+        resp = self.bulk_update("/api/contracts/bulk-edit/", [(self.contracts[1].pk, {"status": True}),
+                                                              (self.contracts[0].pk, {"status": True}),
+                                                              (0, {"status": True}),
+                                                              (self.contracts[3].pk, {"amount": "a lot"}),
+                                                              (self.contracts[5].pk, {"amount": 200})])
+        assert resp.status_code == 200
+        assert [(item["id"], item["status"]) for item in resp.json()] == \
+            [(self.contracts[1].pk, 200), (self.contracts[0].pk, 403), (0, 404), (self.contracts[3].pk, 400),
+             (self.contracts[5].pk, 200)]
+        assert "amount" in resp.json()[3]["errors"]
+        assert set(Contract.objects.filter(status=True)) == {self.contracts[1]}
+        assert Contract.objects.get(pk=self.contracts[5].pk).amount == 200
+
+    def test_events_can_be_reassigned(self):
+        self.client.force_login(self.support_user_1)
+        resp = self.bulk_update("/api/events/bulk-edit/", [(event.pk, {"support": self.support_user_2.pk})
+                                                           for event in self.events])
+        assert [item["status"] for item in resp.json()] == [403, 200] * 3
+        assert not Event.objects.filter(support=self.support_user_1).exists()
+
+    def test_constraints_of_the_database_are_reported(self):
+        self.client.force_login(self.gestion_user)
+        resp = self.bulk_update("/api/events/bulk-edit/", [(self.events[0].pk, {"client": self.client2.pk}),
+                                                           (self.events[1].pk, {"notes": "note"})])
+        assert resp.json() == [
+            {"id": self.events[0].pk, "status": 400,
+             "errors": {"non_field_errors": ["The client must be the same for the event and the contract!"]}},
+            {"id": self.events[1].pk, "status": 200}]
+        assert Event.objects.get(pk=self.events[0].pk).client == self.client1
+        assert Event.objects.get(pk=self.events[1].pk).notes == "note"
+
+    def test_invalid_bulk_updates_are_rejected(self):
+        self.client.force_login(self.gestion_user)
+        pk = self.contracts[0].pk
+        assert self.bulk_update("/api/contracts/bulk-edit/", [(pk, {}), (pk, {})]).status_code == 400
+        assert self.client.post("/api/contracts/bulk-edit/", [{"id": pk}],
+                                content_type="application/json").status_code == 400
+        self.client.force_login(self.support_user_1)
+        assert self.bulk_update("/api/contracts/bulk-edit/", [(pk, {"status": True})]).status_code == 403
+        assert not Contract.objects.filter(status=True).exists()
+
+
+class ImportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                    email="thomas@gmail.com", password=default_password)
+        cls.support_user = MyUser.objects.create_user(first_name="Timothée", last_name="Bravo", role="support",
+                                                      email="timothee@gmail.com", password=default_password)
+        cls.client1 = Client.objects.create(first_name="client_test", last_name="1", email="client_test_1@gmail.com",
+                                            phone_number="+33666666666", company_name="test_1",
+                                            sales_contact=cls.sales_user)
+        cls.client2 = Client.objects.create(first_name="client_test", last_name="2", email="client_test_2@gmail.com",
+                                            phone_number="+33677777777", company_name="test_2")
+        date = make_aware(datetime.datetime(2021, 9, 1, 10, 30))
+        cls.contract1 = Contract.objects.create(sales_contact=cls.sales_user, client=cls.client1, status=False,
+                                                amount=100, payment_due=date)
+        cls.contract2 = Contract.objects.create(sales_contact=cls.sales_user, client=cls.client1, status=False,
+                                                amount=100, payment_due=date)
+        Event.objects.create(client=cls.client1, support=cls.support_user, contract=cls.contract1, attendees=10,
+                             date=date)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def import_csv(self, kind, content):
+        """Import a CSV file and return the output of the command and the rejected rows."""
+        path = os.path.join(self.directory, f"{kind}.csv")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        out = io.StringIO()
+        call_command("importcsv", kind, path, stdout=out)
+        rejected_path = os.path.join(self.directory, f"{kind}.rejected.csv")
+        if not os.path.exists(rejected_path):
+            return out.getvalue(), []
+        with open(rejected_path, encoding="utf-8") as file:
+            return out.getvalue(), list(csv.DictReader(file))
+
+    def test_valid_clients_are_imported_and_the_others_rejected(self):
+        output, rejected = self.import_csv("clients", (
+            "id,first_name,last_name,email,phone_number,company_name,sales_contact\n"
+            "5000,Ann,Lee,ann@gmail.com,+33612345678,Acme,thomas@gmail.com\n"
+            "5001,Bob,Lee,bob@gmail.com,0612,Acme,\n"
+            "5002,Cid,Lee,ann@gmail.com,+33612345678,Acme,\n"
+            "5003,Dan,Lee,client_test_1@gmail.com,+33612345678,Acme,\n"
+            "5004,Eve,Lee,eve@gmail.com,+33612345678,Acme,timothee@gmail.com\n"
+            "abc,Fay,Lee,fay@gmail.com,+33612345678,Acme,\n"
+            "5006,Guy,Lee,guy@gmail.com,+33612345678,Acme,\n"))
+        assert output == f"Imported 2 clients.\nRejected 5 rows, written to " \
+                         f"{os.path.join(self.directory, 'clients.rejected.csv')}.\n"
+        assert [(row["row"], row["error"]) for row in rejected] == [
+            ("2", "phone_number: Enter a valid phone number in the E.164 format."),
+            ("3", "email: Another row of the file has the same value."),
+            ("4", "email: client with this email already exists."),
+            ("5", "sales_contact: There is no sales user with this email."),
+            ("6", "id: A valid integer is required."),
+        ]
+        assert rejected[0]["phone_number"] == "0612"
+        ann = Client.objects.get(pk=5000)
+        assert (ann.email, ann.sales_contact, ann.mobile_number) == ("ann@gmail.com", self.sales_user, None)
+        assert ann.date_created is not None
+        assert Client.objects.get(pk=5006).sales_contact is None
+        # The sequence of the primary keys goes on after the imported ones.
+        assert Client.objects.create(first_name="a", last_name="b", email="new@gmail.com",
+                                     phone_number="+33612345678", company_name="c").pk > 5006
+
+    def test_contracts_need_a_client_with_a_sales_contact(self):
+        output, rejected = self.import_csv("contracts", (
+            "client,sales_contact,status,amount,payment_due\n"
+            f"{self.client1.pk},thomas@gmail.com,true,1500.5,2021-10-01 12:00\n"
+            f"{self.client2.pk},thomas@gmail.com,true,1500.5,2021-10-01 12:00\n"
+            f"{self.client1.pk},thomas@gmail.com,maybe,1500.5,2021-10-01 12:00\n"
+            f"{self.client1.pk},thomas@gmail.com,false,NaN,2021-10-01 12:00\n"
+            f"{self.client1.pk},thomas@gmail.com,false,10,2021-02-30 12:00\n"
+            f"999999,thomas@gmail.com,false,10,2021-10-01 12:00\n"))
+        assert output.startswith("Imported 1 contracts.\nRejected 5 rows")
+        assert [row["error"] for row in rejected] == [
+            "client: The client has no sales contact.",
+            "status: Must be a valid boolean.",
+            "amount: A valid number is required.",
+            "payment_due: Datetime has wrong format.",
+            "client: There is no client with this id.",
+        ]
+        contract = Contract.objects.latest("pk")
+        assert (contract.client, contract.status, contract.amount) == (self.client1, True, 1500.5)
+        # Datetimes without an offset are in the time zone of the project.
+        assert contract.payment_due == make_aware(datetime.datetime(2021, 10, 1, 12))
+        # The counters of the client are kept by the database, whatever inserts the contracts.
+        client = Client.objects.get(pk=self.client1.pk)
+        assert (client.contract_count, client.total_amount, client.unpaid_amount) == (3, 1700.5, 200)
+
+    def test_events_need_the_client_of_their_contract(self):
+        contract3 = Contract.objects.create(sales_contact=self.sales_user, client=self.client2, status=False,
+                                            amount=100, payment_due=self.contract1.payment_due)
+        contract4 = Contract.objects.create(sales_contact=self.sales_user, client=self.client2, status=False,
+                                            amount=100, payment_due=self.contract1.payment_due)
+        output, rejected = self.import_csv("events", (
+            "client,contract,support,attendees,date,notes\n"
+            f"{self.client1.pk},{self.contract2.pk},timothee@gmail.com,10,2021-10-01T12:00:00Z,\n"
+            f"{self.client1.pk},{contract3.pk},timothee@gmail.com,10,2021-10-01T12:00:00Z,\n"
+            f"{self.client1.pk},{self.contract1.pk},timothee@gmail.com,10,2021-10-01T12:00:00Z,\n"
+            f"{self.client1.pk},{self.contract2.pk},timothee@gmail.com,10,2021-10-01T12:00:00Z,\n"
+            f"{self.client2.pk},{contract4.pk},timothee@gmail.com,-1,2021-10-01T12:00:00Z,\n"))
+        assert output.startswith("Imported 1 events.\nRejected 4 rows")
+        assert [row["error"] for row in rejected] == [
+            "client: The client must be the same for the event and the contract!",
+            "contract: event with this contract already exists.",
+            "contract: Another row of the file has the same value.",
+            "attendees: A valid integer is required.",
+        ]
+        event = self.contract2.event
+        assert (event.client, event.support, event.notes) == (self.client1, self.support_user, None)
+        assert event.date == make_aware(datetime.datetime(2021, 10, 1, 12), datetime.timezone.utc)
+
+    def test_nothing_is_imported_from_a_malformed_file(self):
+        with self.assertRaises(CommandError):
+            self.import_csv("clients", "first_name,last_name,email,phone_number,company_name\n"
+                                       "Ann,Lee,ann@gmail.com,+33612345678,Acme\n"
+                                       "Bob,Lee,bob@gmail.com,+33612345678,Acme,extra\n")
+        assert not Client.objects.filter(email="ann@gmail.com").exists()
+        with self.assertRaisesMessage(CommandError, "Missing columns: email."):
+            self.import_csv("clients", "first_name,last_name,phone_number,company_name\n")
+
+
+class SeedTest(TestCase):
+    def seed(self, seed):
+        """Seed a small database and return what was created, without the primary keys."""
+        call_command("seed", "--seed", str(seed), "--users", "4", "--clients", "300", "--contracts", "500",
+                     "--events", "200", "--batch-size", "64", stdout=io.StringIO())
+        clients = Client.objects.filter(email__contains=f".{seed}-").order_by("pk")
+        return {
+            "users": list(MyUser.objects.filter(email__contains=f".{seed}-").order_by("pk")
+                          .values_list("email", "first_name", "role")),
+            "clients": list(clients.values_list("email", "phone_number", "mobile_number", "sales_contact__email",
+                                                "date_created")),
+            "contracts": list(Contract.objects.filter(client__in=clients).order_by("pk")
+                              .values_list("client__email", "sales_contact__email", "amount", "payment_due")),
+            "events": list(Event.objects.filter(client__in=clients).order_by("pk")
+                           .values_list("contract__amount", "client__email", "support__email", "date")),
+        }
+
+    def test_a_seed_gives_the_same_data(self):
+        with transaction.atomic():
+            data = self.seed(1)
+            transaction.set_rollback(True)
+        assert self.seed(1) == data
+        assert self.seed(2)["clients"] != data["clients"]
+
+    def test_seeded_data_is_valid(self):
+        data = self.seed(1)
+        assert [len(data[name]) for name in ("users", "clients", "contracts", "events")] == [12, 300, 500, 200]
+        for client in Client.objects.filter(email__contains=".1-"):
+            ClientSerializer(client, data=ClientSerializer(client).data).is_valid(raise_exception=True)
+        # The contracts have clients with a sales contact, and the events the client of their contract.
+        assert all(client and sales_contact for client, sales_contact, _, _ in data["contracts"])
+        assert not Event.objects.exclude(client=F("contract__client")).exists()
+        assert Contract.objects.latest("pk").pk < Contract.objects.create(
+            sales_contact=MyUser.objects.filter(role="sales").first(), client=Client.objects.first(), status=False,
+            amount=1, payment_due=make_aware(datetime.datetime(2021, 1, 1))).pk
+
+    def test_a_few_salespeople_own_most_clients(self):
+        data = self.seed(1)
+        owners = collections.Counter(sales_contact for _, _, _, sales_contact, _ in data["clients"] if sales_contact)
+        assert owners.most_common(1)[0][1] > len(data["clients"]) / 3
+
+
+class ChangeStreamTest(TransactionTestCase):
+    def setUp(self):
+        self.gestion_user = MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                                       email="corentin@gmail.com", password=default_password)
+        self.sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                     email="thomas@gmail.com", password=default_password)
+        self.support_user_1 = MyUser.objects.create_user(first_name="Timothée", last_name="Bravo", role="support",
+                                                         email="timothee@gmail.com", password=default_password)
+        self.support_user_2 = MyUser.objects.create_user(first_name="Timothée_2", last_name="Bravo", role="support",
+                                                         email="timothee_2@gmail.com", password=default_password)
+        self.client1 = Client.objects.create(first_name="client_test", last_name="1", email="client_test_1@gmail.com",
+                                             phone_number="+33666666666", company_name="test_1",
+                                             sales_contact=self.sales_user)
+        self.contract = Contract.objects.create(sales_contact=self.sales_user, client=self.client1, status=False,
+                                                amount=100, payment_due=make_aware(datetime.datetime(2021, 9, 1)))
+        # A bus of its own, so that its connection is closed before the test database is dropped.
+        bus = changes.ChangeBus()
+        self.addCleanup(bus.stop)
+        patcher = patch.object(changes, "bus", bus)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def open_stream(self, user):
+        self.client.force_login(user)
+        response = self.client.get("/api/changes/")
+        assert response["Content-Type"] == "text/event-stream"
+        self.addCleanup(response.close)
+        stream = iter(response.streaming_content)
+        assert next(stream) == b"retry: 3000\n\n"
+        return stream
+
+    @patch.object(ChangeStreamView, "heartbeat", 0.5)
+    def test_users_are_sent_the_changes_of_their_objects(self):
+        streams = {user: self.open_stream(user)
+                   for user in (self.gestion_user, self.sales_user, self.support_user_1, self.support_user_2)}
+        event = Event.objects.create(client=self.client1, support=self.support_user_1, contract=self.contract,
+                                     attendees=10, date=self.contract.payment_due)
+        expected = b'event: event\ndata: {"action": "create", "ids": [%d]}\n\n' % event.pk
+        assert next(streams[self.gestion_user]) == expected
+        assert next(streams[self.sales_user]) == expected
+        assert next(streams[self.support_user_1]) == expected
+        assert next(streams[self.support_user_2]) == b": heartbeat\n\n"
+        # The number of events of the client changed too.
+        expected = b'event: client\ndata: {"action": "update", "ids": [%d]}\n\n' % self.client1.pk
+        assert next(streams[self.gestion_user]) == expected
+        assert next(streams[self.sales_user]) == expected
+
+        # The changes made without saving the objects are sent as well, to the previous support too.
+        Event.objects.filter(pk=event.pk).update(support=self.support_user_2)
+        expected = b'event: event\ndata: {"action": "update", "ids": [%d]}\n\n' % event.pk
+        assert next(streams[self.support_user_1]) == expected
+        assert next(streams[self.support_user_2]) == expected
+        assert next(streams[self.sales_user]) == expected
+
+        Client.objects.create(first_name="client_test", last_name="2", email="client_test_2@gmail.com",
+                              phone_number="+33666666666", company_name="test_2")
+        assert next(streams[self.sales_user]).startswith(b'event: client\ndata: {"action": "create"')
+        assert next(streams[self.support_user_1]) == b": heartbeat\n\n"
+
+    @patch.object(ChangeStreamView, "heartbeat", 0.5)
+    @patch.object(ChangeStreamView, "max_pending", 2)
+    def test_a_stream_not_keeping_up_is_reset(self):
+        stream = self.open_stream(self.gestion_user)
+        # The notifications of a transaction are only sent once, they're made in separate ones.
+        for i in range(3):
+            Contract.objects.filter(pk=self.contract.pk).update(amount=i)
+        subscription, = changes.bus.subscriptions
+        for i in range(50):
+            if subscription.lost:
+                break
+            time.sleep(0.1)
+        assert next(stream) == b"event: reset\ndata: {}\n\n"
+        assert next(stream).startswith(b"event: contract\n")
+
+
+class ASGITest(TransactionTestCase):
+    def setUp(self):
+        self.sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                     email="thomas@gmail.com", password=default_password)
+        self.client1 = Client.objects.create(first_name="client_test", last_name="1", email="client_test_1@gmail.com",
+                                             phone_number="+33666666666", company_name="test_1",
+                                             sales_contact=self.sales_user)
+        self.handler = asgi.ASGIHandler()
+        self.addCleanup(self.handler.read_executor.shutdown)
+        bus = changes.ChangeBus()
+        self.addCleanup(bus.stop)
+        patcher = patch.object(changes, "bus", bus)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_communicator(self, method, path, body=b"", accept_encoding=b""):
+        credentials = base64.b64encode(f"{self.sales_user.email}:{default_password}".encode())
+        headers = [(b"host", b"testserver"), (b"authorization", b"Basic " + credentials),
+                   (b"accept-encoding", accept_encoding)]
+        if body:
+            headers += [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+                 "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+                 "headers": headers, "client": ("127.0.0.1", 50000), "server": ("testserver", 80)}
+        return ApplicationCommunicator(self.handler, scope)
+
+    async def fetch(self, method, path, body=b""):
+        communicator = self.get_communicator(method, path, body)
+        await communicator.send_input({"type": "http.request", "body": body})
+        start = await communicator.receive_output(5)
+        content = b""
+        while True:
+            message = await communicator.receive_output(5)
+            content += message.get("body", b"")
+            if not message.get("more_body"):
+                return start["status"], content
+
+    def record_threads(self, function, threads, barrier=None):
+        def recorded(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            if barrier is not None:
+                barrier.wait()
+            return function(*args, **kwargs)
+        return recorded
+
+    def test_reads_run_concurrently_and_writes_one_at_a_time(self):
+        threads = []
+        # Both lists only get past the barrier if they run at the same time.
+        barrier = threading.Barrier(2, timeout=5)
+
+        async def read():
+            return await asyncio.gather(self.fetch("GET", "/api/clients/list/"),
+                                        self.fetch("GET", "/api/clients/list/"))
+
+        with patch.object(services, "list_objects", self.record_threads(services.list_objects, threads, barrier)):
+            responses = async_to_sync(read)()
+        assert [status for status, content in responses] == [200, 200]
+        assert len(threads) == 2
+        assert all(name.startswith("api-read") for name in threads)
+
+        threads.clear()
+        body = (b'{"first_name": "client_test", "last_name": "2", "email": "client_test_2@gmail.com", '
+                b'"phone_number": "+33677777777", "company_name": "test_2"}')
+        with patch.object(services, "create_object", self.record_threads(services.create_object, threads)):
+            status, content = async_to_sync(self.fetch)("POST", "/api/clients/create/", body)
+        assert status == 201, content
+        assert threads == [threading.current_thread().name]
+
+    @patch.object(ChangeStreamView, "heartbeat", 0.5)
+    def test_streams_do_not_hold_a_thread(self):
+        async def stream():
+            communicator = self.get_communicator("GET", "/api/changes/", accept_encoding=b"gzip")
+            await communicator.send_input({"type": "http.request"})
+            start = await communicator.receive_output(5)
+            assert dict(start["headers"])[b"Content-Encoding"] == b"gzip"
+            decompressor = zlib.decompressobj(31)
+
+            async def receive():
+                return decompressor.decompress((await communicator.receive_output(5))["body"])
+
+            assert await receive() == b"retry: 3000\n\n"
+            client = await sync_to_async(Client.objects.create)(
+                first_name="client_test", last_name="2", email="client_test_2@gmail.com",
+                phone_number="+33666666666", company_name="test_2", sales_contact=self.sales_user)
+            assert await receive() == b'event: client\ndata: {"action": "create", "ids": [%d]}\n\n' % client.pk
+            assert await receive() == b": heartbeat\n\n"
+            # The reads are still served while the stream is open.
+            status, content = await self.fetch("GET", f"/api/clients/{client.pk}/")
+            assert status == 200
+            await communicator.send_input({"type": "http.disconnect"})
+            await communicator.wait(5)
+
+        async_to_sync(stream)()
+        assert not changes.bus.subscriptions
+
+    def test_queries_of_concurrent_reads_are_counted_by_view(self):
+        key = ("epicevents_db_queries_total", ("client_list",))
+        before = metrics.registry.collect().get(key, 0)
+        status, content = async_to_sync(self.fetch)("GET", "/api/clients/list/")
+        assert status == 200
+        assert metrics.registry.collect()[key] > before
+
+    def test_concurrent_reads_are_profiled_in_their_thread(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(PROFILE_SAMPLE_RATE=1, PROFILES_DIR=directory.name):
+            status, content = async_to_sync(self.fetch)("GET", "/api/clients/list/")
+        assert status == 200
+        profile = Profile.objects.get()
+        assert (profile.view, profile.sampled, profile.user) == ("client_list", True, self.sales_user)
+        assert profile.summary
+        calls = pstats.Stats(os.path.join(directory.name, profile.stats_file)).stats
+        assert "list_objects" in {function for filename, line, function in calls}
+        assert any('FROM "clients_client"' in query["sql"] for query in profile.queries)
+
+    def test_only_gestion_users_can_ask_for_a_profile(self):
+        gestion_user = MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                                  email="corentin@gmail.com", password=default_password)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        async def fetch(user):
+            await sync_to_async(self.client.force_login)(user)
+            cookie = f"sessionid={self.client.cookies['sessionid'].value}".encode()
+            communicator = self.get_communicator("GET", "/api/clients/list/")
+            communicator.scope["headers"] = [(b"host", b"testserver"), (b"cookie", cookie), (b"x-profile", b"true")]
+            await communicator.send_input({"type": "http.request"})
+            assert (await communicator.receive_output(5))["status"] == 200
+            await communicator.receive_output(5)
+
+        with override_settings(PROFILES_DIR=directory.name):
+            async_to_sync(fetch)(self.sales_user)
+            assert not Profile.objects.exists()
+            async_to_sync(fetch)(gestion_user)
+        assert Profile.objects.get().user == gestion_user
+
+
+class JobTest(TransactionTestCase):
+    def setUp(self):
+        self.gestion_user = MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                                       email="corentin@gmail.com", password=default_password)
+        self.sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                     email="thomas@gmail.com", password=default_password)
+        for i in range(5):
+            Client.objects.create(first_name="client_test", last_name=str(i), email=f"client_test_{i}@gmail.com",
+                                  phone_number="+33666666666", company_name=f"test_{i}", sales_contact=self.sales_user)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(JOBS_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def start(self, user, data, multipart=False):
+        self.client.force_login(user)
+        if multipart:
+            resp = self.client.post("/api/jobs/create/", data)
+        else:
+            resp = self.client.post("/api/jobs/create/", data, content_type="application/json")
+        assert resp.status_code == 202, resp.content
+        assert resp["Location"] == f"/api/jobs/{resp.json()['id']}/"
+        return Job.objects.get(pk=resp.json()["id"])
+
+    def run_worker(self):
+        call_command("runjobs", "--burst", stdout=io.StringIO())
+
+    def test_exports_are_run_by_a_worker_and_downloaded(self):
+        job = self.start(self.sales_user, {"kind": "export", "arguments": {"model": "clients", "query": "company=test_1"}})
+        assert job.status == "queued"
+        with patch.object(jobs.ExportTask, "batch_size", 2):
+            job = self.start(self.sales_user, {"kind": "export", "arguments": {"model": "clients"}})
+            self.run_worker()
+        resp = self.client.get(f"/api/jobs/{job.pk}/")
+        assert resp.json()["status"] == "succeeded"
+        assert (resp.json()["progress"], resp.json()["total"], resp.json()["result"]) == (5, 5, {"count": 5})
+        resp = self.client.get(f"/api/jobs/{job.pk}/result")
+        assert resp["Content-Disposition"] == f'attachment; filename="{job.pk}-clients.json"'
+        assert json.loads(b"".join(resp.streaming_content)) == self.client.get("/api/clients/list/").json()
+        filtered = Job.objects.exclude(pk=job.pk).get()
+        assert filtered.result == {"count": 1}
+
+    def test_invalid_jobs_are_refused(self):
+        self.client.force_login(self.sales_user)
+        for data, status_code in (({"kind": "unknown"}, 400),
+                                  ({"kind": "export", "arguments": {"model": "users"}}, 400),
+                                  ({"kind": "export", "arguments": {"model": "clients", "query": "contact=no"}}, 400),
+                                  ({"kind": "delete", "arguments": {"model": "clients", "ids": "1"}}, 400),
+                                  ({"kind": "import", "arguments": {"kind": "clients"}}, 403),
+                                  ({"kind": "reassign", "arguments": {}}, 403)):
+            with self.subTest(data=data):
+                resp = self.client.post("/api/jobs/create/", data, content_type="application/json")
+                assert resp.status_code == status_code, resp.content
+        assert not Job.objects.exists()
+
+    def test_imports_are_run_from_uploaded_files(self):
+        file = io.BytesIO(b"first_name,last_name,email,phone_number,company_name,sales_contact\n"
+                          b"Jean,Dupont,jean@gmail.com,+33612345678,Dupont,thomas@gmail.com\n"
+                          b"Marie,Curie,not an email,+33612345678,Curie,\n")
+        file.name = "clients.csv"
+        job = self.start(self.gestion_user, {"kind": "import", "arguments": '{"kind": "clients"}', "file": file},
+                         multipart=True)
+        upload = jobs.get_path(job.arguments["file"])
+        assert upload.exists()
+        self.run_worker()
+        job.refresh_from_db()
+        assert (job.status, job.result) == ("succeeded", {"imported": 1, "rejected": 1})
+        assert not upload.exists()
+        assert Client.objects.filter(email="jean@gmail.com", sales_contact=self.sales_user).exists()
+        resp = self.client.get(f"/api/jobs/{job.pk}/result")
+        rejected = list(csv.DictReader(io.StringIO(b"".join(resp.streaming_content).decode())))
+        assert [row["email"] for row in rejected] == ["not an email"]
+
+    def test_imports_only_read_the_uploaded_files(self):
+        self.client.force_login(self.gestion_user)
+        for name in ("../manage.py", os.path.abspath("manage.py"), "0" * 32 + ".upload"):
+            with self.subTest(name=name):
+                data = {"kind": "import", "arguments": {"kind": "clients", "file": name}}
+                resp = self.client.post("/api/jobs/create/", data, content_type="application/json")
+                assert resp.status_code == 400, resp.content
+                assert "file" in resp.json()
+        assert not jobs.ImportSerializer(data={"kind": "clients", "file": "../manage.py"}).is_valid()
+        assert not Job.objects.exists()
+        assert os.path.exists("manage.py")
+
+    def test_failed_jobs_are_tried_again_then_fail(self):
+        job = self.start(self.sales_user, {"kind": "export", "arguments": {"model": "clients"}})
+        with patch.object(jobs.ExportTask, "run", side_effect=RuntimeError("Disk full")):
+            for attempt in range(1, 4):
+                with self.assertLogs("api.jobs", "ERROR"):
+                    self.run_worker()
+                job.refresh_from_db()
+                assert (job.attempts, job.error) == (attempt, "RuntimeError: Disk full")
+                if attempt < 3:
+                    assert job.status == "queued"
+                    # The attempts are further and further apart.
+                    delay = (job.run_after - timezone.now()).total_seconds()
+                    assert 60 * 2 ** (attempt - 1) - 5 < delay <= 60 * 2 ** (attempt - 1)
+                    Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        assert job.status == "failed"
+
+        # A job that can't succeed fails at once.
+        job = self.start(self.sales_user, {"kind": "export", "arguments": {"model": "clients"}})
+        self.sales_user.delete()
+        self.run_worker()
+        job.refresh_from_db()
+        assert (job.status, job.attempts, job.error) == ("failed", 1, "The user who started the job was deleted.")
+
+    def test_the_jobs_running_at_once_are_limited_and_the_lost_ones_taken_over(self):
+        first = Job.objects.enqueue("import", {}, self.gestion_user)
+        second = Job.objects.enqueue("import", {}, self.gestion_user)
+        export = Job.objects.enqueue("export", {}, self.gestion_user)
+        limits = {"import": 1, "export": 1}
+        assert Job.objects.claim("worker-1", limits, stale_after=60) == first
+        # The second import must wait for the first one, the export doesn't.
+        assert Job.objects.claim("worker-2", limits, stale_after=60) == export
+        assert Job.objects.claim("worker-2", limits, stale_after=60) is None
+
+        # The first worker stopped without finishing its job: another one takes over.
+        Job.objects.filter(pk=first.pk).update(heartbeat=timezone.now() - datetime.timedelta(minutes=2))
+        claimed = Job.objects.claim("worker-2", limits, stale_after=60)
+        assert (claimed, claimed.worker, claimed.status) == (second, "worker-2", "running")
+        first.refresh_from_db()
+        assert (first.status, first.attempts, first.error) == ("queued", 1, "The worker running the job stopped.")
+        # The first worker can't save the outcome of the job anymore.
+        first.worker = "worker-1"
+        assert not first.succeed({})
+        assert Job.objects.get(pk=first.pk).status == "queued"
+
+    def test_users_only_see_their_jobs(self):
+        own = Job.objects.enqueue("export", {"model": "clients"}, self.sales_user)
+        other = Job.objects.enqueue("export", {"model": "clients"}, self.gestion_user)
+        self.client.force_login(self.sales_user)
+        assert [job["id"] for job in self.client.get("/api/jobs/list/").json()] == [own.pk]
+        assert self.client.get(f"/api/jobs/{other.pk}/").status_code == 404
+        assert self.client.get(f"/api/jobs/{own.pk}/result").status_code == 404
+        self.client.force_login(self.gestion_user)
+        assert [job["id"] for job in self.client.get("/api/jobs/list/", {"status": "queued"}).json()] == \
+               [other.pk, own.pk]
+
+    def test_users_are_reassigned_in_the_background(self):
+        new_user = MyUser.objects.create_user(first_name="Thomas_2", last_name="Bravo", role="sales",
+                                              email="thomas_2@gmail.com", password=default_password)
+        self.client.force_login(self.gestion_user)
+        resp = self.client.post(f"/api/users/{self.sales_user.pk}/reassign",
+                                {"new_user": new_user.pk, "background": True})
+        assert resp.status_code == 202
+        assert Client.objects.filter(sales_contact=self.sales_user).count() == 5
+        self.run_worker()
+        job = Job.objects.get()
+        assert (job.status, job.result["clients"]) == ("succeeded", 5)
+        assert Client.objects.filter(sales_contact=new_user).count() == 5
+
+    @patch("accounts.admin.BACKGROUND_DELETE_THRESHOLD", 2)
+    def test_the_admin_deletes_many_objects_in_the_background(self):
+        self.client.force_login(self.gestion_user)
+        pks = list(Client.objects.values_list("pk", flat=True))
+        resp = self.client.post("/admin/clients/client/", {"action": "delete_selected", "_selected_action": pks,
+                                                           "post": "yes"}, follow=True)
+        assert resp.status_code == 200
+        job = Job.objects.get()
+        assert (job.kind, job.created_by, sorted(job.arguments["ids"])) == ("delete", self.gestion_user, sorted(pks))
+        assert Client.objects.count() == 5
+        Client.objects.filter(pk=pks[0]).delete()
+        self.run_worker()
+        job.refresh_from_db()
+        assert job.result == {"deleted": 4, "not_found": [pks[0]], "forbidden": []}
+        assert not Client.objects.exists()
+
+    def test_scheduled_jobs_are_queued_once_per_interval(self):
+        schedules = {"remind": 3600}
+        job = Job.objects.claim("worker", {"remind": 1}, 60, schedules=schedules)
+        assert (job.kind, job.status) == ("remind", "running")
+        assert Job.objects.claim("worker", {"remind": 1}, 60, schedules=schedules) is None
+        assert Job.objects.count() == 1
+        job.succeed()
+        assert Job.objects.claim("worker", {"remind": 1}, 60, schedules=schedules) is None
+        queued = Job.objects.get(status="queued")
+        assert queued.run_after == job.run_after + datetime.timedelta(seconds=3600)
+        assert Job.objects.claim("worker", {"remind": 1}, 60, schedules=schedules) is None
+        assert Job.objects.count() == 2
+
+    def test_reminders_are_sent_by_a_job(self):
+        Contract.objects.create(sales_contact=self.sales_user, client=Client.objects.first(), status=False,
+                                amount=320.54, payment_due=timezone.now() - datetime.timedelta(days=1))
+        self.client.force_login(self.sales_user)
+        resp = self.client.post("/api/jobs/create/", {"kind": "remind"}, content_type="application/json")
+        assert resp.status_code == 403
+        job = self.start(self.gestion_user, {"kind": "remind"})
+        self.run_worker()
+        job.refresh_from_db()
+        assert (job.status, job.result["contracts"], job.result["reminders"]) == ("succeeded", 1, 1)
+
+
+class MetricsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gestion_user = MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                                      email="corentin@gmail.com", password=default_password)
+        cls.sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                    email="thomas@gmail.com", password=default_password)
+        cls.support_user = MyUser.objects.create_user(first_name="Timothée", last_name="Bravo", role="support",
+                                                      email="timothee@gmail.com", password=default_password)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(METRICS_DIR=directory.name, METRICS_TOKEN="8e03978e40d5")
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.directory = directory.name
+
+    def read_metrics(self, **headers):
+        """Return the samples served by the metrics endpoint, with their value."""
+        resp = self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer 8e03978e40d5", **headers)
+        assert resp.status_code == 200
+        assert resp["Content-Type"] == "text/plain; version=0.0.4; charset=utf-8"
+        samples = {}
+        for line in resp.content.decode().splitlines():
+            if not line.startswith("#"):
+                sample, value = line.rsplit(" ", 1)
+                samples[sample] = float(value)
+        return samples
+
+    def test_requests_are_counted_by_view(self):
+        before = self.read_metrics()
+        self.client.force_login(self.sales_user)
+        for _ in range(2):
+            assert self.client.get("/api/clients/list/").status_code == 200
+        after = self.read_metrics()
+
+        def increase(sample):
+            return after.get(sample, 0) - before.get(sample, 0)
+
+        assert increase('epicevents_requests_total{view="client_list",method="GET",status="200"}') == 2
+        assert increase('epicevents_request_duration_seconds_count{view="client_list"}') == 2
+        assert increase('epicevents_request_duration_seconds_bucket{view="client_list",le="+Inf"}') == 2
+        assert increase('epicevents_request_duration_seconds_sum{view="client_list"}') > 0
+        assert increase('epicevents_db_queries_total{view="client_list"}') >= 2
+        assert increase('epicevents_db_query_duration_seconds_total{view="client_list"}') > 0
+
+    def test_permissions_denied_are_counted_by_view(self):
+        before = self.read_metrics()
+        self.client.force_login(self.support_user)
+        assert self.client.post("/api/clients/create/", {}, content_type="application/json").status_code == 403
+        self.client.force_login(self.sales_user)
+        assert self.client.get("/admin/accounts/myuser/").status_code == 403
+        after = self.read_metrics()
+        for view in ("client_create", "accounts_myuser_changelist"):
+            with self.subTest(view=view):
+                sample = f'epicevents_permission_denied_total{{view="{view}"}}'
+                assert after[sample] - before.get(sample, 0) == 1
+
+    def test_idempotency_cache_reads_are_counted(self):
+        before = self.read_metrics()
+        self.client.force_login(self.sales_user)
+        data = {"first_name": "client_test", "last_name": "1", "email": "client_test_1@gmail.com",
+                "phone_number": "+33666666666", "company_name": "test_1"}
+        for _ in range(3):
+            resp = self.client.post("/api/clients/create/", data, content_type="application/json",
+                                    HTTP_IDEMPOTENCY_KEY="8e03978e-40d5-43e8-bc93-6894a57f9324")
+            assert resp.status_code == 201
+        after = self.read_metrics()
+        for result, count in (("hit", 2), ("miss", 1)):
+            with self.subTest(result=result):
+                sample = f'epicevents_cache_requests_total{{cache="idempotency",result="{result}"}}'
+                assert after[sample] - before.get(sample, 0) == count
+
+    def test_metrics_are_only_read_by_gestion_users_and_with_the_token(self):
+        assert self.client.get("/api/metrics/").status_code == 403
+        assert self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer 8e03978e40d6").status_code == 403
+        self.client.force_login(self.sales_user)
+        assert self.client.get("/api/metrics/").status_code == 403
+        self.client.force_login(self.gestion_user)
+        assert self.client.get("/api/metrics/").status_code == 200
+        with override_settings(METRICS_TOKEN=None):
+            self.client.logout()
+            assert self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer None").status_code == 403
+
+    def test_metrics_of_the_processes_are_added_up(self):
+        counter = metrics.CACHE_REQUESTS
+        sample = 'epicevents_cache_requests_total{cache="metrics_test",result="hit"}'
+        counter.inc(3, cache="metrics_test", result="hit")
+        pid = os.fork()
+        if pid == 0:
+            # The child starts from zero and writes its own file.
+            try:
+                counter.inc(2, cache="metrics_test", result="hit")
+                metrics.registry.flush()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        assert len(os.listdir(self.directory)) == 1
+        assert self.read_metrics()[sample] == 5
+        metrics.registry.flush()
+        assert len(os.listdir(self.directory)) == 2
+        # The file of this process isn't added to its own values.
+        assert self.read_metrics()[sample] == 5
+
+    def test_values_counted_by_threads_are_kept_once_they_stop(self):
+        registry = metrics.Registry()
+        counter = metrics.Counter("test_total", "A test.", ("thread",), registry=registry)
+        histogram = metrics.Histogram("test_seconds", "A test.", registry=registry, buckets=(0.1, 1))
+
+        def count():
+            for i in range(10000):
+                counter.inc(thread="any")
+                histogram.observe(i % 3 / 2)
+
+        threads = [threading.Thread(target=count) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        values = registry.collect()
+        assert values[("test_total", ("any",))] == 80000
+        assert values[("test_seconds", ())] == [26672, 53328, 0, 39996]
+        assert registry.collect() == values
+        assert not registry.threads
+        assert registry.render(values).splitlines()[-7:] == [
+            '# HELP test_seconds A test.', '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 26672', 'test_seconds_bucket{le="1"} 80000',
+            'test_seconds_bucket{le="+Inf"} 80000', 'test_seconds_sum 39996.0', 'test_seconds_count 80000']
+
+
+class ProfilerTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gestion_user = MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion",
+                                                      email="corentin@gmail.com", password=default_password)
+        cls.sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                    email="thomas@gmail.com", password=default_password)
+        Client.objects.create(first_name="client_test", last_name="1", email="client_test_1@gmail.com",
+                              phone_number="+33666666666", company_name="test_1", sales_contact=cls.sales_user)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(PROFILES_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.directory = directory.name
+
+    def test_requests_asked_by_gestion_users_are_profiled(self):
+        self.client.force_login(self.gestion_user)
+        assert self.client.get("/api/events/list/?client=test_1&profile=true").status_code == 200
+        assert self.client.get("/admin/events/event/", HTTP_X_PROFILE="true").status_code == 200
+        assert self.client.get("/api/events/list/?profile=false").status_code == 200
+        api_profile, admin_profile = Profile.objects.order_by("pk")
+        assert (api_profile.view, api_profile.path, api_profile.user, api_profile.sampled) == \
+            ("event_list", "/api/events/list/?client=test_1&profile=true", self.gestion_user, False)
+        assert admin_profile.view == "events_event_changelist"
+        assert admin_profile.summary
+        calls = pstats.Stats(os.path.join(self.directory, admin_profile.stats_file)).stats
+        assert "obtain_queryset" in {function for filename, line, function in calls}
+        assert api_profile.query_count == len(api_profile.queries) > 0
+        assert any('FROM "events_event"' in query["sql"] for query in api_profile.queries)
+        assert api_profile.duration >= api_profile.query_duration > 0
+
+        resp = self.client.get("/api/profiles/list/?view=event_list")
+        assert [profile["id"] for profile in resp.json()] == [api_profile.pk]
+        resp = self.client.get(f"/api/profiles/{api_profile.pk}/stats")
+        assert resp.status_code == 200
+        path = os.path.join(self.directory, "downloaded.prof")
+        with open(path, "wb") as file:
+            file.write(b"".join(resp.streaming_content))
+        assert pstats.Stats(path).total_calls > 0
+
+    def test_other_users_are_not_profiled(self):
+        with patch.object(profiling, "RequestProfile", wraps=profiling.RequestProfile) as request_profile:
+            assert self.client.get("/api/events/list/?profile=true").status_code == 403
+            self.client.force_login(self.sales_user)
+            assert self.client.get("/api/events/list/?profile=true").status_code == 200
+            assert self.client.get("/api/events/list/", HTTP_X_PROFILE="1").status_code == 200
+            credentials = base64.b64encode(f"{self.sales_user.email}:{default_password}".encode()).decode()
+            self.client.logout()
+            assert self.client.get("/api/events/list/?profile=true",
+                                   HTTP_AUTHORIZATION=f"Basic {credentials}").status_code == 200
+        assert not request_profile.called
+        assert not Profile.objects.exists()
+        self.client.force_login(self.sales_user)
+        assert self.client.get("/api/profiles/list/").status_code == 403
+
+    def test_one_in_profile_sample_rate_requests_is_profiled(self):
+        self.client.force_login(self.sales_user)
+        with override_settings(PROFILE_SAMPLE_RATE=1):
+            assert self.client.get("/api/clients/list/").status_code == 200
+        assert self.client.get("/api/clients/list/").status_code == 200
+        profile = Profile.objects.get()
+        assert (profile.view, profile.user, profile.sampled) == ("client_list", self.sales_user, True)
+
+    def test_only_the_latest_profiles_are_kept(self):
+        self.client.force_login(self.gestion_user)
+        with patch.object(Profile.objects, "max_kept", 2):
+            for _ in range(3):
+                assert self.client.get("/api/clients/list/?profile=true").status_code == 200
+        profiles = Profile.objects.order_by("pk")
+        assert len(profiles) == 2
+        assert sorted(os.listdir(self.directory)) == sorted(profile.stats_file for profile in profiles)
@@ -0,0 +1,131 @@
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from phonenumber_field.modelfields import PhoneNumberField
+from phonenumber_field.phonenumber import to_python
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
+
+# The values of those fields are already what their to_representation would return.
+IDENTITY_FIELDS = (serializers.BooleanField, serializers.CharField, serializers.FloatField, serializers.IntegerField)
+
+
+def identity(value):
+    return value
+
+
+def datetime_converter(field):
+    """Return a function converting datetimes like the DateTimeField does with the ISO 8601 format."""
+    field_timezone = getattr(field, 'timezone', field.default_timezone())
+
+    def convert(value):
+        if field_timezone is not None:
+            value = value.astimezone(field_timezone)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def phone_number_converter(model_field):
+    """Return a function converting the phone numbers stored in the database like their `__str__` does.
+
+    When they're stored in the format they're displayed in, the valid numbers don't need to be parsed again."""
+    stored_as_displayed = (getattr(settings, "PHONENUMBER_DB_FORMAT", "E164") == "E164"
+                           and getattr(settings, "PHONENUMBER_DEFAULT_FORMAT", "E164") == "E164")
+
+    def convert(value):
+        if stored_as_displayed and value[:1] == '+' and value[1:].isdigit():
+            return value
+        return str(to_python(value, region=model_field.region))
+    return convert
+
+
+class ValuesSerializer:
+    """Serialize lists with `.values_list()` rather than model instances, for the lists that may be large.
+
+    Each column is converted by a function chosen once for the field of `serializer` it comes from, so that the output
+    is the same as the one of the serializer without going through each of its fields for each object. Only the fields
+    reading a column of the model, or the primary keys of a reverse relation, are supported."""
+
+    def __init__(self, serializer):
+        self.model = serializer.Meta.model
+        self.columns = []
+        self.converters = []
+        self.reverse_relations = []
+        for field in serializer._readable_fields:
+            if isinstance(field, ManyRelatedField):
+                self.reverse_relations.append((len(self.columns), self.get_reverse_relation(field)))
+                self.columns.append('pk')
+                self.converters.append(None)
+            else:
+                self.columns.append(field.source)
+                self.converters.append(self.get_converter(field))
+        self.names = [field.field_name for field in serializer._readable_fields]
+
+    def get_model_field(self, field):
+        if field.source == '*' or '.' in field.source:
+            raise ImproperlyConfigured(f"The field {field.field_name} can't be read from a column.")
+        try:
+            return self.model._meta.get_field(field.source)
+        except FieldDoesNotExist as error:
+            raise ImproperlyConfigured(f"The field {field.field_name} can't be read from a column.") from error
+
+    def get_reverse_relation(self, field):
+        model_field = self.get_model_field(field)
+        if not isinstance(field.child_relation, PrimaryKeyRelatedField) or field.child_relation.pk_field is not None \
+                or not model_field.one_to_many:
+            raise ImproperlyConfigured(f"The field {field.field_name} isn't a list of primary keys.")
+        return model_field
+
+    def get_converter(self, field):
+        """Return the function converting the values of the column of a field into what the field would return."""
+        model_field = self.get_model_field(field)
+        if isinstance(field, PrimaryKeyRelatedField):
+            if field.pk_field is not None:
+                return field.pk_field.to_representation
+            return identity
+        if isinstance(field, serializers.DateTimeField) \
+                and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601:
+            return datetime_converter(field)
+        if isinstance(model_field, PhoneNumberField):
+            return phone_number_converter(model_field)
+        if type(field) in IDENTITY_FIELDS or type(field) is serializers.EmailField:
+            return identity
+        return field.to_representation
+
+    def get_rows(self, queryset):
+        """Return the queryset of the rows to serialize. It can be paginated like the queryset."""
+        return queryset.values_list(*self.columns)
+
+    def to_representation(self, rows):
+        """Return the list of the dictionaries the serializer would have returned for those rows."""
+        rows = list(rows)
+        converters = [(index, converter) for index, converter in enumerate(self.converters)
+                      if converter is not None and converter is not identity]
+        related = {}
+        for index, relation in self.reverse_relations:
+            related[index] = self.get_related_pks(relation, [row[index] for row in rows])
+        data = []
+        for row in rows:
+            row = list(row)
+            for index, converter in converters:
+                if row[index] is not None:
+                    row[index] = converter(row[index])
+            for index, pks in related.items():
+                row[index] = pks.get(row[index], [])
+            data.append(dict(zip(self.names, row)))
+        return data
+
+    def get_related_pks(self, relation, pks):
+        """Return the primary keys of the objects related to each of the given primary keys, in a single query.
+
+        They're ordered by primary key, as PrimaryKeyListField orders them for the serializer."""
+        related_model = relation.related_model
+        field_name = relation.field.attname
+        related = {}
+        for pk, related_pk in related_model._default_manager.filter(**{f"{field_name}__in": pks}) \
+                .order_by('pk').values_list(field_name, 'pk'):
+            related.setdefault(pk, []).append(related_pk)
+        return related
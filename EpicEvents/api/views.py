@@ -1,22 +1,188 @@
-import datetime
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
 
-from django.utils.timezone import make_aware
-from rest_framework import status
-from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, QueryDict, StreamingHttpResponse
+from django.urls import resolve, reverse
+from django.utils import timezone
+from django.utils.cache import add_never_cache_headers, patch_cache_control, patch_vary_headers
+from django.views import defaults
+from rest_framework import exceptions, mixins, serializers, status
+from rest_framework.decorators import action
+from rest_framework.permissions import SAFE_METHODS, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet
+from rest_framework.views import APIView, exception_handler as drf_exception_handler
+from rest_framework.viewsets import GenericViewSet, ModelViewSet
 
-from .serializers import MyUserSerializer, ClientSerializer, EventSerializer, ContractSerializer
-from accounts.models import MyUser
+from . import changes, jobs, metrics, profiling, services
+from .asgi import AsyncStreamingHttpResponse
+from .serializers import (MyUserSerializer, ClientSerializer, EventSerializer, ContractSerializer,
+                          BatchRequestSerializer, BulkUpdateSerializer, JobCreateSerializer, JobSerializer,
+                          ProfileSerializer, ReassignSerializer, ReassignmentSerializer)
+from accounts.models import MyUser, Reassignment
 from clients.models import Contract, Client
 from events.models import Event
-from .permissions import IsContactOrReadOnly, IsContactOrSupportOrReadOnly, IsManager
+from .models import Job, Profile
+from .filters import DeclarativeFilterBackend, Filter, FilterSet, MethodFilter, OrderingFilter
+from .routers import LazyViewSetView
+from .permissions import CanReadMetrics, IsContactOrReadOnly, IsContactOrSupportOrReadOnly, IsManager
+from .values import ValuesSerializer
 
 
-class UserAPIViewSet(ModelViewSet):
+# The archived contracts and events are only listed with `include_archived=true`, see ContractManager.archive.
+INCLUDE_ARCHIVED = Filter(lambda include: Q() if include else Q(archived=False), serializers.BooleanField(),
+                          default=False)
+
+
+def exception_handler(exc, context):
+    """The exception handler of DRF, counting the permissions denied for the metrics."""
+    if isinstance(exc, (exceptions.PermissionDenied, PermissionDenied)):
+        metrics.PERMISSION_DENIED.inc(view=metrics.get_view_name())
+    return drf_exception_handler(exc, context)
+
+
+def permission_denied(request, exception):
+    """The view of the 403 responses of Django, like the ones of the admin, counting them for the metrics."""
+    metrics.PERMISSION_DENIED.inc(view=metrics.get_view_name(request))
+    return defaults.permission_denied(request, exception)
+
+
+class CacheControlMixin:
+    """Set the cache headers of the responses depending on the method of the request.
+
+    The responses to safe methods depend on the user, so only their own cache may keep them. The other responses, like
+    lists obtained with POST, must never be cached."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            patch_cache_control(response, private=True, max_age=0)
+            patch_vary_headers(response, ('Authorization', 'Cookie'))
+        else:
+            add_never_cache_headers(response)
+        return response
+
+
+class ServiceMixin:
+    """Run the actions of the viewset through the services, which the admin also uses.
+
+    If `fast_list` is set, the lists are serialized from the values of the columns rather than from model instances.
+    If `concurrent_reads` is set, the ASGI handler of the API runs the reads concurrently, see api.asgi."""
+    fast_list = False
+    concurrent_reads = False
+
+    def list(self, request, *args, **kwargs):
+        queryset = services.list_objects(self)
+        if self.fast_list:
+            serializer = ValuesSerializer(self.get_serializer())
+            rows = serializer.get_rows(queryset)
+            page = self.paginate_queryset(rows)
+            if page is not None:
+                return self.get_paginated_response(serializer.to_representation(page))
+            return Response(serializer.to_representation(rows))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    def create(self, request, *args, **kwargs):
+        serializer = services.create_object(self, request.data)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def update(self, request, *args, **kwargs):
+        serializer = services.update_object(self, request.data, partial=kwargs.pop('partial', False))
+        return Response(serializer.data)
+
+    def destroy(self, request, *args, **kwargs):
+        services.delete_object(self)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class IdempotencyMixin:
+    """Let the clients retry creations safely, by sending the same `Idempotency-Key` header with each try.
+
+    The response to the first try is stored for `idempotency_timeout` seconds, and returned to the following ones
+    without validating or saving anything again. A key reused with other data is refused, as is a key whose first
+    try is still being run. Only successful creations are stored, failed ones can be fixed and tried again."""
+    idempotency_timeout = 24 * 3600
+    # How long a try may run before another try with the same key is allowed to run.
+    idempotency_lock_timeout = 60
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return super().create(request, *args, **kwargs)
+        cache = caches['idempotency']
+        cache_key = hashlib.sha256(f"{request.user.pk}:{self.basename}:{key}".encode()).hexdigest()
+        fingerprint = hashlib.sha256(
+            json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+        if not cache.add(cache_key, {'fingerprint': fingerprint}, self.idempotency_lock_timeout):
+            stored = cache.get(cache_key)
+            if stored is None:
+                # It expired since it was added, this try can be the first one again.
+                return self.create(request, *args, **kwargs)
+            metrics.CACHE_REQUESTS.inc(cache='idempotency', result='hit')
+            if stored['fingerprint'] != fingerprint:
+                return Response({'detail': 'This Idempotency-Key was already used with other data.'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if 'status' not in stored:
+                return Response({'detail': 'A request with this Idempotency-Key is still being processed.'},
+                                status=status.HTTP_409_CONFLICT)
+            response = Response(stored['data'], status=stored['status'], headers=stored['headers'])
+            response['Idempotent-Replayed'] = 'true'
+            return response
+        metrics.CACHE_REQUESTS.inc(cache='idempotency', result='miss')
+
+        try:
+            response = super().create(request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        cache.set(cache_key, {'fingerprint': fingerprint, 'status': response.status_code, 'data': dict(response.data),
+                              'headers': {name: value for name, value in response.items() if name == 'Location'}},
+                  self.idempotency_timeout)
+        return response
+
+
+class BulkUpdateMixin:
+    """Add an action changing many objects at once, from a list of `{"id": 1, "changes": {"status": true}}`.
+
+    The permissions and the changes are checked like for each object separately, and the outcome of each one is
+    returned, as `{"id": 1, "status": 200}` or with the `errors`. The objects that can be changed are changed even if
+    others can't."""
+    bulk_update_max_objects = 5000
+
+    @action(detail=False, methods=['post', 'patch'], url_path='bulk-edit', url_name='bulk_edit')
+    def bulk_update(self, request, *args, **kwargs):
+        rows = BulkUpdateSerializer(data=request.data, many=True)
+        rows.is_valid(raise_exception=True)
+        if len(rows.validated_data) > self.bulk_update_max_objects:
+            raise serializers.ValidationError(f"Can't change more than {self.bulk_update_max_objects} objects at once.")
+        changes = {row["id"]: row["changes"] for row in rows.validated_data}
+        if len(changes) < len(rows.validated_data):
+            raise serializers.ValidationError("Each object can only be given once.")
+        outcomes = services.bulk_update_objects(self, changes)
+        return Response([{"id": pk, **outcome} for pk, outcome in outcomes.items()])
+
+
+class UserAPIViewSet(CacheControlMixin, ServiceMixin, ModelViewSet):
     queryset = MyUser.objects.all()
     permission_classes = (IsAuthenticated, IsAdminUser, IsManager)
     serializer_class = MyUserSerializer
+    filter_backends = (DeclarativeFilterBackend,)
+    filterset = FilterSet(
+        email=Filter("email", serializers.EmailField()),
+        role=Filter("role", serializers.ChoiceField(choices=MyUser.roles)),
+    )
 
     def perform_update(self, serializer):
         """Add the password to the serializer data before saving it, if there is one."""
@@ -25,135 +191,291 @@ class UserAPIViewSet(ModelViewSet):
         else:
             serializer.save()
 
-    def get_queryset(self):
-        """Filter the queryset depending on given parameters."""
-        queryset = super().get_queryset()
-        email = self.request.query_params.get('email')
-        role = self.request.query_params.get('role')
-        if email is not None:
-            queryset = queryset.filter(email=email)
-        if role is not None:
-            queryset = queryset.filter(role=role)
-        return queryset
-
-
-class ClientAPIViewSet(ModelViewSet):
+    @action(detail=True, methods=['post'], url_path='reassign', url_name='reassign')
+    def reassign(self, request, *args, **kwargs):
+        """Give all the clients, contracts and events of the user to another user, usually before the user leaves."""
+        previous_user = self.get_object()
+        serializer = ReassignSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data["background"]:
+            return start_job(request, jobs.TASKS["reassign"], {
+                "previous_user": previous_user.pk, "new_user": serializer.validated_data["new_user"].pk,
+                "deactivate": serializer.validated_data["deactivate"]})
+        try:
+            reassignment = Reassignment.objects.reassign(previous_user, serializer.validated_data["new_user"],
+                                                         performed_by=request.user,
+                                                         deactivate=serializer.validated_data["deactivate"])
+        except ValueError as error:
+            raise serializers.ValidationError({"new_user": [str(error)]})
+        return Response(ReassignmentSerializer(reassignment).data, status=status.HTTP_201_CREATED)
+
+
+class ClientAPIViewSet(CacheControlMixin, IdempotencyMixin, ServiceMixin, ModelViewSet):
     queryset = Client.objects.all()
     permission_classes = (IsAuthenticated, IsContactOrReadOnly,)
     serializer_class = ClientSerializer
+    fast_list = True
+    concurrent_reads = True
+    filter_backends = (DeclarativeFilterBackend,)
+    filterset = FilterSet(
+        email=Filter("email", serializers.EmailField()),
+        company=Filter("company_name"),
+        contact=Filter("sales_contact__email", serializers.EmailField()),
+        search=MethodFilter("search"),
+        ordering=OrderingFilter("event_count", "contract_count", "total_amount", "unpaid_amount"),
+    )
 
-    def get_queryset(self):
-        """Filter the queryset depending on given parameters."""
-        queryset = super().get_queryset()
-        email = self.request.query_params.get('email')
-        company_name = self.request.query_params.get('company')
-        sales_contact = self.request.query_params.get('contact')
-        if email is not None:
-            queryset = queryset.filter(email=email)
-        if sales_contact is not None:
-            queryset = queryset.filter(sales_contact__email=sales_contact)
-        if company_name is not None:
-            queryset = queryset.filter(company_name=company_name)
-        return queryset
-
-
-class EventAPIViewSet(ModelViewSet):
+
+class EventAPIViewSet(CacheControlMixin, IdempotencyMixin, BulkUpdateMixin, ServiceMixin, ModelViewSet):
     queryset = Event.objects.all()
     permission_classes = (IsAuthenticated, IsContactOrSupportOrReadOnly,)
     serializer_class = EventSerializer
+    fast_list = True
+    concurrent_reads = True
+    filter_backends = (DeclarativeFilterBackend,)
+    filterset = FilterSet(
+        client=Filter("client__company_name"),
+        support=Filter("support__email", serializers.EmailField()),
+        contact=Filter("client__sales_contact__email", serializers.EmailField()),
+        include_archived=INCLUDE_ARCHIVED,
+    )
 
-    def create(self, request, *args, **kwargs):
-        """Create an event, turning the date and time into a datetime object."""
-        data = request.data.copy()
-        if "date_0" in request.data and "date_1" in request.data:
-            data["date"] = merge_date_time(request.data["date_0"], request.data["date_1"])
-        serializer = self.get_serializer(data=data)
-        serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-    def update(self, request, *args, **kwargs):
-        """Update an event, turning the date and time into a datetime object."""
-        partial = kwargs.pop('partial', False)
-        instance = self.get_object()
-        data = request.data.copy()
-        if "date_0" in request.data and "date_1" in request.data:
-            data["date"] = merge_date_time(request.data["date_0"], request.data["date_1"])
-        serializer = self.get_serializer(instance, data=data, partial=partial)
-        serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+class ContractAPIViewSet(CacheControlMixin, IdempotencyMixin, BulkUpdateMixin, ServiceMixin, ModelViewSet):
+    queryset = Contract.objects.all()
+    permission_classes = (IsAuthenticated, IsContactOrReadOnly,)
+    serializer_class = ContractSerializer
+    fast_list = True
+    concurrent_reads = True
+    filter_backends = (DeclarativeFilterBackend,)
+    filterset = FilterSet(
+        due=Filter(lambda due: Q(payment_due__lt=timezone.now()) if due else Q(), serializers.BooleanField()),
+        client=Filter("client__company_name"),
+        contact=Filter("client__sales_contact__email", serializers.EmailField()),
+        include_archived=INCLUDE_ARCHIVED,
+    )
 
-        if getattr(instance, '_prefetched_objects_cache', None):
-            instance._prefetched_objects_cache = {}
 
-        return Response(serializer.data)
+def start_job(request, task, arguments):
+    """Queue a job of the user of the request and return the response telling where to follow it."""
+    job = Job.objects.enqueue(task.name, task.validate(request.user, arguments), created_by=request.user,
+                              max_attempts=task.max_attempts)
+    return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED,
+                    headers={"Location": reverse("job_find", kwargs={"pk": job.pk})})
+
+
+class JobAPIViewSet(CacheControlMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, GenericViewSet):
+    """Start the operations too long for a request, which the `runjobs` workers run in the background, and follow them.
+
+    A job is created with its `kind` and its `arguments`, like `{"kind": "export", "arguments": {"model": "contracts",
+    "query": "due=true"}}`, with the CSV `file` of the imports, see api.jobs for the kinds. The users see the jobs they
+    started, the gestion users all of them. The file a job made, like an export, is downloaded from its `result`."""
+    queryset = Job.objects.all()
+    permission_classes = (IsAuthenticated,)
+    serializer_class = JobSerializer
+    filter_backends = (DeclarativeFilterBackend,)
+    filterset = FilterSet(
+        kind=Filter("kind"),
+        status=Filter("status", serializers.ChoiceField(choices=Job.statuses)),
+    )
 
     def get_queryset(self):
-        """Filter the queryset depending on given parameters."""
-        queryset = super().get_queryset()
-        client = self.request.query_params.get('client')
-        support = self.request.query_params.get('support')
-        contact = self.request.query_params.get('contact')
-        if client is not None:
-            queryset = queryset.filter(client__company_name=client)
-        if contact is not None:
-            queryset = queryset.filter(client__sales_contact__email=contact)
-        if support is not None:
-            queryset = queryset.filter(support__email=support)
-        return queryset
-
-
-class ContractAPIViewSet(ModelViewSet):
-    queryset = Contract.objects.all()
-    permission_classes = (IsAuthenticated, IsContactOrReadOnly,)
-    serializer_class = ContractSerializer
+        queryset = super().get_queryset().order_by("-pk")
+        if self.request.user.role == "gestion":
+            return queryset
+        return queryset.filter(created_by=self.request.user)
 
     def create(self, request, *args, **kwargs):
-        """Create a contract, turning the date and time into a datetime object."""
-        data = request.data.copy()
-        if "payment_due_0" in request.data and "payment_due_1" in request.data:
-            data["payment_due"] = merge_date_time(request.data["payment_due_0"], request.data["payment_due_1"])
-        serializer = self.get_serializer(data=data)
+        serializer = JobCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
-        headers = self.get_success_headers(serializer.data)
-        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        task = jobs.TASKS.get(serializer.validated_data["kind"])
+        if task is None:
+            raise serializers.ValidationError({"kind": [f"Must be one of {', '.join(jobs.TASKS)}."]})
+        arguments = serializer.validated_data["arguments"]
+        # The file of a job is only ever the one uploaded with it.
+        arguments.pop("file", None)
+        upload = serializer.validated_data.get("file")
+        if upload is not None:
+            arguments["file"] = jobs.store_file(upload)
+        try:
+            return start_job(request, task, arguments)
+        except Exception:
+            if upload is not None:
+                jobs.remove_file(arguments["file"])
+            raise
 
-    def update(self, request, *args, **kwargs):
-        """Update a contract, turning the date and time into a datetime object."""
-        partial = kwargs.pop('partial', False)
-        instance = self.get_object()
-        data = request.data.copy()
-        if "payment_due_0" in request.data and "payment_due_1" in request.data:
-            data["payment_due"] = merge_date_time(request.data["payment_due_0"], request.data["payment_due_1"])
-        serializer = self.get_serializer(instance, data=data, partial=partial)
-        serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+    @action(detail=True, methods=['get'], url_path='result', url_name='result')
+    def result(self, request, *args, **kwargs):
+        """Download the file the job made."""
+        job = self.get_object()
+        if not job.result_file:
+            raise Http404
+        try:
+            file = open(jobs.get_path(job.result_file), 'rb')
+        except FileNotFoundError:
+            raise Http404
+        return FileResponse(file, as_attachment=True, filename=job.result_file)
 
-        if getattr(instance, '_prefetched_objects_cache', None):
-            instance._prefetched_objects_cache = {}
 
-        return Response(serializer.data)
+class ProfileAPIViewSet(CacheControlMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, GenericViewSet):
+    """The profiles of the requests, for the gestion users, see api.middleware.ProfilerMiddleware.
 
-    def get_queryset(self):
-        """Filter the queryset depending on given parameters."""
-        queryset = super().get_queryset()
-        due = self.request.query_params.get('due')
-        client = self.request.query_params.get('client')
-        contact = self.request.query_params.get('contact')
-        if due is not None and due.lower() == "true":
-            queryset = queryset.filter(payment_due__lt=datetime.datetime.now())
-        if contact is not None:
-            queryset = queryset.filter(client__sales_contact__email=contact)
-        if client is not None:
-            queryset = queryset.filter(client__company_namel=client)
-        return queryset
-
-
-def merge_date_time(date, time):
-    """Merge a date string and time string in a specific format into a single aware datetime object."""
-    date = datetime.datetime.strptime(date, "%Y-%m-%d")
-    time = datetime.datetime.strptime(time, "%H:%M:%S")
-    time = datetime.time(hour=time.hour, minute=time.minute, second=time.second)
-    return make_aware(datetime.datetime.combine(date, time))
+    A profile tells how long the request took, its queries in order and the functions taking the longest. The calls
+    recorded by cProfile are downloaded from its `stats`, to be read with pstats or snakeviz."""
+    queryset = Profile.objects.order_by("-pk")
+    permission_classes = (IsAuthenticated, IsManager)
+    serializer_class = ProfileSerializer
+    filter_backends = (DeclarativeFilterBackend,)
+    filterset = FilterSet(
+        view=Filter("view"),
+        user=Filter("user__email", serializers.EmailField()),
+        sampled=Filter("sampled", serializers.BooleanField()),
+    )
+
+    @action(detail=True, methods=['get'], url_path='stats', url_name='stats')
+    def stats(self, request, *args, **kwargs):
+        """Download the calls recorded by cProfile."""
+        profile = self.get_object()
+        try:
+            file = open(profiling.get_path(profile.stats_file), 'rb')
+        except FileNotFoundError:
+            raise Http404
+        return FileResponse(file, as_attachment=True, filename=profile.stats_file)
+
+
+class BatchAPIView(CacheControlMixin, APIView):
+    """Run several requests to the API in a single one, under the authentication of the batch.
+
+    The body is a list of requests, like `{"method": "GET", "url": "/api/events/1/"}`, with a `body` for the ones
+    sending data. Their responses are returned in the same order, as `{"status": 200, "body": ...}`. Identical GET
+    requests are only run once, and if the batch only reads data, its requests are run concurrently. Otherwise they're
+    run one after the other, as if they had been made separately."""
+    permission_classes = (IsAuthenticated,)
+    max_requests = 20
+    max_workers = 4
+
+    def post(self, request, *args, **kwargs):
+        batch = BatchRequestSerializer(data=request.data, many=True)
+        batch.is_valid(raise_exception=True)
+        if len(batch.validated_data) > self.max_requests:
+            raise serializers.ValidationError(f"A batch can't have more than {self.max_requests} requests.")
+        requests = [(item["method"], item["url"], item["body"]) for item in batch.validated_data]
+
+        if any(method != "GET" for method, url, body in requests):
+            responses = [self.run(*sub_request) for sub_request in requests]
+        else:
+            urls = list(dict.fromkeys(url for method, url, body in requests))
+            if self.max_workers > 1 and len(urls) > 1:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+                    results = dict(zip(urls, executor.map(self.run_in_thread, urls)))
+            else:
+                results = {url: self.run("GET", url, {}) for url in urls}
+            responses = [results[url] for method, url, body in requests]
+        return Response(responses)
+
+    def run(self, method, url, body):
+        """Run a request against a viewset of the API and return its status and its data."""
+        path, _, query = url.partition("?")
+        try:
+            match = resolve(path)
+            # Only the actions of the viewsets can be run, not other views like the batch itself.
+            if not isinstance(match.func, LazyViewSetView):
+                raise Http404
+            action = match.func.actions.get(method.lower())
+            if action is None:
+                raise exceptions.MethodNotAllowed(method)
+            # The other actions, like the downloads, don't answer with data the batch can return.
+            if action not in services.ACTION_METHODS:
+                raise exceptions.MethodNotAllowed(method, detail=f"The action {action} can't be run in a batch.")
+            response = services.run_action(match.func.cls, self.request.user, action, data=body,
+                                           query_params=QueryDict(query), **match.kwargs)
+        except Exception as exc:
+            response = exception_handler(exc, {"view": self, "request": self.request})
+            if response is None:
+                raise
+        return {"status": response.status_code, "body": response.data}
+
+    def run_in_thread(self, url):
+        """Run a GET request in a thread of the executor, which has its own connection to the database."""
+        try:
+            return self.run("GET", url, {})
+        finally:
+            connection.close()
+
+
+class ChangeStreamView(APIView):
+    """Stream the changes of the clients, contracts and events the user is shown, as Server-Sent Events.
+
+    Each event is named after the model of the objects and its data is like `{"action": "update", "ids": [1, 2]}`, so
+    that the client only fetches what changed rather than polling the lists. The changes are sent from the moment the
+    stream starts. An event `reset` means that some changes were missed and that everything must be fetched again.
+    A comment is sent every `heartbeat` seconds, so that the proxies keep the connection open. When more than
+    `max_pending` changes wait to be sent, they're dropped and the client is reset."""
+    permission_classes = (IsAuthenticated,)
+    heartbeat = 15
+    max_pending = 1000
+
+    def get(self, request, *args, **kwargs):
+        if getattr(request, "async_streaming", False):
+            # Served by the ASGI handler of the API, the stream doesn't hold a thread.
+            response = AsyncStreamingHttpResponse(self.async_stream(request.user), content_type="text/event-stream")
+        else:
+            response = StreamingHttpResponse(self.stream(request.user), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        # Otherwise nginx buffers the events.
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def stream(self, user):
+        subscription = changes.bus.subscribe(changes.Subscription(self.max_pending))
+        try:
+            # The stream may last for hours, it doesn't keep a connection to the database meanwhile.
+            if not connection.in_atomic_block:
+                connection.close()
+            yield "retry: 3000\n\n"
+            while True:
+                yield from self.get_messages(user, subscription, subscription.get(self.heartbeat))
+        finally:
+            changes.bus.unsubscribe(subscription)
+
+    async def async_stream(self, user):
+        subscription = changes.AsyncSubscription(self.max_pending)
+        # Subscribing waits for the bus to listen the first time.
+        await sync_to_async(changes.bus.subscribe, thread_sensitive=False)(subscription)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                for message in self.get_messages(user, subscription, await subscription.get(self.heartbeat)):
+                    yield message
+        finally:
+            changes.bus.unsubscribe(subscription)
+
+    @staticmethod
+    def get_messages(user, subscription, change):
+        """Return the messages to send for a change, or for None if there was no change."""
+        messages = []
+        if subscription.lost:
+            subscription.lost = False
+            messages.append("event: reset\ndata: {}\n\n")
+        if change is None:
+            messages.append(": heartbeat\n\n")
+        else:
+            ids = changes.get_visible_ids(user, change)
+            if ids:
+                messages.append(f"event: {change['model']}\ndata: "
+                                f"{json.dumps({'action': change['action'], 'ids': ids})}\n\n")
+        return messages
+
+
+class MetricsView(APIView):
+    """Return the metrics of api.metrics, added up over the processes of the server, in the text format of Prometheus.
+
+    The rates, like the ratio of the permissions denied or of the hits of a cache, are computed from the counters by
+    Prometheus."""
+    permission_classes = (CanReadMetrics,)
+
+    def get(self, request, *args, **kwargs):
+        response = HttpResponse(metrics.registry.render(metrics.registry.collect_all()),
+                                content_type="text/plain; version=0.0.4; charset=utf-8")
+        add_never_cache_headers(response)
+        return response
@@ -5,11 +5,9 @@ from django.contrib import admin
 from django.contrib.admin.options import ModelAdmin
 
 
-from api.urls import client_create, client_change, client_list, client_delete
-from api.urls import contract_create, contract_change, contract_list, contract_delete
-
 from .models import Contract, Client
-from accounts.admin import create_view, modification_view, obtain_queryset, delete_view
+from accounts.admin import (ArchivedListFilter, create_view, modification_view, obtain_queryset, delete_view,
+                            delete_queryset_view)
 
 module_logger = logging.getLogger(__name__)
 file_handler = logging.FileHandler('debug.log')
@@ -54,14 +52,16 @@ class ContractChangeForm(forms.ModelForm):
 class ClientAdmin(ModelAdmin):
     form = ClientChangeForm
     add_form = ClientCreationForm
-    list_display = ('first_name', 'last_name', 'email', 'phone_number', 'mobile_number', 'company_name', 'date_created', 'date_updated', 'sales_contact')
+    list_display = ('first_name', 'last_name', 'email', 'phone_number', 'mobile_number', 'company_name', 'date_created', 'date_updated', 'sales_contact',
+                    'contract_count', 'event_count', 'total_amount', 'unpaid_amount')
+    list_select_related = ('sales_contact',)
     search_fields = ('company_name', 'email')
     ordering = ('date_created',)
     filter_horizontal = ()
-    api_views = {"create": client_create,
-                 "change": client_change,
-                 "list": client_list,
-                 "delete": client_delete}
+    api_views = {"create": "client_create",
+                 "change": "client_change",
+                 "list": "client_list",
+                 "delete": "client_delete"}
     data_to_log = ["email", "first_name", "last_name", "sales_contact"]
     logger = module_logger
 
@@ -77,14 +77,19 @@ class ClientAdmin(ModelAdmin):
         """Return the queryset asked by the request."""
         return obtain_queryset(self, request)
 
+    def get_search_results(self, request, queryset, search_term):
+        """Search the clients with the full-text index rather than scanning each field of the table."""
+        if not search_term:
+            return queryset, False
+        return queryset.search(search_term), False
+
     def delete_model(self, request, obj):
         """Delete a Client."""
         delete_view(self, request, obj)
 
     def delete_queryset(self, request, queryset):
-        """Delete a queryset of Clients."""
-        for model in queryset:
-            self.delete_model(request, model)
+        """Delete a queryset of Clients, in the background if there are many of them."""
+        delete_queryset_view(self, request, queryset)
 
     def has_add_permission(self, request):
         if request.user.role in ('gestion', 'sales'):
@@ -117,13 +122,21 @@ class ContractAdmin(ModelAdmin):
     form = ContractChangeForm
     add_form = ContractCreationForm
     list_display = ('sales_contact', 'client', 'date_created', 'date_updated', 'status', 'amount', 'payment_due')
-    search_fields = ('date_created',)
+    list_select_related = ('sales_contact', 'client')
+    search_fields = ('client__company_name', 'client__email')
+    # The lists of clients and contracts grow with the business, so they're searched rather than listed in a select.
+    autocomplete_fields = ('client',)
     ordering = ('date_created',)
+    list_filter = (ArchivedListFilter,)
+    # The archived objects are left out of the list by its filter, but can still be opened.
+    api_list_query = 'include_archived=true'
+    # Counting every object would read the whole archive.
+    show_full_result_count = False
     filter_horizontal = ()
-    api_views = {"create": contract_create,
-                 "change": contract_change,
-                 "list": contract_list,
-                 "delete": contract_delete}
+    api_views = {"create": "contract_create",
+                 "change": "contract_change",
+                 "list": "contract_list",
+                 "delete": "contract_delete"}
     data_to_log = ["client", "sales_contact"]
     logger = module_logger
 
@@ -136,17 +149,22 @@ class ContractAdmin(ModelAdmin):
         return modification_view(self, request, object_id, form_url='', extra_context=None)
 
     def get_queryset(self, request):
-        """Return the queryset asked by the request."""
-        return obtain_queryset(self, request)
+        """Return the queryset asked by the request, with the client and sales contact that __str__ shows."""
+        return obtain_queryset(self, request).select_related('client', 'sales_contact')
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search the contracts by their client, with the full-text index of the clients."""
+        if not search_term:
+            return queryset, False
+        return queryset.filter(client__in=Client.objects.search(search_term).values('pk')), False
 
     def delete_model(self, request, obj):
         """Delete a Contract."""
         delete_view(self, request, obj)
 
     def delete_queryset(self, request, queryset):
-        """Delete a queryset of Contracts."""
-        for model in queryset:
-            self.delete_model(request, model)
+        """Delete a queryset of Contracts, in the background if there are many of them."""
+        delete_queryset_view(self, request, queryset)
 
     def has_add_permission(self, request):
         if request.user.role in ('gestion', 'sales'):
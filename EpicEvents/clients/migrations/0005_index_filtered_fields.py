@@ -0,0 +1,23 @@
+# Generated by Django 3.2.7 on 2026-10-19 16:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0004_alter_contract_client'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='client',
+            name='company_name',
+            field=models.CharField(db_index=True, max_length=250, verbose_name="nom d'entreprise"),
+        ),
+        migrations.AlterField(
+            model_name='contract',
+            name='payment_due',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
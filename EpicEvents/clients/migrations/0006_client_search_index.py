@@ -0,0 +1,21 @@
+# Generated by Django 3.2.7 on 2026-10-19 16:29
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+import django.db.models.expressions
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0005_index_filtered_fields'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.SearchVector('first_name', 'last_name', 'company_name', django.db.models.functions.text.Replace('email', django.db.models.expressions.Value('@'), django.db.models.expressions.Value(' ')), config='simple'), name='client_search_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.7 on 2026-10-19 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0006_client_search_index'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='contract',
+            constraint=models.UniqueConstraint(fields=('id', 'client'), name='contract_id_client_unique'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.7 on 2026-10-19 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0008_payment_reminders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contract',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+        # Django doesn't keep the default in the database, which the rows inserted with SQL, like the imports and the
+        # seed, need.
+        migrations.RunSQL(
+            sql="ALTER TABLE clients_contract ALTER COLUMN archived SET DEFAULT false;",
+            reverse_sql="ALTER TABLE clients_contract ALTER COLUMN archived DROP DEFAULT;",
+        ),
+        migrations.AddIndex(
+            model_name='contract',
+            index=models.Index(condition=models.Q(('archived', False)), fields=['date_created', 'id'], name='contract_recent_idx'),
+        ),
+    ]
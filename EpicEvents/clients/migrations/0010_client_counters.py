@@ -0,0 +1,127 @@
+# Generated by Django 3.2.7 on 2026-10-19 18:22
+
+from django.db import migrations, models
+
+# For each table, the changes of the counters of the clients, summed over the changed rows with a `sign` of 1 for the
+# new rows and -1 for the old ones, the condition for the counters to have changed, and how they're changed by the
+# sums `d`. The amounts are summed as numbers rounded to the cent, see clients.models.RECOUNT_SQL.
+COUNTERS = {
+    'clients_contract': (
+        "sum(sign) AS count, sum(sign * amount::numeric) AS total, "
+        "coalesce(sum(sign * amount::numeric) FILTER (WHERE NOT status), 0) AS unpaid",
+        "count <> 0 OR total <> 0 OR unpaid <> 0",
+        "contract_count = c.contract_count + d.count, total_amount = round(c.total_amount::numeric + d.total, 2), "
+        "unpaid_amount = round(c.unpaid_amount::numeric + d.unpaid, 2)",
+    ),
+    'events_event': (
+        "sum(sign) AS count",
+        "count <> 0",
+        "event_count = c.event_count + d.count",
+    ),
+}
+
+
+def update_counters(table, rows):
+    """Return the statements changing the counters of the clients of the rows, given as (sign, transition table)."""
+    sums, changed, counters = COUNTERS[table]
+    signed_rows = " UNION ALL ".join(f"SELECT {sign} AS sign, * FROM {name}" for sign, name in rows)
+    changes = f"SELECT * FROM (SELECT client_id, {sums} FROM ({signed_rows}) AS r GROUP BY client_id) AS s " \
+              f"WHERE {changed}"
+    # The clients are locked in the order of their ids, so that statements changing the same clients don't deadlock.
+    return f"""
+        PERFORM 1 FROM clients_client WHERE id IN (SELECT client_id FROM ({changes}) AS d) ORDER BY id FOR UPDATE;
+        UPDATE clients_client AS c SET {counters} FROM ({changes}) AS d WHERE c.id = d.client_id;"""
+
+
+def create_triggers():
+    statements = []
+    for table in COUNTERS:
+        statements.append(f"""
+            CREATE FUNCTION {table}_count() RETURNS trigger LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN {update_counters(table, [(1, 'new_rows')])}
+                ELSIF TG_OP = 'UPDATE' THEN {update_counters(table, [(1, 'new_rows'), (-1, 'old_rows')])}
+                ELSE {update_counters(table, [(-1, 'old_rows')])}
+                END IF;
+                RETURN NULL;
+            END $$;""")
+        # The triggers of a table run in the order of their names, these ones after the ones notifying the changes, so
+        # that the changes of the contracts and the events are notified before the ones of their clients.
+        for event, tables in (('INSERT', 'NEW TABLE AS new_rows'),
+                              ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+                              ('DELETE', 'OLD TABLE AS old_rows')):
+            statements.append(f"""
+                CREATE TRIGGER {table}_update_counters_{event.lower()} AFTER {event} ON {table} REFERENCING {tables}
+                FOR EACH STATEMENT EXECUTE FUNCTION {table}_count();""")
+    return statements
+
+
+def drop_triggers():
+    return [f"DROP FUNCTION {table}_count() CASCADE;" for table in COUNTERS]
+
+
+class Migration(migrations.Migration):
+    """Keep the number of contracts and events of the clients, and the amounts of their contracts, on the clients.
+
+    The triggers are per statement, like the ones notifying the changes, so that a statement changing many contracts
+    changes each of their clients once."""
+
+    dependencies = [
+        ('clients', '0009_archived'),
+        ('events', '0006_archived'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='contract_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='event_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='total_amount',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='unpaid_amount',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        # Django doesn't keep the defaults in the database, which the clients inserted with SQL, like the imports and
+        # the seed, need.
+        migrations.RunSQL(
+            sql=[f"ALTER TABLE clients_client ALTER COLUMN {name} SET DEFAULT 0;"
+                 for name in ('event_count', 'contract_count', 'total_amount', 'unpaid_amount')],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(create_triggers(), drop_triggers()),
+        migrations.RunSQL(
+            sql="""
+                UPDATE clients_client AS c
+                SET event_count = coalesce(e.count, 0), contract_count = coalesce(k.count, 0),
+                    total_amount = coalesce(k.total, 0), unpaid_amount = coalesce(k.unpaid, 0)
+                FROM clients_client AS a
+                LEFT JOIN (SELECT client_id, count(*) FROM events_event GROUP BY client_id) AS e
+                    ON e.client_id = a.id
+                LEFT JOIN (SELECT client_id, count(*), round(sum(amount::numeric), 2) AS total,
+                                  round(sum(amount::numeric) FILTER (WHERE NOT status), 2) AS unpaid
+                           FROM clients_contract GROUP BY client_id) AS k
+                    ON k.client_id = a.id
+                WHERE c.id = a.id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['total_amount', 'id'], name='client_total_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['unpaid_amount', 'id'], name='client_unpaid_amount_idx'),
+        ),
+    ]
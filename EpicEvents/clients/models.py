@@ -1,7 +1,78 @@
-from django.db import models
-from django.db.models import Q
+import logging
+import re
+
+from django.apps import apps
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.core import mail
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection, models, transaction
+from django.db.models import F, Func, Q, Value
+from django.db.models.functions import Replace
+from django.utils import timezone
 from phonenumber_field.modelfields import PhoneNumberField
 
+# The 'simple' configuration keeps names as they are instead of stemming them as words of a language.
+# The @ of the email is removed so that its local part and its domain can be searched separately.
+SEARCH_VECTOR = SearchVector('first_name', 'last_name', 'company_name', Replace('email', Value('@'), Value(' ')),
+                             config='simple')
+
+logger = logging.getLogger(__name__)
+
+# The fields of the clients kept by the database from their contracts and events.
+COUNTERS = ('event_count', 'contract_count', 'total_amount', 'unpaid_amount')
+
+
+class ClientQuerySet(models.QuerySet):
+    def search(self, text):
+        """Return the clients having a word starting with each word of the text, the best matches first.
+
+        It uses the full-text index on the names, the company name and the email."""
+        # Dots and dashes are kept so that domains and compound names are parsed as they are in the index.
+        words = [word for word in re.findall(r"[\w.-]+", text.lower()) if re.search(r"[^\W_]", word)]
+        if not words:
+            return self.none()
+        query = SearchQuery(" & ".join(f"{word}:*" for word in words), config='simple', search_type='raw')
+        return self.alias(search=SEARCH_VECTOR).filter(search=query).annotate(
+            rank=SearchRank(SEARCH_VECTOR, query)).order_by('-rank', 'pk')
+
+    def recount(self, batch_size=10000):
+        """Compute the counters of the clients again from their contracts and events, `batch_size` clients per
+        transaction, and return how many clients had wrong counters."""
+        fixed = 0
+        last = 0
+        while True:
+            with transaction.atomic():
+                pks = list(self.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    return fixed
+                with connection.cursor() as cursor:
+                    cursor.execute(RECOUNT_SQL, {'ids': pks})
+                    fixed += cursor.rowcount
+            last = pks[-1]
+
+
+# The counters of the clients, computed like the triggers of the migration 0010 keep them: the amounts are summed as
+# numbers rounded to the cent, so that adding and removing contracts doesn't leave rounding errors.
+RECOUNT_SQL = """
+    UPDATE clients_client AS c
+    SET event_count = n.event_count, contract_count = n.contract_count, total_amount = n.total_amount,
+        unpaid_amount = n.unpaid_amount
+    FROM (
+        SELECT c.id, coalesce(e.count, 0) AS event_count, coalesce(k.count, 0) AS contract_count,
+               coalesce(k.total, 0)::float8 AS total_amount, coalesce(k.unpaid, 0)::float8 AS unpaid_amount
+        FROM clients_client AS c
+        LEFT JOIN (SELECT client_id, count(*) FROM events_event WHERE client_id = ANY(%(ids)s) GROUP BY client_id)
+            AS e ON e.client_id = c.id
+        LEFT JOIN (SELECT client_id, count(*), round(sum(amount::numeric), 2) AS total,
+                          round(sum(amount::numeric) FILTER (WHERE NOT status), 2) AS unpaid
+                   FROM clients_contract WHERE client_id = ANY(%(ids)s) GROUP BY client_id)
+            AS k ON k.client_id = c.id
+        WHERE c.id = ANY(%(ids)s)
+    ) AS n
+    WHERE c.id = n.id AND (c.event_count, c.contract_count, c.total_amount, c.unpaid_amount)
+        IS DISTINCT FROM (n.event_count, n.contract_count, n.total_amount, n.unpaid_amount)"""
+
 
 class Client(models.Model):
     first_name = models.CharField(
@@ -20,15 +91,70 @@ class Client(models.Model):
     mobile_number = PhoneNumberField(null=True)
     company_name = models.CharField(
         verbose_name="nom d'entreprise",
-        max_length=250)
+        max_length=250,
+        db_index=True)
     date_created = models.DateTimeField(auto_now_add=True)
     date_updated = models.DateTimeField(auto_now=True)
     sales_contact = models.ForeignKey('accounts.MyUser', on_delete=models.CASCADE, limit_choices_to={'role': 'sales'}, blank=True,
                                       null=True, related_name="clients")
+    # Kept by the triggers of the migration 0010 whenever the contracts and the events change, see COUNTERS.
+    event_count = models.PositiveIntegerField(default=0, editable=False)
+    contract_count = models.PositiveIntegerField(default=0, editable=False)
+    total_amount = models.FloatField(default=0, editable=False)
+    unpaid_amount = models.FloatField(default=0, editable=False)
+
+    objects = ClientQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(SEARCH_VECTOR, name='client_search_idx'),
+            # The clients are sorted by the amounts, like the ones owing the most first.
+            models.Index(fields=['total_amount', 'id'], name='client_total_amount_idx'),
+            models.Index(fields=['unpaid_amount', 'id'], name='client_unpaid_amount_idx'),
+        ]
 
     def __str__(self):
         return self.company_name
 
+    def save(self, *args, **kwargs):
+        """Save the client without its counters, which may have changed in the database since it was read."""
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in COUNTERS]
+        super().save(*args, **kwargs)
+
+
+class ContractManager(models.Manager):
+    # The number of contracts archived per transaction.
+    archive_batch_size = 5000
+
+    def archive(self, before, batch_size=None, progress=None):
+        """Archive the contracts paid and due before `before`, with their event if it took place before then too, and
+        return how many contracts and events were archived.
+
+        The archived objects are only listed by the API and the admin when they're asked for, and the lists read the
+        others with indexes leaving them out. They're archived in batches, each in its own transaction, so that the rows
+        aren't locked for long and an archival stopped halfway can be run again. The rows being changed meanwhile are
+        left for the next archival. `progress` is called with the number of contracts archived."""
+        Event = apps.get_model('events', 'Event')
+        batch_size = batch_size or self.archive_batch_size
+        contracts = events = 0
+        last = 0
+        while True:
+            with transaction.atomic():
+                pks = list(self.filter(archived=False, status=True, payment_due__lt=before, pk__gt=last)
+                           .exclude(event__date__gte=before).order_by('pk')
+                           .select_for_update(skip_locked=True, of=('self',))
+                           .values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    return contracts, events
+                self.filter(pk__in=pks).update(archived=True)
+                events += Event.objects.filter(contract__in=pks).update(archived=True)
+            contracts += len(pks)
+            last = pks[-1]
+            if progress is not None:
+                progress(contracts)
+
 
 class Contract(models.Model):
     sales_contact = models.ForeignKey('accounts.MyUser', on_delete=models.CASCADE, limit_choices_to={'role': 'sales'}, related_name="contracts")
@@ -37,7 +163,158 @@ class Contract(models.Model):
     date_updated = models.DateTimeField(auto_now=True)
     status = models.BooleanField()
     amount = models.FloatField()
-    payment_due = models.DateTimeField()
+    payment_due = models.DateTimeField(db_index=True)
+    # Closed history, see ContractManager.archive.
+    archived = models.BooleanField(default=False)
+
+    objects = ContractManager()
+
+    class Meta:
+        # Referenced by the foreign key ensuring that the events have the same client as their contract.
+        constraints = [models.UniqueConstraint(fields=['id', 'client'], name='contract_id_client_unique')]
+        indexes = [
+            # The payment reminders scan the unpaid contracts in this order, from where their previous run stopped.
+            models.Index(fields=['payment_due', 'id'], condition=Q(status=False), name='contract_unpaid_due_idx'),
+            # The lists only read the contracts that aren't archived, in the order of the admin.
+            models.Index(fields=['date_created', 'id'], condition=Q(archived=False), name='contract_recent_idx'),
+        ]
 
     def __str__(self):
         return f"{self.client} with {self.sales_contact} {self.date_created.date()}"
+
+
+class ReminderRunManager(models.Manager):
+    # The number of contracts read at once. Each batch rewrites the reminders of the run.
+    batch_size = 10000
+    # The number of contracts listed in an email, the others are only counted.
+    max_listed = 50
+
+    def run(self, now=None, progress=None):
+        """Remind the sales contacts of their unpaid contracts that became due since the previous run, and return the
+        run, or None if another one is running.
+
+        The unpaid contracts are read by due date from where the previous run stopped, with the index on their due
+        date, so that a run only reads the contracts that became due since. Each batch of contracts is recorded in the
+        reminder of its sales contact, with the position reached, before any email is sent: a run stopping halfway
+        carries on where it stopped. Then a single email is sent to each sales contact, and the reminders that
+        couldn't be sent are sent again by the next runs. `progress` is called with the number of contracts read.
+
+        The contracts whose due date is before the position reached, once they're made unpaid or given an earlier due
+        date, aren't reminded of."""
+        now = now or timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(hashtext('clients_reminders'))")
+            if not cursor.fetchone()[0]:
+                return None
+        try:
+            previous = self.order_by('-pk').first()
+            run = self.create(last_payment_due=previous and previous.last_payment_due,
+                              last_contract_id=previous and previous.last_contract_id)
+            while self.remind_batch(run, now):
+                if progress is not None:
+                    progress(run.contracts)
+            Reminder.objects.send_unsent()
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(hashtext('clients_reminders'))")
+        return run
+
+    def remind_batch(self, run, now):
+        """Record the reminders of the next batch of contracts that became due, and return how many there were."""
+        contracts = Contract.objects.filter(status=False, payment_due__lte=now).order_by('payment_due', 'pk')
+        if run.last_contract_id is not None:
+            # The first condition bounds the scan of the index, the others skip the contracts already read.
+            contracts = contracts.filter(
+                Q(payment_due__gt=run.last_payment_due) |
+                Q(payment_due=run.last_payment_due, pk__gt=run.last_contract_id),
+                payment_due__gte=run.last_payment_due)
+        batch = list(contracts.values_list('payment_due', 'pk', 'sales_contact')[:self.batch_size])
+        if not batch:
+            return 0
+        by_sales_contact = {}
+        for payment_due, pk, sales_contact in batch:
+            by_sales_contact.setdefault(sales_contact, []).append(pk)
+        with transaction.atomic():
+            reminders = dict(run.reminders.select_for_update().values_list('sales_contact', 'pk'))
+            for sales_contact, pks in by_sales_contact.items():
+                if sales_contact not in reminders:
+                    Reminder.objects.create(run=run, sales_contact_id=sales_contact, contracts=pks)
+                else:
+                    # Appended by the database, instead of sending the whole array again at each batch.
+                    Reminder.objects.filter(pk=reminders[sales_contact]).update(
+                        contracts=Func(F('contracts'), Value(pks, output_field=ArrayField(models.BigIntegerField())),
+                                       function='array_cat'))
+            run.last_payment_due, run.last_contract_id = batch[-1][:2]
+            run.contracts += len(batch)
+            run.save(update_fields=['last_payment_due', 'last_contract_id', 'contracts'])
+        return len(batch)
+
+
+class ReminderRun(models.Model):
+    """A run of the payment reminders, and how far it read the unpaid contracts by due date."""
+    date = models.DateTimeField(auto_now_add=True)
+    # The last contract read, by due date then primary key. The next run starts after it.
+    last_payment_due = models.DateTimeField(null=True)
+    last_contract_id = models.BigIntegerField(null=True)
+    contracts = models.PositiveIntegerField(default=0)
+
+    objects = ReminderRunManager()
+
+    def __str__(self):
+        return f"Reminders of {self.date}"
+
+
+class ReminderManager(models.Manager):
+    def send_unsent(self):
+        """Send the reminders that weren't sent yet, one email each, and return how many were sent.
+
+        The ones that fail are logged and left for the next run. A reminder is only marked as sent once its email is,
+        so an email may be sent twice if the database fails in between, but never lost."""
+        sent = 0
+        failed = 0
+        with mail.get_connection() as mail_connection:
+            for reminder in self.filter(date_sent__isnull=True).select_related('sales_contact').order_by('pk'):
+                if reminder.sales_contact is None:
+                    reminder.delete()
+                    continue
+                try:
+                    reminder.get_message(mail_connection).send()
+                except Exception:
+                    logger.exception(f"The reminder {reminder.pk} couldn't be sent.")
+                    failed += 1
+                    continue
+                self.filter(pk=reminder.pk).update(date_sent=timezone.now(), email=reminder.sales_contact.email)
+                sent += 1
+        if failed:
+            raise RuntimeError(f"{failed} reminders couldn't be sent, they're sent again by the next run.")
+        return sent
+
+
+class Reminder(models.Model):
+    """The unpaid contracts a sales contact is reminded of by a run, and when the email was sent."""
+    run = models.ForeignKey(ReminderRun, on_delete=models.CASCADE, related_name='reminders')
+    sales_contact = models.ForeignKey('accounts.MyUser', on_delete=models.SET_NULL, null=True,
+                                      related_name='reminders')
+    contracts = ArrayField(models.BigIntegerField(), default=list)
+    # Where and when it was sent, it's waiting to be sent until then.
+    email = models.EmailField(max_length=255, blank=True)
+    date_sent = models.DateTimeField(null=True)
+
+    objects = ReminderManager()
+
+    def __str__(self):
+        return f"{len(self.contracts)} contracts to {self.sales_contact}"
+
+    def get_message(self, mail_connection=None):
+        count = len(self.contracts)
+        contracts = Contract.objects.filter(pk__in=self.contracts[:ReminderRun.objects.max_listed]) \
+            .select_related('client').order_by('payment_due', 'pk')
+        lines = [f"Hello {self.sales_contact.first_name},", "",
+                 f"{count} of your contracts became due without being paid:", ""]
+        lines += [f"- {contract.client.company_name}: {contract.amount:.2f} due on "
+                  f"{timezone.localtime(contract.payment_due):%Y-%m-%d} (contract {contract.pk})"
+                  for contract in contracts]
+        if count > len(contracts):
+            lines.append(f"- and {count - len(contracts)} more, listed by /api/contracts/list/?due=true.")
+        return mail.EmailMessage(subject=f"{count} unpaid contract{'s' if count > 1 else ''} due",
+                                 body="\n".join(lines), to=[self.sales_contact.email], connection=mail_connection)
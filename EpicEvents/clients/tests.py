@@ -1,13 +1,19 @@
 import datetime
+import io
 
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import patch
 
 from django.utils.timezone import make_aware
 
 import clients.admin
 from accounts.models import MyUser
-from .models import Client, Contract
+from events.models import Event
+from .models import COUNTERS, Client, Contract, Reminder, ReminderRun
 
 default_password = "correcthorsebatterystaple"
 
@@ -380,3 +386,196 @@ class ClientsTest(TestCase):
         assert resp.status_code == 302
         assert len(Contract.objects.all()) == number_of_objects
         assert resp.url == f"/admin/login/?next={resp.request['PATH_INFO']}"
+
+    def test_lists_render_in_a_constant_number_of_queries(self):
+        self.client.login(**self.gestion_logs)
+        for model in ("client", "contract"):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(f"/admin/clients/{model}/")
+            setattr(self, f"{model}_queries", len(queries))
+        for i in range(20):
+            client = Client.objects.create(first_name="client_test", last_name=str(i + 5),
+                                           email=f"client_test_{i + 5}@gmail.com", phone_number="+33666666666",
+                                           company_name=f"test_{i + 5}", sales_contact=self.sales_user_1)
+            Contract.objects.create(sales_contact=self.sales_user_1, client=client, status=False, amount=320.54,
+                                    payment_due=make_aware(datetime.datetime.now()))
+        for model in ("client", "contract"):
+            with self.assertNumQueries(getattr(self, f"{model}_queries")):
+                resp = self.client.get(f"/admin/clients/{model}/")
+            assert resp.status_code == 200
+
+
+class ReminderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sales_user_1 = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                      email="thomas@gmail.com", password=default_password)
+        cls.sales_user_2 = MyUser.objects.create_user(first_name="Thomas_2", last_name="Bravo", role="sales",
+                                                      email="thomas_2@gmail.com", password=default_password)
+        cls.client1 = Client.objects.create(first_name="client_test", last_name="1", email="client_test_1@gmail.com",
+                                            phone_number="+33666666666", company_name="test_1",
+                                            sales_contact=cls.sales_user_1)
+        cls.now = make_aware(datetime.datetime(2021, 10, 1, 12))
+
+    def add_contract(self, sales_contact, days, status=False):
+        return Contract.objects.create(sales_contact=sales_contact, client=self.client1, status=status, amount=320.54,
+                                       payment_due=self.now + datetime.timedelta(days=days))
+
+    def test_each_sales_contact_is_sent_their_due_unpaid_contracts_once(self):
+        due_1 = [self.add_contract(self.sales_user_1, -2), self.add_contract(self.sales_user_1, -1)]
+        due_2 = self.add_contract(self.sales_user_2, -1)
+        self.add_contract(self.sales_user_1, -1, status=True)
+        later = self.add_contract(self.sales_user_1, 1)
+        run = ReminderRun.objects.run(now=self.now)
+        assert (run.contracts, run.last_contract_id) == (3, due_2.pk)
+        assert sorted((message.to[0], message.subject) for message in mail.outbox) == [
+            ("thomas@gmail.com", "2 unpaid contracts due"), ("thomas_2@gmail.com", "1 unpaid contract due")]
+        reminder = Reminder.objects.get(sales_contact=self.sales_user_1)
+        assert reminder.contracts == [contract.pk for contract in due_1]
+        assert (reminder.email, reminder.date_sent is not None) == ("thomas@gmail.com", True)
+        assert f"test_1: 320.54 due on 2021-09-29 (contract {due_1[0].pk})" in mail.outbox[0].body
+
+        mail.outbox = []
+        run = ReminderRun.objects.run(now=self.now)
+        assert (run.contracts, mail.outbox) == (0, [])
+        run = ReminderRun.objects.run(now=self.now + datetime.timedelta(days=2))
+        assert run.contracts == 1
+        assert (mail.outbox[0].to, Reminder.objects.get(run=run).contracts) == (["thomas@gmail.com"], [later.pk])
+
+    def test_a_run_reads_the_contracts_in_batches(self):
+        contracts = [self.add_contract(self.sales_user_1, -1) for _ in range(5)]
+        progress = []
+        with patch.object(ReminderRun.objects, "batch_size", 2), patch.object(ReminderRun.objects, "max_listed", 3):
+            run = ReminderRun.objects.run(now=self.now, progress=progress.append)
+        assert (run.contracts, progress) == (5, [2, 4, 5])
+        assert Reminder.objects.get().contracts == [contract.pk for contract in contracts]
+        assert len(mail.outbox) == 1
+        assert "- and 2 more" in mail.outbox[0].body
+
+    def test_the_reminders_not_sent_are_sent_by_the_next_run(self):
+        self.add_contract(self.sales_user_1, -1)
+        with patch("django.core.mail.EmailMessage.send", side_effect=OSError), \
+                self.assertLogs("clients.models", "ERROR"), self.assertRaises(RuntimeError):
+            ReminderRun.objects.run(now=self.now)
+        reminder = Reminder.objects.get()
+        assert (reminder.date_sent, mail.outbox) == (None, [])
+        run = ReminderRun.objects.run(now=self.now)
+        assert run.contracts == 0
+        reminder.refresh_from_db()
+        assert reminder.date_sent is not None
+        assert len(mail.outbox) == 1
+
+
+@patch.object(clients.admin.file_handler, 'stream', open('debug_test.log', 'a'))
+class ArchiveTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.gestion_logs = {"email": "corentin@gmail.com", "password": default_password}
+        MyUser.objects.create_user(first_name="Corentin", last_name="Bravo", role="gestion", email="corentin@gmail.com",
+                                   password=default_password)
+        cls.sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                    email="thomas@gmail.com", password=default_password)
+        cls.support_user = MyUser.objects.create_user(first_name="Timothée", last_name="Bravo", role="support",
+                                                      email="timothee@gmail.com", password=default_password)
+        cls.client1 = Client.objects.create(first_name="client_test", last_name="1", email="client_test_1@gmail.com",
+                                            phone_number="+33666666666", company_name="test_1",
+                                            sales_contact=cls.sales_user)
+        cls.before = make_aware(datetime.datetime(2021, 1, 1))
+        old, recent = cls.before - datetime.timedelta(days=30), cls.before + datetime.timedelta(days=30)
+        cls.closed = [cls.add_contract(True, old, old), cls.add_contract(True, old, old), cls.add_contract(True, old)]
+        # Unpaid, due after the date, or whose event took place after it.
+        cls.open = [cls.add_contract(False, old), cls.add_contract(True, recent), cls.add_contract(True, old, recent)]
+
+    @classmethod
+    def add_contract(cls, status, payment_due, event_date=None):
+        contract = Contract.objects.create(sales_contact=cls.sales_user, client=cls.client1, status=status,
+                                           amount=320.54, payment_due=payment_due)
+        if event_date is not None:
+            Event.objects.create(client=cls.client1, support=cls.support_user, contract=contract, attendees=10,
+                                 date=event_date)
+        return contract
+
+    def test_closed_contracts_are_archived_with_their_event_in_batches(self):
+        progress = []
+        assert Contract.objects.archive(self.before, batch_size=2, progress=progress.append) == (3, 2)
+        assert progress == [2, 3]
+        assert set(Contract.objects.filter(archived=True)) == set(self.closed)
+        assert set(Event.objects.filter(archived=True)) == {contract.event for contract in self.closed[:2]}
+        assert Contract.objects.archive(self.before) == (0, 0)
+
+    def test_the_command_archives_before_the_date(self):
+        out = io.StringIO()
+        call_command("archive", "--before", "2021-01-01", stdout=out)
+        assert "Archived 3 contracts and 2 events from before 2021-01-01." in out.getvalue()
+
+    def test_the_admin_lists_the_archived_contracts_on_demand(self):
+        Contract.objects.archive(self.before)
+        self.client.login(**self.gestion_logs)
+        for params, expected in (({}, self.open), ({"archived": "yes"}, self.closed),
+                                 ({"archived": "all"}, self.open + self.closed)):
+            resp = self.client.get("/admin/clients/contract/", params)
+            assert resp.status_code == 200
+            assert set(resp.context["cl"].result_list) == set(expected)
+        resp = self.client.get(f"/admin/clients/contract/{self.closed[0].pk}/change/")
+        assert resp.status_code == 200
+
+
+class ClientCountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sales_user = MyUser.objects.create_user(first_name="Thomas", last_name="Bravo", role="sales",
+                                                    email="thomas@gmail.com", password=default_password)
+        cls.support_user = MyUser.objects.create_user(first_name="Timothée", last_name="Bravo", role="support",
+                                                      email="timothee@gmail.com", password=default_password)
+        cls.client1, cls.client2 = [
+            Client.objects.create(first_name="client_test", last_name=str(i), email=f"client_test_{i}@gmail.com",
+                                  phone_number="+33666666666", company_name=f"test_{i}", sales_contact=cls.sales_user)
+            for i in (1, 2)]
+
+    def add_contract(self, client, status, amount, event=False):
+        contract = Contract.objects.create(sales_contact=self.sales_user, client=client, status=status, amount=amount,
+                                           payment_due=make_aware(datetime.datetime(2021, 10, 1)))
+        if event:
+            Event.objects.create(client=client, support=self.support_user, contract=contract, attendees=10,
+                                 date=contract.payment_due)
+        return contract
+
+    def get_counters(self, client):
+        return Client.objects.filter(pk=client.pk).values_list(*COUNTERS).get()
+
+    def test_the_counters_follow_the_contracts_and_events(self):
+        paid = self.add_contract(self.client1, True, 0.1, event=True)
+        unpaid = self.add_contract(self.client1, False, 0.2)
+        assert self.get_counters(self.client1) == (1, 2, 0.3, 0.2)
+        unpaid.status = True
+        unpaid.save()
+        assert self.get_counters(self.client1) == (1, 2, 0.3, 0)
+        Contract.objects.filter(pk=unpaid.pk).update(status=False, amount=10.25)
+        assert self.get_counters(self.client1) == (1, 2, 10.35, 10.25)
+        # The event follows the client of its contract.
+        Contract.objects.filter(pk=paid.pk).update(client=self.client2)
+        assert self.get_counters(self.client1) == (0, 1, 10.25, 10.25)
+        assert self.get_counters(self.client2) == (1, 1, 0.1, 0)
+        paid.event.delete()
+        unpaid.delete()
+        assert self.get_counters(self.client1) == (0, 0, 0, 0)
+        assert self.get_counters(self.client2) == (0, 1, 0.1, 0)
+        assert Client.objects.recount() == 0
+
+    def test_saving_a_client_keeps_its_counters(self):
+        client = Client.objects.get(pk=self.client1.pk)
+        self.add_contract(self.client1, False, 100, event=True)
+        client.company_name = "test_3"
+        client.save()
+        assert self.get_counters(client) == (1, 1, 100, 100)
+        assert Client.objects.get(pk=client.pk).company_name == "test_3"
+
+    def test_wrong_counters_are_recounted(self):
+        self.add_contract(self.client1, False, 100, event=True)
+        self.add_contract(self.client2, True, 50)
+        Client.objects.update(event_count=5, total_amount=0)
+        out = io.StringIO()
+        call_command("recount", "--batch-size", "1", stdout=out)
+        assert out.getvalue() == "Fixed the counters of 2 clients.\n"
+        assert self.get_counters(self.client1) == (1, 1, 100, 100)
+        assert self.get_counters(self.client2) == (0, 1, 50, 0)
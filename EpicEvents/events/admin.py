@@ -3,12 +3,10 @@ import logging
 from django import forms
 from django.contrib import admin
 from django.contrib.admin.options import ModelAdmin
-from django.core.exceptions import ValidationError
-
-from api.urls import event_create, event_change, event_list, event_delete
 
 from .models import Event
-from accounts.admin import create_view, modification_view, obtain_queryset, delete_view
+from accounts.admin import (ArchivedListFilter, create_view, modification_view, obtain_queryset, delete_view,
+                            delete_queryset_view)
 
 module_logger = logging.getLogger(__name__)
 file_handler = logging.FileHandler('debug.log')
@@ -24,16 +22,6 @@ class EventCreationForm(forms.ModelForm):
         model = Event
         fields = ('client', 'support', 'contract', 'attendees', 'date', 'notes')
 
-    def clean(self):
-        """Clean the data of the form and ensure that the client and the client in the contract are the same."""
-        cleaned_data = super().clean()
-        client = cleaned_data.get('client')
-        contract_client = getattr(cleaned_data.get("contract"), "client")
-
-        if client and contract_client:
-            if client != contract_client:
-                raise ValidationError("The client for the event and the client on the contract must be the same.")
-
 
 class EventChangeForm(forms.ModelForm):
     """A form for updating events."""
@@ -42,29 +30,28 @@ class EventChangeForm(forms.ModelForm):
         model = Event
         fields = ('client', 'support', 'contract', 'attendees', 'date', 'notes')
 
-    def clean(self):
-        """Clean the data of the form and ensure that the client and the client in the contract are the same."""
-        cleaned_data = super().clean()
-        client = cleaned_data.get('client')
-        contract_client = getattr(cleaned_data.get("contract"), "client")
-
-        if client and contract_client:
-            if client != contract_client:
-                raise ValidationError("The client for the event and the client on the contract must be the same.")
-
 
 @admin.register(Event)
 class EventAdmin(ModelAdmin):
     form = EventChangeForm
     add_form = EventCreationForm
     list_display = ('client', 'date_created', 'date_updated', 'support', 'contract', 'attendees', 'date', 'notes', 'status')
+    # Everything list_display shows, including the __str__ of the contracts, is fetched with the events.
+    list_select_related = ('client', 'support', 'contract__client', 'contract__sales_contact')
+    # The lists of clients and contracts grow with the business, so they're searched rather than listed in a select.
+    autocomplete_fields = ('client', 'contract')
     search_fields = ('date_created',)
     ordering = ('date_created',)
+    list_filter = (ArchivedListFilter,)
+    # The archived objects are left out of the list by its filter, but can still be opened.
+    api_list_query = 'include_archived=true'
+    # Counting every object would read the whole archive.
+    show_full_result_count = False
     filter_horizontal = ()
-    api_views = {"create": event_create,
-                 "change": event_change,
-                 "list": event_list,
-                 "delete": event_delete}
+    api_views = {"create": "event_create",
+                 "change": "event_change",
+                 "list": "event_list",
+                 "delete": "event_delete"}
     data_to_log = ["client", "contract"]
     logger = module_logger
 
@@ -77,17 +64,20 @@ class EventAdmin(ModelAdmin):
         return modification_view(self, request, object_id, form_url='', extra_context=None)
 
     def get_queryset(self, request):
-        """Return the queryset asked by the request."""
-        return obtain_queryset(self, request)
+        """Return the queryset asked by the request, with the status of the events."""
+        return obtain_queryset(self, request).with_status()
+
+    @admin.display(ordering='contract_status')
+    def status(self, obj):
+        return obj.status
 
     def delete_model(self, request, obj):
         """Delete an Event."""
         delete_view(self, request, obj)
 
     def delete_queryset(self, request, queryset):
-        """Delete a queryset of Events."""
-        for model in queryset:
-            self.delete_model(request, model)
+        """Delete a queryset of Events, in the background if there are many of them."""
+        delete_queryset_view(self, request, queryset)
 
     def has_add_permission(self, request):
         if request.user.role in ('gestion', 'sales'):
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0007_contract_id_client_unique'),
+        ('events', '0004_alter_event_notes'),
+    ]
+
+    operations = [
+        # Events created before the constraint may have another client than their contract, the contract prevails.
+        migrations.RunSQL(
+            sql="""
+                UPDATE events_event SET client_id = clients_contract.client_id
+                FROM clients_contract
+                WHERE clients_contract.id = events_event.contract_id
+                AND clients_contract.client_id <> events_event.client_id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        # Django has no composite foreign keys. This one isn't deferred, so that the error is raised by the query that
+        # breaks it and can be reported to the user.
+        migrations.RunSQL(
+            sql="""
+                ALTER TABLE events_event ADD CONSTRAINT event_client_matches_contract
+                FOREIGN KEY (contract_id, client_id) REFERENCES clients_contract (id, client_id)
+                ON UPDATE CASCADE;
+            """,
+            reverse_sql="ALTER TABLE events_event DROP CONSTRAINT event_client_matches_contract;",
+        ),
+    ]
@@ -1,4 +1,15 @@
 from django.db import models
+from django.db.models import F, Q
+
+# The foreign key on (contract, client) created by the migration 0005, ensuring that the client of an event is the one
+# of its contract. Changing the client of a contract changes the client of its event too.
+CLIENT_CONSTRAINT = 'event_client_matches_contract'
+
+
+class EventQuerySet(models.QuerySet):
+    def with_status(self):
+        """Annotate the events with the status of their contract, so that the contracts don't need to be fetched."""
+        return self.annotate(contract_status=F('contract__status'))
 
 
 class Event(models.Model):
@@ -10,10 +21,22 @@ class Event(models.Model):
     attendees = models.PositiveIntegerField()
     date = models.DateTimeField()
     notes = models.TextField(blank=True, null=True)
+    # Archived with its contract, see clients.models.ContractManager.archive.
+    archived = models.BooleanField(default=False)
+
+    objects = EventQuerySet.as_manager()
+
+    class Meta:
+        # The lists only read the events that aren't archived, in the order of the admin.
+        indexes = [models.Index(fields=['date_created', 'id'], condition=Q(archived=False), name='event_recent_idx')]
 
     @property
     def status(self):
-        return self.contract.status
+        """Return the status of the contract, from the annotation of `EventQuerySet.with_status` if there is one."""
+        try:
+            return self.contract_status
+        except AttributeError:
+            return self.contract.status
 
     def __str__(self):
         return f"{self.client} {self.date.date()}"
@@ -1,11 +1,14 @@
 import datetime
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import patch
 
 from django.utils.timezone import make_aware
 
 import events.admin
+from api.serializers import EventSerializer
 from accounts.models import MyUser
 from clients.models import Client, Contract
 from .models import Event
@@ -249,3 +252,82 @@ class EventsTest(TestCase):
         resp = self.client.post(f"/admin/events/event/{self.event2.pk}/delete/", {"post": "yes"})
         assert resp.status_code == 403
         assert len(Event.objects.all()) == number_of_events
+
+    def test_event_list_renders_in_a_constant_number_of_queries(self):
+        self.client.login(**self.gestion_logs)
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get("/admin/events/event/")
+        number_of_queries = len(queries)
+        for i in range(20):
+            contract = Contract.objects.create(sales_contact=self.sales_user_1, client=self.client2, status=False,
+                                               amount=320.54, payment_due=make_aware(datetime.datetime.now()))
+            Event.objects.create(client=self.client2, support=self.support_user1, contract=contract, attendees=10,
+                                 date=make_aware(datetime.datetime.now()), notes="")
+        with self.assertNumQueries(number_of_queries):
+            resp = self.client.get("/admin/events/event/")
+        assert resp.status_code == 200
+        assert len(resp.context["cl"].result_list) == 22
+
+    def test_status_is_annotated(self):
+        event = Event.objects.with_status().get(pk=self.event1.pk)
+        with self.assertNumQueries(0):
+            assert event.status is False
+        assert Event.objects.get(pk=self.event1.pk).status is False
+
+    def test_forms_render_in_a_constant_number_of_queries(self):
+        self.client.login(**self.gestion_logs)
+        self.client.get("/admin/events/event/add/")  # The first request after the login also updates the session.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/admin/events/event/add/")
+        number_of_queries = len(queries)
+        for i in range(20):
+            Contract.objects.create(sales_contact=self.sales_user_1, client=self.client2, status=False, amount=320.54,
+                                    payment_due=make_aware(datetime.datetime.now()))
+        with self.assertNumQueries(number_of_queries):
+            resp = self.client.get("/admin/events/event/add/")
+        assert resp.status_code == 200
+
+    def test_contracts_and_clients_can_be_searched_from_the_forms(self):
+        for logs in (self.gestion_logs, self.sales_logs, self.support_logs):
+            self.client.login(**logs)
+            resp = self.client.get("/admin/autocomplete/", {"app_label": "events", "model_name": "event",
+                                                            "field_name": "contract", "term": "test_2"})
+            assert resp.status_code == 200
+            assert {result["id"] for result in resp.json()["results"]} == \
+                {str(contract.pk) for contract in (self.contract1, self.contract2, self.contract3)}
+            resp = self.client.get("/admin/autocomplete/", {"app_label": "events", "model_name": "event",
+                                                            "field_name": "client", "term": "test"})
+            assert resp.status_code == 200
+            assert {result["id"] for result in resp.json()["results"]} == {str(self.client1.pk), str(self.client2.pk)}
+
+    def test_contract_search_follows_the_limits_of_the_field(self):
+        self.client.login(**self.gestion_logs)
+        resp = self.client.get("/admin/autocomplete/", {"app_label": "clients", "model_name": "contract",
+                                                        "field_name": "client", "term": "test"})
+        assert resp.status_code == 200
+        # The first client has no sales contact, so it can't have a contract.
+        assert [result["id"] for result in resp.json()["results"]] == [str(self.client2.pk)]
+
+    def test_event_with_another_client_than_its_contract_is_rejected(self):
+        self.client.login(**self.gestion_logs)
+        number_of_events = len(Event.objects.all())
+        resp = self.client.post("/admin/events/event/add/", self.event_additional_data_1)
+        assert resp.status_code == 200
+        assert "The client must be the same for the event and the contract!" in resp.content.decode()
+        assert len(Event.objects.all()) == number_of_events
+
+    def test_client_of_the_contract_is_not_fetched_to_validate_an_event(self):
+        serializer = EventSerializer(self.event1, data={"client": self.client2.pk, "contract": self.contract1.pk},
+                                     partial=True)
+        # The client, the contract, and the check that the contract has no other event.
+        with self.assertNumQueries(3):
+            assert serializer.is_valid()
+        serializer = EventSerializer(self.event1, data={"notes": "note"}, partial=True)
+        assert serializer.is_valid()
+        serializer.save()
+        assert Event.objects.get(pk=self.event1.pk).notes == "note"
+
+    def test_changing_the_client_of_a_contract_changes_the_client_of_its_event(self):
+        self.contract1.client = self.client1
+        self.contract1.save()
+        assert Event.objects.get(pk=self.event1.pk).client == self.client1